@@ -0,0 +1,92 @@
+#!/usr/bin/python
+#
+# Compare extracting a few attributes from stored accounting packets by
+# decoding every packet into an AcctPacket with DecodeBatch, which
+# returns one NumPy column per attribute. Requires numpy.
+
+from io import StringIO
+import struct
+import timeit
+
+from pyrad.batch import DecodeBatch
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AcctPacket
+
+PACKETS = 20000
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  NAS-IP-Address       4   ipaddr
+ATTRIBUTE  NAS-Port             5   integer
+ATTRIBUTE  Framed-IP-Address    8   ipaddr
+ATTRIBUTE  Class                25  octets
+ATTRIBUTE  Called-Station-Id    30  string
+ATTRIBUTE  Acct-Status-Type     40  integer
+ATTRIBUTE  Acct-Input-Octets    42  integer
+ATTRIBUTE  Acct-Output-Octets   43  integer
+ATTRIBUTE  Acct-Session-Id      44  string
+ATTRIBUTE  Acct-Session-Time    46  integer
+ATTRIBUTE  Event-Timestamp      55  date
+VENDOR     Simplon              16
+BEGIN-VENDOR Simplon
+ATTRIBUTE  Simplon-Number       1   integer
+END-VENDOR Simplon
+"""
+
+NAMES = ['User-Name', 'Framed-IP-Address', 'Acct-Input-Octets',
+         'Acct-Output-Octets', 'Acct-Session-Time', 'Event-Timestamp',
+         'Simplon-Number']
+
+
+def Attribute(code, value):
+    return struct.pack('!BB', code, len(value) + 2) + value
+
+
+def BuildPacket(i):
+    attrs = b''.join([
+        Attribute(1, b'user-%06d@example.com' % i),
+        Attribute(4, b'\xc0\xa8\x00\x01'),
+        Attribute(5, struct.pack('!L', i)),
+        Attribute(8, struct.pack('!L', 0x0a000000 + i)),
+        Attribute(25, b'class-%06d' % i),
+        Attribute(30, b'00-11-22-33-44-55:ssid'),
+        Attribute(40, struct.pack('!L', 3)),
+        Attribute(42, struct.pack('!L', i * 100)),
+        Attribute(43, struct.pack('!L', i * 200)),
+        Attribute(44, b'%016x' % i),
+        Attribute(46, struct.pack('!L', i)),
+        Attribute(55, struct.pack('!L', 1700000000 + i)),
+        Attribute(26, struct.pack('!LBBL', 16, 1, 6, i)),
+    ])
+    return struct.pack('!BBH', 4, i % 256, 20 + len(attrs)) + \
+        16 * b'\x00' + attrs
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    raws = [BuildPacket(i) for i in range(PACKETS)]
+
+    def PerPacket():
+        rows = []
+        for raw in raws:
+            pkt = AcctPacket(packet=raw, dict=dictionary)
+            rows.append([pkt[name][0] if name in pkt else None
+                         for name in NAMES])
+        return rows
+
+    def Batch():
+        return DecodeBatch(dictionary, raws, NAMES)
+
+    rows = PerPacket()
+    columns = Batch()
+    assert [row[2] for row in rows] == columns['Acct-Input-Octets'].tolist()
+
+    print('%d packets, %d attributes' % (PACKETS, len(NAMES)))
+    for (name, func) in (('AcctPacket', PerPacket), ('DecodeBatch', Batch)):
+        best = min(timeit.repeat(func, number=1, repeat=3))
+        print('%-12s %8.1fms %8.2fus/packet' % (name, best * 1e3,
+                                                best / PACKETS * 1e6))
+
+
+if __name__ == '__main__':
+    main()
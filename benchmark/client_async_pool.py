@@ -0,0 +1,85 @@
+#!/usr/bin/python
+#
+# Send a burst of requests through ClientAsync to a local responder that
+# answers after a fixed latency, and compare a single source socket with
+# a pool of sockets per port.
+#
+# With one socket at most 256 requests can be outstanding, so throughput
+# is capped at 256 requests per round trip. The identifier pool keeps
+# 256 requests in flight per socket.
+
+import asyncio
+import socket
+import time
+from io import StringIO
+
+from pyrad.client_async import ClientAsync
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AccessAccept, AuthPacket
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+"""
+SECRET = b'secret'
+REQUESTS = 4096
+LATENCY = 0.05
+
+
+class Responder(asyncio.DatagramProtocol):
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+    def datagram_received(self, data, addr):
+        request = AuthPacket(packet=data, secret=SECRET, dict=self.dictionary)
+        reply = request.CreateReply()
+        reply.code = AccessAccept
+        asyncio.get_running_loop().call_later(
+            LATENCY, self.transport.sendto, reply.ReplyPacket(), addr)
+
+
+async def Burst(client, count, window):
+    done = 0
+    while done < count:
+        futures = []
+        for _ in range(min(window, count - done)):
+            pkt = client.CreateAuthPacket(User_Name='user')
+            futures.append(client.SendPacket(pkt))
+        await asyncio.gather(*futures)
+        done += len(futures)
+
+
+async def Run(dictionary, sockets):
+    loop = asyncio.get_running_loop()
+    (transport, _) = await loop.create_datagram_endpoint(
+        lambda: Responder(dictionary), local_addr=('127.0.0.1', 0))
+    port = transport.get_extra_info('sockname')[1]
+
+    client = ClientAsync('127.0.0.1', auth_port=port, secret=SECRET,
+                         dict=dictionary, timeout=5,
+                         sockets_per_port=sockets)
+    await client.initialize_transports(enable_auth=True)
+    window = 256 * sockets
+    start = time.perf_counter()
+    await Burst(client, REQUESTS, window)
+    elapsed = time.perf_counter() - start
+    await client.deinitialize_transports()
+    transport.close()
+    return elapsed
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    print('%8s %10s %12s' % ('sockets', 'window', 'requests/s'))
+    for sockets in (1, 2, 4, 8):
+        elapsed = asyncio.run(Run(dictionary, sockets))
+        print('%8d %10d %12.0f' % (sockets, 256 * sockets,
+                                   REQUESTS / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#
+# Keep tens of thousands of requests in flight on a ClientAsync protocol
+# whose transport drops everything, and measure how long the
+# retransmission scheduler needs to retry and expire all of them.
+
+import asyncio
+import logging
+import time
+
+from pyrad.client_async import DatagramProtocolClient
+
+TIMEOUT = 0.2
+RETRIES = 2
+
+
+class BlackHole:
+    sent = 0
+
+    def sendto(self, data, addr=None):
+        self.sent += 1
+
+
+class StubPacket:
+    def __init__(self, id):
+        self.id = id
+
+    def RequestPacket(self):
+        return b''
+
+
+class StubClient:
+    def __init__(self, loop):
+        self.loop = loop
+
+
+async def Run(count):
+    loop = asyncio.get_running_loop()
+    logger = logging.getLogger('benchmark')
+    transport = BlackHole()
+    protocols = []
+    futures = []
+    # Packet ids are a single octet, so spread requests over protocols.
+    for _ in range(count // 256):
+        protocol = DatagramProtocolClient('127.0.0.1', 1812, logger,
+                                          StubClient(loop), retries=RETRIES,
+                                          timeout=TIMEOUT)
+        protocol.transport = transport
+        protocols.append(protocol)
+
+    start = time.perf_counter()
+    for protocol in protocols:
+        for id in range(256):
+            future = loop.create_future()
+            protocol.send_packet(StubPacket(id), future)
+            futures.append(future)
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    assert all(isinstance(result, TimeoutError) for result in results)
+    assert transport.sent == len(futures) * (RETRIES + 1)
+    idle = TIMEOUT * (RETRIES + 1)
+    return (elapsed, elapsed - idle)
+
+
+def main():
+    print('%10s %12s %16s' % ('requests', 'total s', 'scheduler us/req'))
+    for count in (2560, 10240, 40960):
+        (elapsed, overhead) = asyncio.run(Run(count))
+        print('%10d %12.3f %16.2f' % (count, elapsed,
+                                      max(overhead, 0) / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+#
+# Replay accounting requests against a local responder that answers after
+# a fixed latency, once with stop-and-wait Client.SendPacket and once with
+# the pipelined Client.SendPackets.
+
+import socket
+import threading
+import time
+from io import StringIO
+
+from pyrad.client import Client
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AccountingResponse, AcctPacket
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  Acct-Status-Type     40  integer
+"""
+SECRET = b'secret'
+LATENCY = 0.002
+REQUESTS = 1000
+
+
+def Responder(sock, dictionary):
+    pending = []
+    sock.settimeout(LATENCY)
+    while True:
+        try:
+            (data, addr) = sock.recvfrom(4096)
+            pending.append((time.monotonic() + LATENCY, data, addr))
+        except socket.timeout:
+            pass
+        except OSError:
+            return
+        now = time.monotonic()
+        while pending and pending[0][0] <= now:
+            (_, data, addr) = pending.pop(0)
+            if data == b'stop':
+                return
+            request = AcctPacket(packet=data, secret=SECRET, dict=dictionary)
+            reply = request.CreateReply()
+            reply.code = AccountingResponse
+            sock.sendto(reply.ReplyPacket(), addr)
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    thread = threading.Thread(target=Responder, args=(sock, dictionary))
+    thread.start()
+
+    client = Client('127.0.0.1', acctport=port, secret=SECRET,
+                    dict=dictionary)
+
+    def Packets():
+        return [client.CreateAcctPacket(User_Name='user', Acct_Status_Type=1)
+                for _ in range(REQUESTS)]
+
+    print('%-22s %12s' % ('method', 'requests/s'))
+    packets = Packets()
+    start = time.perf_counter()
+    for pkt in packets:
+        client.SendPacket(pkt)
+    elapsed = time.perf_counter() - start
+    print('%-22s %12.0f' % ('SendPacket', REQUESTS / elapsed))
+
+    for window in (16, 64, 256):
+        packets = Packets()
+        start = time.perf_counter()
+        replies = sum(1 for (pkt, reply) in
+                      client.SendPackets(packets, window=window)
+                      if reply is not None)
+        elapsed = time.perf_counter() - start
+        assert replies == REQUESTS
+        print('%-22s %12.0f' % ('SendPackets(window=%d)' % window,
+                                REQUESTS / elapsed))
+
+    sock.sendto(b'stop', ('127.0.0.1', port))
+    thread.join()
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# Compare the per-attribute compiled codecs with the previous string
+# dispatch in tools.EncodeAttr/DecodeAttr.
+#
+# The old dispatch compared the datatype against every known type name
+# in turn, so its cost grew with the position of the type in the chain.
+# The legacy functions below reproduce that lookup order.
+
+import timeit
+
+from pyrad import tools
+from pyrad.bidict import BiDict
+from pyrad.dictionary import Attribute
+
+SAMPLES = [
+    ('string', 'user@example.com'),
+    ('octets', b'\x01\x02\x03\x04'),
+    ('integer', 1234),
+    ('uint32', 1234),
+    ('ipaddr', '192.168.0.1'),
+    ('ipv6addr', '2001:db8::1'),
+    ('signed', -5),
+    ('short', 5),
+    ('byte', 5),
+    ('date', 1234),
+    ('integer64', 1234),
+    ('combo-ip', '192.168.0.1'),
+    ('ether', '00:11:22:33:44:55'),
+    ('ifid', '0:0:0:0:0:0:0:1'),
+    ('vsa', tools.Vsa(26, 12, 16, [tools.Tlv(1, 6, 5)])),
+    ('float32', 1.5),
+    ('int64', 1234),
+    ('uint8', '5'),
+    ('uint64', 1234),
+    ('bool', True),
+    ('tlv', tools.Tlv(1, 6, 5)),
+    ('uint16', '5'),
+    ('long-extended', tools.LongExtended(245, 7, 1, False, b'abc')),
+    ('extended', tools.Extended(241, 7, 1, 5)),
+    ('evs', tools.Evs(16, 1, 5)),
+]
+
+LEGACY_ORDER = [
+    'string', 'octets', 'integer', 'uint32', 'ipaddr', 'ipv6prefix',
+    'ipv6addr', 'abinary', 'signed', 'short', 'byte', 'date', 'integer64',
+    'combo-ip', 'ipv4prefix', 'ether', 'ifid', 'vsa', 'float32', 'int64',
+    'uint8', 'uint64', 'bool', 'tlv', 'uint16', 'long-extended', 'extended',
+    'evs',
+]
+
+LEGACY_ENCODERS = [(name, tools.ENCODERS[name]) for name in LEGACY_ORDER]
+LEGACY_DECODERS = [(name, tools.DECODERS[name]) for name in LEGACY_ORDER]
+
+
+def LegacyEncodeAttr(datatype, value, attrcodes=None):
+    for (name, encoder) in LEGACY_ENCODERS:
+        if datatype == name:
+            if name in tools.STRUCTURED_TYPES:
+                return encoder(value, attrcodes)
+            return encoder(value)
+    raise ValueError('Unknown attribute type %s' % datatype)
+
+
+def LegacyDecodeAttr(datatype, value, attrcodes=None):
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    for (name, decoder) in LEGACY_DECODERS:
+        if datatype == name:
+            if name in tools.STRUCTURED_TYPES:
+                return decoder(value, attrcodes)
+            return decoder(value)
+    raise ValueError('Unknown attribute type %s' % datatype)
+
+
+def main():
+    attrcodes = BiDict()
+    attrcodes.Add(1, 'integer')
+    attrcodes.Add('241.1', 'integer')
+
+    print('%14s %12s %12s %12s %12s' % ('datatype', 'legacy enc',
+                                        'compiled enc', 'legacy dec',
+                                        'compiled dec'))
+    loops = 20000
+    for (datatype, value) in SAMPLES:
+        attr = Attribute(datatype, 1, datatype, attrcodes=attrcodes)
+        encoded = attr.encoder(value)
+        if datatype == 'long-extended':
+            encoded = b'\xf5\x07\x01\x00abc'
+
+        results = []
+        for func in (lambda: LegacyEncodeAttr(datatype, value, attrcodes),
+                     lambda: attr.encoder(value),
+                     lambda: LegacyDecodeAttr(datatype, encoded, attrcodes),
+                     lambda: attr.decoder(encoded)):
+            best = min(timeit.repeat(func, number=loops, repeat=3))
+            results.append(best / loops * 1e9)
+        print('%14s %10.0fns %10.0fns %10.0fns %10.0fns' %
+              ((datatype,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
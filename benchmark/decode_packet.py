@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# Compare Packet.DecodePacket with the previous slicing decoder.
+#
+# The old decoder re-sliced the remaining packet for every attribute,
+# which copies the tail of the buffer each time and makes decoding
+# quadratic in the number of attributes. The offset-based decoder
+# should show a roughly constant cost per attribute.
+
+from io import StringIO
+import struct
+import timeit
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import Packet
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  Acct-Session-Time    46  integer
+VENDOR     Simplon              16
+BEGIN-VENDOR Simplon
+ATTRIBUTE  Simplon-Number       1   integer
+END-VENDOR Simplon
+"""
+
+
+def BuildPacket(count):
+    attrs = []
+    for i in range(count):
+        if i % 3 == 0:
+            attrs.append(struct.pack('!BB', 1, 12) + b'user-%05d' % i)
+        elif i % 3 == 1:
+            attrs.append(struct.pack('!BBL', 46, 6, i))
+        else:
+            attrs.append(struct.pack('!BBLBBL', 26, 12, 16, 1, 6, i))
+    attrs = b''.join(attrs)
+    return struct.pack('!BBH', 4, 1, 20 + len(attrs)) + 16 * b'\x00' + attrs
+
+
+def SlicingDecode(pkt, packet):
+    """The decode loop as it was before the offset-based decoder."""
+    pkt.clear()
+    packet = packet[20:]
+    while packet:
+        (key, attrlen) = struct.unpack('!BB', packet[0:2])
+        value = packet[2:attrlen]
+        attribute = pkt.dict.attributes.get(pkt._DecodeKey(key))
+        if key == 26:
+            for (key, value) in pkt._PktDecodeVendorAttribute(value):
+                pkt.setdefault(key, []).append(value)
+        elif attribute and attribute.type == 'tlv':
+            pkt._PktDecodeTlvAttribute(key, value)
+        else:
+            pkt.setdefault(key, []).append(value)
+        packet = packet[attrlen:]
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    pkt = Packet(dict=dictionary)
+
+    print('%10s %14s %14s %14s' % ('attributes', 'slicing us/avp',
+                                   'offset us/avp', 'speedup'))
+    for count in (16, 64, 256, 512, 768):
+        raw = BuildPacket(count)
+        loops = max(20, 20000 // count)
+        old = min(timeit.repeat(lambda: SlicingDecode(pkt, raw),
+                                number=loops, repeat=3))
+        new = min(timeit.repeat(lambda: pkt.DecodePacket(raw),
+                                number=loops, repeat=3))
+        old = old / loops / count * 1e6
+        new = new / loops / count * 1e6
+        print('%10d %14.3f %14.3f %13.2fx' % (count, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+#
+# Compare decoding nested TLVs with the previous recursive decoder,
+# which built values with a per-instance __dict__ and sliced a copy of
+# the remaining payload at every level.
+#
+# Reports the time per decode and the memory allocated for the decoded
+# value, measured with tracemalloc.
+
+import struct
+import timeit
+import tracemalloc
+
+from pyrad import tools
+from pyrad.bidict import BiDict
+
+DEPTHS = [1, 4, 16, 32]
+
+
+class LegacyTlv:
+    def __init__(self, datatype, length, value):
+        self._type = datatype
+        self._len = length
+        self._val = value
+
+    @property
+    def value(self):
+        return self._val
+
+
+def LegacyDecodeTlv(value, attrcodes):
+    datatype = struct.unpack('B', value[0:1])[0]
+    length = struct.unpack('B', value[1:2])[0]
+    nested = attrcodes.GetForward(datatype)
+    if nested == 'tlv':
+        decoded = LegacyDecodeTlv(value[2:length], attrcodes)
+    else:
+        decoded = tools.DecodeAttr(nested, value[2:length])
+    return LegacyTlv(datatype, length, decoded)
+
+
+def Encode(depth):
+    encoded = b'\x01\x06\x00\x00\x00\x05'
+    for _ in range(depth - 1):
+        encoded = b'\x02' + bytes([len(encoded) + 2]) + encoded
+    return encoded
+
+
+def Allocated(func):
+    tracemalloc.start()
+    try:
+        value = func()  # noqa: F841
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    attrcodes = BiDict()
+    attrcodes.Add(1, 'integer')
+    attrcodes.Add(2, 'tlv')
+
+    loops = 20000
+    print('%6s %12s %12s %12s %12s' % ('depth', 'legacy', 'iterative',
+                                       'legacy B', 'iterative B'))
+    for depth in DEPTHS:
+        encoded = Encode(depth)
+        funcs = (lambda: LegacyDecodeTlv(encoded, attrcodes),
+                 lambda: tools.DecodeTlv(encoded, attrcodes))
+        times = [min(timeit.repeat(func, number=loops, repeat=3)) / loops
+                 for func in funcs]
+        sizes = [Allocated(func) for func in funcs]
+        print('%6d %10.0fns %10.0fns %12d %12d' % (
+            depth, times[0] * 1e9, times[1] * 1e9, sizes[0], sizes[1]))
+
+
+if __name__ == '__main__':
+    main()
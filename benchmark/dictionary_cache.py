@@ -0,0 +1,64 @@
+#!/usr/bin/python
+#
+# Compare parsing a large dictionary tree with loading it from the
+# compiled dictionary cache.
+#
+# The tree mimics a FreeRADIUS installation: a top level dictionary
+# that includes one file per vendor, each defining attributes and
+# enumerated values.
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from pyrad.dictionary import Dictionary
+
+VENDORS = 100
+ATTRIBUTES = 40
+VALUES = 10
+
+
+def WriteTree(path):
+    top = os.path.join(path, 'dictionary')
+    with open(top, 'w') as fd:
+        fd.write('ATTRIBUTE User-Name 1 string\n')
+        for vendor in range(VENDORS):
+            name = 'dictionary.vendor%d' % vendor
+            fd.write('$INCLUDE %s\n' % name)
+            with open(os.path.join(path, name), 'w') as vfd:
+                vfd.write('VENDOR Vendor%d %d\n' % (vendor, vendor + 1))
+                vfd.write('BEGIN-VENDOR Vendor%d\n' % vendor)
+                for attr in range(ATTRIBUTES):
+                    vfd.write('ATTRIBUTE Vendor%d-Attr%d %d integer\n' %
+                              (vendor, attr, attr + 1))
+                    for value in range(VALUES):
+                        vfd.write('VALUE Vendor%d-Attr%d Value%d %d\n' %
+                                  (vendor, attr, value, value))
+                vfd.write('END-VENDOR Vendor%d\n' % vendor)
+    return top
+
+
+def main():
+    path = tempfile.mkdtemp()
+    try:
+        top = WriteTree(path)
+        cache = os.path.join(path, 'dictionary.cache')
+        Dictionary(top, cache=cache)
+
+        loops = 5
+        parse = min(timeit.repeat(lambda: Dictionary(top), number=loops,
+                                  repeat=3)) / loops
+        cached = min(timeit.repeat(lambda: Dictionary(top, cache=cache),
+                                   number=loops, repeat=3)) / loops
+        print('%d files, %d attributes' % (VENDORS + 1,
+                                           len(Dictionary(top))))
+        print('%-8s %10s' % ('load', 'ms'))
+        print('%-8s %10.1f' % ('parse', parse * 1e3))
+        print('%-8s %10.1f' % ('cache', cached * 1e3))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
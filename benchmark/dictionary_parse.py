@@ -0,0 +1,94 @@
+#!/usr/bin/python
+#
+# Measure dictionary parse time and peak memory.
+#
+# Parses the example dictionary shipped with pyrad and a generated tree
+# the size of a full FreeRADIUS installation. Pass the path of a real
+# FreeRADIUS dictionary (for example /usr/share/freeradius/dictionary)
+# to measure that as well.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pyrad.dictionary import Dictionary
+
+VENDORS = 130
+ATTRIBUTES = 60
+VALUES = 8
+
+
+def WriteTree(path):
+    top = os.path.join(path, 'dictionary')
+    with open(top, 'w') as fd:
+        fd.write('# Generated dictionary tree\n'
+                 'ATTRIBUTE\tUser-Name\t\t1\tstring\n'
+                 'ATTRIBUTE\tUser-Password\t\t2\tstring\tencrypt=1\n'
+                 'ATTRIBUTE\tFramed-Interface-Id\t96\tifid\n'
+                 'ATTRIBUTE\tChargeable-User-Identity\t0x59\toctets[16]\n')
+        for vendor in range(VENDORS):
+            name = 'dictionary.vendor%d' % vendor
+            fd.write('$INCLUDE %s\t# vendor %d\n' % (name, vendor))
+            with open(os.path.join(path, name), 'w') as vfd:
+                vfd.write('# Vendor %d\n\n' % vendor)
+                vfd.write('VENDOR\t\tVendor%d\t\t%d\n' % (vendor, vendor + 1))
+                vfd.write('BEGIN-VENDOR\tVendor%d\n\n' % vendor)
+                # Values ahead of their attribute are parsed deferred
+                vfd.write('VALUE\tVendor%d-Attr1\tEarly\t\t99\n' % vendor)
+                for attr in range(ATTRIBUTES):
+                    datatype = ('integer', 'string', 'ipaddr',
+                                'octets')[attr % 4]
+                    vfd.write('ATTRIBUTE\tVendor%d-Attr%d\t\t%d\t%s\n' %
+                              (vendor, attr, attr + 1, datatype))
+                    if datatype == 'integer':
+                        for value in range(VALUES):
+                            vfd.write('VALUE\tVendor%d-Attr%d\tValue-%d\t'
+                                      '%d\t# comment\n' %
+                                      (vendor, attr, value, value))
+                vfd.write('ATTRIBUTE\tVendor%d-Tlv\t\t200\ttlv\n' % vendor)
+                vfd.write('ATTRIBUTE\tVendor%d-Tlv-Int\t200.1\tinteger\n' %
+                          vendor)
+                vfd.write('\nEND-VENDOR\tVendor%d\n' % vendor)
+    return top
+
+
+def Measure(path, loops=3):
+    best = None
+    for _ in range(loops):
+        start = time.perf_counter()
+        dictionary = Dictionary(path)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    Dictionary(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (len(dictionary), len(dictionary.files), best, peak)
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    trees = [('example', os.path.join(here, '..', 'example', 'dictionary'))]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        trees.append(('generated', WriteTree(tmpdir)))
+        for path in sys.argv[1:]:
+            trees.append((os.path.basename(path), path))
+
+        print('%-12s %6s %10s %10s %10s' % ('tree', 'files', 'attributes',
+                                            'parse ms', 'peak KiB'))
+        for (name, path) in trees:
+            (attributes, files, elapsed, peak) = Measure(path)
+            print('%-12s %6d %10d %10.1f %10.0f' % (name, files, attributes,
+                                                    elapsed * 1e3,
+                                                    peak / 1024.0))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+#
+# Compare the bytearray attribute encoder with the previous encoder,
+# which built the attribute block with repeated bytes concatenation.
+#
+# Growing an immutable bytes object copies everything encoded so far,
+# so the old encoder was quadratic in the size of the packet.
+
+from io import StringIO
+import timeit
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import Packet
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  Acct-Session-Time    46  integer
+VENDOR     Simplon              16
+BEGIN-VENDOR Simplon
+ATTRIBUTE  Simplon-Number       1   integer
+END-VENDOR Simplon
+"""
+
+
+def BuildPacket(dictionary, count):
+    pkt = Packet(dict=dictionary)
+    for i in range(count):
+        if i % 3 == 0:
+            pkt.AddAttribute('User-Name', 'user-%05d' % i)
+        elif i % 3 == 1:
+            pkt.AddAttribute('Acct-Session-Time', i)
+        else:
+            pkt.AddAttribute('Simplon-Number', i)
+    return pkt
+
+
+def ConcatEncode(pkt):
+    """The encode loop as it was before the bytearray encoder."""
+    result = b''
+    for (code, datalst) in pkt.items():
+        attribute = pkt.dict.attributes.get(pkt._DecodeKey(code))
+        if attribute and attribute.type == 'tlv':
+            result += pkt._PktEncodeTlv(code, datalst)
+        else:
+            for data in datalst:
+                result += pkt._PktEncodeAttribute(code, data)
+    return result
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+
+    print('%10s %14s %14s %14s' % ('attributes', 'concat us/avp',
+                                   'buffer us/avp', 'speedup'))
+    for count in (16, 64, 256, 512, 768):
+        pkt = BuildPacket(dictionary, count)
+        assert ConcatEncode(pkt) == pkt._PktEncodeAttributes()
+        loops = max(20, 20000 // count)
+        old = min(timeit.repeat(lambda: ConcatEncode(pkt),
+                                number=loops, repeat=3))
+        new = min(timeit.repeat(pkt._PktEncodeAttributes,
+                                number=loops, repeat=3))
+        old = old / loops / count * 1e6
+        new = new / loops / count * 1e6
+        print('%10d %14.3f %14.3f %13.2fx' % (count, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
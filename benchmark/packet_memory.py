@@ -0,0 +1,108 @@
+#!/usr/bin/python
+#
+# Compare the memory held per in-flight packet by Packet, lazily
+# decoded Packet and SlimPacket, measured with tracemalloc.
+#
+# Each packet is a typical accounting request: a mix of strings,
+# integers, addresses and vendor attributes. The raw datagrams are
+# allocated before tracing starts, as a server receives them anyway.
+
+from io import StringIO
+import struct
+import timeit
+import tracemalloc
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import Packet, SlimPacket
+
+PACKETS = 10000
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  NAS-IP-Address       4   ipaddr
+ATTRIBUTE  NAS-Port             5   integer
+ATTRIBUTE  Service-Type         6   integer
+ATTRIBUTE  Framed-IP-Address    8   ipaddr
+ATTRIBUTE  Class                25  octets
+ATTRIBUTE  Called-Station-Id    30  string
+ATTRIBUTE  Calling-Station-Id   31  string
+ATTRIBUTE  Acct-Status-Type     40  integer
+ATTRIBUTE  Acct-Delay-Time      41  integer
+ATTRIBUTE  Acct-Input-Octets    42  integer
+ATTRIBUTE  Acct-Output-Octets   43  integer
+ATTRIBUTE  Acct-Session-Id      44  string
+ATTRIBUTE  Acct-Session-Time    46  integer
+ATTRIBUTE  Event-Timestamp      55  date
+VENDOR     Simplon              16
+BEGIN-VENDOR Simplon
+ATTRIBUTE  Simplon-Number       1   integer
+ATTRIBUTE  Simplon-String       2   string
+END-VENDOR Simplon
+"""
+
+
+def Attribute(code, value):
+    return struct.pack('!BB', code, len(value) + 2) + value
+
+
+def BuildPacket(i):
+    attrs = b''.join([
+        Attribute(1, b'user-%06d@example.com' % i),
+        Attribute(4, b'\xc0\xa8\x00\x01'),
+        Attribute(5, struct.pack('!L', i)),
+        Attribute(6, struct.pack('!L', 2)),
+        Attribute(8, struct.pack('!L', 0x0a000000 + i)),
+        Attribute(25, b'class-%06d' % i),
+        Attribute(30, b'00-11-22-33-44-55:ssid'),
+        Attribute(31, b'66-77-88-99-aa-bb'),
+        Attribute(40, struct.pack('!L', 3)),
+        Attribute(41, struct.pack('!L', 0)),
+        Attribute(42, struct.pack('!L', i * 100)),
+        Attribute(43, struct.pack('!L', i * 200)),
+        Attribute(44, b'%016x' % i),
+        Attribute(46, struct.pack('!L', i)),
+        Attribute(55, struct.pack('!L', 1700000000 + i)),
+        Attribute(26, struct.pack('!LBBL', 16, 1, 6, i)),
+        Attribute(26, struct.pack('!LBB', 16, 2, 10) + b'value123'),
+    ])
+    return struct.pack('!BBH', 4, i % 256, 20 + len(attrs)) + \
+        16 * b'\x00' + attrs
+
+
+def Measure(make, raws):
+    tracemalloc.start()
+    try:
+        packets = [make(raw) for raw in raws]
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del packets
+    return size / len(raws)
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    raws = [BuildPacket(i) for i in range(PACKETS)]
+    decoders = [
+        ('Packet', lambda raw: Packet(packet=raw, dict=dictionary)),
+        ('Packet lazy',
+         lambda raw: Packet(packet=raw, dict=dictionary, lazy=True)),
+        ('SlimPacket', lambda raw: SlimPacket(packet=raw, dict=dictionary)),
+    ]
+
+    print('%d packets of %d bytes' % (PACKETS, len(raws[0])))
+    print('%-12s %12s %12s %12s' % ('class', 'bytes/packet', 'decode us',
+                                    'lookup us'))
+    for (name, make) in decoders:
+        size = Measure(make, raws)
+        decode = min(timeit.repeat(lambda: make(raws[0]), number=2000,
+                                   repeat=3)) / 2000
+        pkt = make(raws[0])
+        lookup = min(timeit.repeat(lambda: pkt['Acct-Session-Time'],
+                                   number=2000, repeat=3)) / 2000
+        print('%-12s %12.0f %12.1f %12.1f' % (name, size, decode * 1e6,
+                                              lookup * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+#
+# Compare building packets with static attributes through keyword
+# arguments with building them from a PacketTemplate.
+#
+# Replies carry a handful of static attributes and one per-request
+# address; requests, as sent by a load generator, carry static NAS
+# attributes and a per-request user name and password.
+
+from io import StringIO
+import timeit
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AccessAccept, AccessRequest
+from pyrad.packet import AuthPacket, PacketTemplate
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  User-Password        2   string
+ATTRIBUTE  NAS-IP-Address       4   ipaddr
+ATTRIBUTE  NAS-Port             5   integer
+ATTRIBUTE  Service-Type         6   integer
+ATTRIBUTE  Framed-Protocol      7   integer
+ATTRIBUTE  Framed-IP-Address    8   ipaddr
+ATTRIBUTE  Framed-MTU           12  integer
+ATTRIBUTE  Reply-Message        18  string
+ATTRIBUTE  Session-Timeout      27  integer
+ATTRIBUTE  Idle-Timeout         28  integer
+ATTRIBUTE  Called-Station-Id    30  string
+ATTRIBUTE  NAS-Identifier       32  string
+ATTRIBUTE  NAS-Port-Type        61  integer
+"""
+
+REPLY = dict(Service_Type=2, Framed_Protocol=1, Framed_MTU=1500,
+             Session_Timeout=3600, Idle_Timeout=600,
+             Reply_Message='Welcome to the network')
+
+REQUEST = dict(NAS_IP_Address='192.168.0.1', NAS_Identifier='nas-01',
+               NAS_Port_Type=15, Service_Type=2,
+               Called_Station_Id='00-11-22-33-44-55:ssid')
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    secret = b'secret'
+    request = AuthPacket(id=1, secret=secret, dict=dictionary,
+                         authenticator=16 * b'\x01', User_Name='user')
+    reply_template = PacketTemplate(AccessAccept, dictionary, **REPLY)
+    request_template = PacketTemplate(AccessRequest, dictionary, **REQUEST)
+
+    def KeywordReply():
+        return request.CreateReply(**REPLY,
+                                   Framed_IP_Address='10.0.0.1').ReplyPacket()
+
+    def TemplateReply():
+        return reply_template.CreateReply(
+            request, Framed_IP_Address='10.0.0.1').ReplyPacket()
+
+    def KeywordRequest():
+        pkt = AuthPacket(secret=secret, dict=dictionary, User_Name='user',
+                         **REQUEST)
+        pkt['User-Password'] = pkt.PwCrypt('password')
+        return pkt.RequestPacket()
+
+    def TemplateRequest():
+        pkt = request_template.CreatePacket(secret=secret, User_Name='user')
+        pkt['User-Password'] = pkt.PwCrypt('password')
+        return pkt.RequestPacket()
+
+    assert KeywordReply() == TemplateReply()
+
+    loops = 10000
+    print('%-8s %10s %10s' % ('packet', 'keywords', 'template'))
+    for (name, keywords, template) in (
+            ('reply', KeywordReply, TemplateReply),
+            ('request', KeywordRequest, TemplateRequest)):
+        results = [min(timeit.repeat(func, number=loops, repeat=3)) / loops
+                   for func in (keywords, template)]
+        print('%-8s %8.1fus %8.1fus' % (name, results[0] * 1e6,
+                                        results[1] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/python
+#
+# Compare the block XOR used by PwCrypt/PwDecrypt and SaltCrypt with the
+# previous implementation, which XORed one byte at a time and re-hashed
+# the secret for every block.
+
+import hashlib
+import timeit
+
+from pyrad.packet import _CryptBlocks
+
+SECRET = b'a shared secret of a realistic length'
+AUTHENTICATOR = 16 * b'\x5a'
+
+
+def BytewiseCrypt(secret, last, data):
+    """The PwCrypt loop as it was before the block XOR."""
+    result = b''
+    while data:
+        hash = hashlib.md5(secret + last).digest()
+        for i in range(16):
+            result += bytes((hash[i] ^ data[i],))
+        last = result[-16:]
+        data = data[16:]
+    return result
+
+
+def main():
+    print('%8s %14s %14s %14s' % ('bytes', 'bytewise us', 'block us',
+                                  'speedup'))
+    for size in (16, 32, 64, 128):
+        data = bytes(range(size))
+        assert (BytewiseCrypt(SECRET, AUTHENTICATOR, data) ==
+                _CryptBlocks(SECRET, AUTHENTICATOR, data))
+        loops = 20000
+        old = min(timeit.repeat(
+            lambda: BytewiseCrypt(SECRET, AUTHENTICATOR, data),
+            number=loops, repeat=3))
+        new = min(timeit.repeat(
+            lambda: _CryptBlocks(SECRET, AUTHENTICATOR, data),
+            number=loops, repeat=3))
+        old = old / loops * 1e6
+        new = new / loops * 1e6
+        print('%8d %14.2f %14.2f %13.2fx' % (size, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
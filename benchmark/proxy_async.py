@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# Forward bursts of Access-Requests through ProxyAsync to two local home
+# servers, with both pool policies, and report the proxied request rate.
+# Bursts are kept small enough for the default socket receive buffers;
+# requests dropped there are only retried after the client timeout.
+
+import asyncio
+import logging
+import socket
+import time
+from io import StringIO
+
+from pyrad.client_async import ClientAsync
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AccessAccept, AuthPacket
+from pyrad.proxy_async import HomeServer, HomeServerPool, ProxyAsync, \
+    POLICY_FAIL_OVER, POLICY_LOAD_BALANCE
+from pyrad.server import RemoteHost
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  User-Password        2   string  encrypt=1
+ATTRIBUTE  Proxy-State          33  octets
+ATTRIBUTE  Message-Authenticator 80 octets
+"""
+REQUESTS = 4000
+WINDOW = 100
+
+
+class HomeResponder(asyncio.DatagramProtocol):
+    def __init__(self, secret, dictionary):
+        self.secret = secret
+        self.dictionary = dictionary
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.requests += 1
+        request = AuthPacket(packet=data, secret=self.secret,
+                             dict=self.dictionary)
+        reply = request.CreateReply()
+        reply.code = AccessAccept
+        reply[33] = request[33]
+        self.transport.sendto(reply.ReplyPacket(), addr)
+
+
+def FreePort():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+async def Run(dictionary, policy):
+    loop = asyncio.get_running_loop()
+    responders = []
+    servers = []
+    for i in range(2):
+        secret = b'home-%d' % i
+        port = FreePort()
+        responder = HomeResponder(secret, dictionary)
+        await loop.create_datagram_endpoint(lambda r=responder: r,
+                                            local_addr=('127.0.0.1', port))
+        responders.append(responder)
+        servers.append(HomeServer('127.0.0.1', secret, auth_port=port,
+                                  sockets_per_port=2))
+
+    port = FreePort()
+    proxy = ProxyAsync(auth_pool=HomeServerPool(servers, policy),
+                       auth_port=port, dictionary=dictionary, loop=loop,
+                       hosts={'127.0.0.1': RemoteHost('127.0.0.1', b'nas',
+                                                      'nas')})
+    await proxy.initialize_transports(enable_auth=True)
+    await proxy.initialize_home_servers()
+
+    client = ClientAsync('127.0.0.1', auth_port=port, secret=b'nas',
+                         dict=dictionary, timeout=5, sockets_per_port=2)
+    await client.initialize_transports(enable_auth=True)
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS // WINDOW):
+        futures = []
+        for _ in range(WINDOW):
+            pkt = client.CreateAuthPacket(User_Name='user')
+            pkt['User-Password'] = pkt.PwCrypt('password')
+            futures.append(client.SendPacket(pkt))
+        await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+
+    await client.deinitialize_transports()
+    await proxy.deinitialize_home_servers()
+    await proxy.deinitialize_transports()
+    return (elapsed, [responder.requests for responder in responders])
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    print('%-14s %12s %16s' % ('policy', 'requests/s', 'per home server'))
+    for policy in (POLICY_FAIL_OVER, POLICY_LOAD_BALANCE):
+        (elapsed, counts) = asyncio.run(Run(dictionary, policy))
+        print('%-14s %12.0f %16s' % (policy, REQUESTS / elapsed,
+                                     '/'.join(map(str, counts))))
+
+
+if __name__ == '__main__':
+    main()
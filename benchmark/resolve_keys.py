@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# Compare attribute key resolution through Dictionary.resolver with the
+# previous lookups, which went through the attributes, vendors and
+# attrindex tables and built a (vendor, code) tuple on every access.
+
+from io import StringIO
+import timeit
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import Packet
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  Acct-Session-Time    46  integer
+VENDOR     Simplon              16
+BEGIN-VENDOR Simplon
+ATTRIBUTE  Simplon-Number       1   integer
+END-VENDOR Simplon
+"""
+
+
+def LegacyEncodeKey(pkt, key):
+    if not isinstance(key, str):
+        return key
+    attr = pkt.dict.attributes[key]
+    if attr.vendor and not attr.is_sub_attribute:
+        return (pkt.dict.vendors.GetForward(attr.vendor), attr.code)
+    return attr.code
+
+
+def LegacyDecodeKey(pkt, key):
+    if pkt.dict.attrindex.HasBackward(key):
+        return pkt.dict.attrindex.GetBackward(key)
+    return key
+
+
+def LegacyGetItem(pkt, key):
+    values = dict.__getitem__(pkt, LegacyEncodeKey(pkt, key))
+    attr = pkt.dict.attributes[key]
+    return [pkt._DecodeValue(attr, v) for v in values]
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    pkt = Packet(dict=dictionary, User_Name='user', Acct_Session_Time=10,
+                 Simplon_Number=5)
+
+    loops = 100000
+    cases = [
+        ('encode key', lambda: LegacyEncodeKey(pkt, 'Simplon-Number'),
+         lambda: pkt._EncodeKey('Simplon-Number')),
+        ('decode key', lambda: LegacyDecodeKey(pkt, (16, 1)),
+         lambda: pkt._DecodeKey((16, 1))),
+        ('getitem', lambda: LegacyGetItem(pkt, 'Simplon-Number'),
+         lambda: pkt['Simplon-Number']),
+        ('contains',
+         lambda: dict.__contains__(pkt, LegacyEncodeKey(pkt,
+                                                        'Simplon-Number')),
+         lambda: 'Simplon-Number' in pkt),
+    ]
+    print('%-14s %10s %10s' % ('operation', 'legacy', 'resolver'))
+    for (name, legacy, current) in cases:
+        results = []
+        for func in (legacy, current):
+            best = min(timeit.repeat(func, number=loops, repeat=3))
+            results.append(best / loops * 1e9)
+        print('%-14s %8.0fns %8.0fns' % ((name,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# Compare encoding a request again for every retransmission with resending
+# the cached encoding, patching only Acct-Delay-Time for accounting
+# requests.
+
+import timeit
+from io import StringIO
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AcctPacket, AuthPacket
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  User-Password        2   string  encrypt=1
+ATTRIBUTE  NAS-IP-Address       4   ipaddr
+ATTRIBUTE  NAS-Port             5   integer
+ATTRIBUTE  Class                25  octets
+ATTRIBUTE  Acct-Status-Type     40  integer
+ATTRIBUTE  Acct-Delay-Time      41  integer
+ATTRIBUTE  Acct-Input-Octets    42  integer
+ATTRIBUTE  Acct-Output-Octets   43  integer
+ATTRIBUTE  Acct-Session-Id      44  string
+ATTRIBUTE  Acct-Session-Time    46  integer
+ATTRIBUTE  Message-Authenticator 80 octets
+"""
+
+
+def Fill(pkt):
+    pkt['User-Name'] = 'user@example.com'
+    pkt['NAS-IP-Address'] = '192.168.0.1'
+    pkt['NAS-Port'] = 12
+    for i in range(8):
+        pkt.AddAttribute('Class', b'class-%d' % i)
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+
+    auth = AuthPacket(id=1, secret=b'secret', dict=dictionary)
+    Fill(auth)
+    auth['User-Password'] = auth.PwCrypt('password')
+    auth.add_message_authenticator()
+
+    acct = AcctPacket(id=2, secret=b'secret', dict=dictionary)
+    Fill(acct)
+    acct['Acct-Status-Type'] = 3
+    acct['Acct-Session-Id'] = 'session'
+    acct['Acct-Input-Octets'] = 1000
+    acct['Acct-Output-Octets'] = 2000
+    acct['Acct-Session-Time'] = 60
+    acct['Acct-Delay-Time'] = 0
+
+    loops = 20000
+    raw_auth = auth.RequestPacket()
+    raw_acct = acct.RequestPacket()
+
+    def ReencodeAcct():
+        acct['Acct-Delay-Time'] = acct['Acct-Delay-Time'][0] + 1
+        acct.RequestPacket()
+
+    def PatchAcct():
+        acct['Acct-Delay-Time'] = acct['Acct-Delay-Time'][0] + 1
+        acct.RetransmitPacket(raw_acct, acct['Acct-Delay-Time'][0])
+
+    print('%-16s %12s %12s' % ('request', 'encode us', 'resend us'))
+    for (name, encode, resend) in (
+            ('Access-Request', auth.RequestPacket, lambda: raw_auth),
+            ('Acct-Request', ReencodeAcct, PatchAcct)):
+        old = min(timeit.repeat(encode, number=loops, repeat=3))
+        new = min(timeit.repeat(resend, number=loops, repeat=3))
+        print('%-16s %12.2f %12.2f' % (name, old / loops * 1e6,
+                                       new / loops * 1e6))
+
+
+if __name__ == '__main__':
+    main()
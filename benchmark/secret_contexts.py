@@ -0,0 +1,38 @@
+#!/usr/bin/python
+#
+# Compare keying a new HMAC-MD5 context for every packet with copying a
+# context that was keyed once per shared secret.
+
+import hmac
+import timeit
+
+from pyrad.packet import _SecretHmac
+
+SECRETS = [b'secret-%d' % i for i in range(8)]
+PACKET = 200 * b'\x01'
+
+
+def FreshHmac():
+    for secret in SECRETS:
+        hmac.new(secret, PACKET, digestmod='MD5').digest()
+
+
+def PrimedHmac():
+    for secret in SECRETS:
+        mac = _SecretHmac(secret)
+        mac.update(PACKET)
+        mac.digest()
+
+
+def main():
+    loops = 20000
+    old = min(timeit.repeat(FreshHmac, number=loops, repeat=3))
+    new = min(timeit.repeat(PrimedHmac, number=loops, repeat=3))
+    old = old / loops / len(SECRETS) * 1e6
+    new = new / loops / len(SECRETS) * 1e6
+    print('%14s %14s %14s' % ('fresh us/pkt', 'primed us/pkt', 'speedup'))
+    print('%14.2f %14.2f %13.2fx' % (old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
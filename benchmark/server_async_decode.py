@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+# Measure how many accounting requests per second the asyncio server
+# protocol can take in, with and without the preliminary generic decode
+# that datagram_received used to do to find the packet code.
+
+from io import StringIO
+import logging
+import time
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AcctPacket, Packet
+from pyrad.server import RemoteHost
+from pyrad.server_async import DatagramProtocolServer, ServerType
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  NAS-IP-Address       4   ipaddr
+ATTRIBUTE  Acct-Status-Type     40  integer
+ATTRIBUTE  Acct-Session-Id      44  string
+ATTRIBUTE  Acct-Session-Time    46  integer
+"""
+
+PACKETS = 20000
+
+
+class StubServer:
+    enable_pkt_verify = True
+    lazy_decode = False
+    debug = False
+
+    def __init__(self, dictionary):
+        self.dict = dictionary
+
+
+class DoubleDecodeProtocol(DatagramProtocolServer):
+    """datagram_received with the former preliminary decode."""
+
+    def datagram_received(self, data, addr):
+        try:
+            Packet(packet=data, dict=self.server.dict)
+        except Exception:
+            return
+        DatagramProtocolServer.datagram_received(self, data, addr)
+
+
+def Measure(klass, dictionary, data):
+    handled = []
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(logging.WARNING)
+    protocol = klass('127.0.0.1', 1813, logger, StubServer(dictionary),
+                     ServerType.Acct,
+                     {'127.0.0.1': RemoteHost('127.0.0.1', b'secret', 'nas')},
+                     lambda protocol, req, addr: handled.append(req))
+    addr = ('127.0.0.1', 5000)
+    start = time.perf_counter()
+    for _ in range(PACKETS):
+        protocol.datagram_received(data, addr)
+    elapsed = time.perf_counter() - start
+    assert len(handled) == PACKETS
+    return PACKETS / elapsed
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    request = AcctPacket(id=1, secret=b'secret', dict=dictionary,
+                         User_Name='user@example.com',
+                         NAS_IP_Address='192.168.1.1',
+                         Acct_Status_Type=3,
+                         Acct_Session_Id='0123456789abcdef',
+                         Acct_Session_Time=3600)
+    data = request.RequestPacket()
+
+    before = max(Measure(DoubleDecodeProtocol, dictionary, data)
+                 for _ in range(3))
+    after = max(Measure(DatagramProtocolServer, dictionary, data)
+                for _ in range(3))
+    print('%16s %16s %10s' % ('before pkt/s', 'after pkt/s', 'speedup'))
+    print('%16.0f %16.0f %9.2fx' % (before, after, after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+#
+# Compare draining an accounting socket one datagram per poll() wakeup
+# with reading a batch of datagrams per wakeup.
+
+from io import StringIO
+import select
+import socket
+import time
+
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AcctPacket
+from pyrad.server import RemoteHost, Server
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  Acct-Session-Time    46  integer
+"""
+
+BURST = 200
+ROUNDS = 50
+
+
+def Drain(server, client, request):
+    address = server.acctfds[0].getsockname()
+    poll = select.poll()
+    for fd in server._fdmap:
+        poll.register(fd, select.POLLIN)
+
+    elapsed = 0.0
+    for _ in range(ROUNDS):
+        for _ in range(BURST):
+            client.sendto(request, address)
+        handled = 0
+        start = time.perf_counter()
+        while handled < BURST:
+            for (fd, event) in poll.poll():
+                handled += server._ProcessBatch(server._fdmap[fd])
+        elapsed += time.perf_counter() - start
+    return elapsed / (ROUNDS * BURST) * 1e6
+
+
+def main():
+    dictionary = Dictionary(StringIO(DICTIONARY))
+    request = AcctPacket(id=1, secret=b'secret', dict=dictionary,
+                         User_Name='user', Acct_Session_Time=10)
+    request = request.RequestPacket()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    print('%10s %12s %14s' % ('batch size', 'us/packet', 'packets/wakeup'))
+    for batch_size in (1, 8, 32, 64):
+        server = Server(acctport=0, auth_enabled=False, dict=dictionary,
+                        batch_size=batch_size,
+                        hosts={'127.0.0.1': RemoteHost('127.0.0.1',
+                                                       b'secret', 'local')})
+        server.BindToAddress('127.0.0.1')
+        server._poll = select.poll()
+        server._fdmap = {}
+        server._PrepareSockets()
+        cost = Drain(server, client, request)
+        print('%10d %12.2f %14.1f' % (batch_size, cost,
+                                      server.PacketsPerWakeup()))
+        server._CloseSockets()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+#
+# Compare the private memory of forked workers using a dictionary
+# parsed by each worker, a dictionary parsed before forking and a
+# SharedDictionary created before forking.
+#
+# Each worker looks up a handful of attributes and runs a garbage
+# collection, as a long running worker eventually does, then reports
+# its private dirty memory from /proc/self/smaps_rollup (Linux only).
+
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+from pyrad.dictionary import Dictionary
+from pyrad.shareddict import SharedDictionary
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from dictionary_cache import WriteTree  # noqa: E402
+
+WORKERS = 4
+LOOKUPS = ['Vendor%d-Attr%d' % (vendor, vendor % 40)
+           for vendor in range(0, 100, 10)]
+
+
+def PrivateDirty():
+    with open('/proc/self/smaps_rollup') as fd:
+        for line in fd:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1])
+    return 0
+
+
+def Work(load):
+    dictionary = load()
+    for name in LOOKUPS:
+        dictionary[name].values.GetForward('Value1')
+    gc.collect()
+    return PrivateDirty()
+
+
+def Fork(load):
+    results = []
+    for _ in range(WORKERS):
+        (read, write) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read)
+                os.write(write, str(Work(load)).encode())
+            finally:
+                os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as fd:
+            results.append(int(fd.read()))
+        os.waitpid(pid, 0)
+    return sum(results) / len(results)
+
+
+def main():
+    path = tempfile.mkdtemp()
+    try:
+        top = WriteTree(path)
+        gc.collect()
+        results = [('parse in worker', Fork(lambda: Dictionary(top)))]
+
+        parsed = Dictionary(top)
+        gc.collect()
+        results.append(('parse before fork', Fork(lambda: parsed)))
+        del parsed
+
+        shared = SharedDictionary.FromDictionary(Dictionary(top))
+        gc.collect()
+        results.append(('shared', Fork(lambda: shared)))
+
+        print('%d attributes, %d byte shared buffer, %d workers' % (
+            len(shared), len(shared.buffer), WORKERS))
+        print('%-18s %14s' % ('dictionary', 'private kB'))
+        for (name, private) in results:
+            print('%-18s %14d' % (name, private))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+# batch.py
+#
+# Columnar decoding of captured RADIUS packets
+
+"""
+Decoding stored traffic one :obj:`pyrad.packet.Packet` at a time builds
+a mapping of lists for every packet, only to pull a few values out of
+each. :obj:`DecodeBatch` instead walks the raw packets with the framing
+rules of :obj:`pyrad.packet.Packet.DecodePacket`, collects the values of
+the requested attributes and converts each attribute to one column.
+
+Fixed-width attributes become NumPy masked arrays, with packets that
+lack the attribute masked out:
+
+  ==========================  =========
+  attribute type              dtype
+  ==========================  =========
+  integer, uint32, date       uint32
+  ipaddr                      uint32
+  signed                      int32
+  short, uint16               uint16
+  byte, uint8                 uint8
+  integer64, uint64           uint64
+  int64                       int64
+  float32                     float32
+  ==========================  =========
+
+Other attributes, such as strings and octets, become object arrays of
+decoded values with None for missing attributes. Only the first value
+of an attribute in a packet is used.
+
+NumPy is an optional dependency, installed with the ``numpy`` extra.
+"""
+
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pyrad.packet import PacketError
+from pyrad import tools
+
+_HEADER = struct.Struct('!BBH')
+_ATTR_HEADER = struct.Struct('!BB')
+_VSA_HEADER = struct.Struct('!LBB')
+
+# Attribute types stored in fixed-width columns, with the dtype of the
+# encoded values. The byte order follows the codecs in pyrad.tools.
+FIXED_TYPES = {
+    'integer': '>u4',
+    'uint32': '>u4',
+    'date': '>u4',
+    'ipaddr': '>u4',
+    'signed': '>i4',
+    'short': '>u2',
+    'byte': 'u1',
+    'integer64': '>u8',
+    'uint8': 'u1',
+    'uint16': '=u2',
+    'uint64': '=u8',
+    'int64': '=i8',
+    'float32': '=f4',
+}
+
+
+class _Column(object):
+    __slots__ = ('name', 'attribute', 'rows', 'values')
+
+    def __init__(self, name, attribute):
+        self.name = name
+        self.attribute = attribute
+        self.rows = []
+        self.values = []
+
+
+def _Packets(packets, offsets):
+    """Yield (buffer, start, end) for every packet."""
+    if offsets is None:
+        for packet in packets:
+            yield (packet, 0, len(packet))
+        return
+    offsets = [int(offset) for offset in offsets]
+    ends = offsets[1:] + [len(packets)]
+    for (start, end) in zip(offsets, ends):
+        yield (packets, start, end)
+
+
+def _Columns(dictionary, names):
+    """Resolve the attribute names to columns, indexed by packet key."""
+    columns = {}
+    for name in names:
+        resolved = dictionary.resolver[name]
+        attribute = resolved.attribute
+        if not isinstance(resolved.key, (int, tuple)) or \
+                attribute.type in tools.STRUCTURED_TYPES or \
+                attribute.type == 'long-extended' or \
+                attribute.is_sub_attribute:
+            raise ValueError('Attribute %s can not be decoded into a column'
+                             % name)
+        if attribute.encrypt == 2:
+            raise ValueError('Attribute %s is encrypted' % name)
+        if resolved.key in columns:
+            raise ValueError('Attribute %s is requested twice' % name)
+        columns[resolved.key] = _Column(name, attribute)
+    return columns
+
+
+def _VendorValues(data, start, end, vendors):
+    """Return the (key, start, end) entries of a vendor attribute, or
+    an empty list if it is not in the RFC 2865 recommended form."""
+    if end - start < 6:
+        return []
+    (vendor, atype, length) = _VSA_HEADER.unpack_from(data, start)
+    if vendor not in vendors:
+        return []
+    entries = [((vendor, atype), start + 6, min(start + length + 4, end))]
+    offset = start + 4 + length
+    while offset < end:
+        try:
+            (atype, length) = _ATTR_HEADER.unpack_from(data, offset)
+        except struct.error:
+            return []
+        if length < 2:
+            return []
+        entries.append(((vendor, atype), offset + 2,
+                        min(offset + length, end)))
+        offset += length
+    return entries
+
+
+def _Index(packets, offsets, columns):
+    """Walk the packets and record the first value of every requested
+    attribute. Return the number of packets."""
+    vendors = set(key[0] for key in columns if isinstance(key, tuple))
+    unpack_attr = _ATTR_HEADER.unpack_from
+    row = -1
+    for (row, (data, start, end)) in enumerate(_Packets(packets, offsets)):
+        if end - start < 20:
+            raise PacketError('Packet %d: header is corrupt' % row)
+        (_, _, length) = _HEADER.unpack_from(data, start)
+        if end - start != length:
+            raise PacketError('Packet %d: invalid length' % row)
+        if length > 8192:
+            raise PacketError('Packet %d: length is too long (%d)'
+                              % (row, length))
+
+        seen = set()
+        offset = start + 20
+        while offset < end:
+            try:
+                (key, attrlen) = unpack_attr(data, offset)
+            except struct.error:
+                raise PacketError('Packet %d: attribute header is corrupt'
+                                  % row)
+            if attrlen < 2:
+                raise PacketError('Packet %d: attribute length is too '
+                                  'small (%d)' % (row, attrlen))
+            (vstart, vend) = (offset + 2, min(offset + attrlen, end))
+            offset += attrlen
+
+            if key == 26 and vendors:
+                entries = _VendorValues(data, vstart, vend, vendors)
+            elif key in columns and key not in seen:
+                entries = ((key, vstart, vend),)
+            else:
+                continue
+            for (key, vstart, vend) in entries:
+                column = columns.get(key)
+                if column is None or key in seen:
+                    continue
+                seen.add(key)
+                column.rows.append(row)
+                column.values.append(data[vstart:vend])
+    return row + 1
+
+
+def _FixedColumn(column, count, dtype):
+    dtype = numpy.dtype(dtype)
+    rows = []
+    values = []
+    for (row, value) in zip(column.rows, column.values):
+        if len(value) == dtype.itemsize:
+            rows.append(row)
+            values.append(value)
+    data = numpy.zeros(count, dtype=dtype.newbyteorder('='))
+    mask = numpy.ones(count, dtype=bool)
+    if rows:
+        rows = numpy.array(rows, dtype=numpy.intp)
+        data[rows] = numpy.frombuffer(b''.join(values), dtype=dtype)
+        mask[rows] = False
+    return numpy.ma.MaskedArray(data, mask=mask)
+
+
+def _ObjectColumn(column, count):
+    decoder = column.attribute.decoder
+    data = numpy.empty(count, dtype=object)
+    for (row, value) in zip(column.rows, column.values):
+        try:
+            data[row] = decoder(bytes(value))
+        except Exception:
+            data[row] = bytes(value)
+    return data
+
+
+def DecodeBatch(dictionary, packets, names, offsets=None):
+    """Decode the values of a set of attributes from many raw packets
+    into NumPy columns.
+
+    Packets are validated as by
+    :obj:`pyrad.packet.Packet.DecodePacket`, and a :obj:`PacketError`
+    naming the index of the packet is raised for the first invalid
+    packet. Fixed-width values with an unexpected length are treated
+    as missing, and other values that can not be decoded are kept as
+    bytes. Enumerated values are returned as numbers, not as value
+    names.
+
+    :param dictionary: RADIUS dictionary
+    :type dictionary:  pyrad.dictionary.Dictionary
+    :param packets:    raw packets, or a buffer holding all packets
+                       back to back if offsets are given
+    :type packets:     sequence of bytes, or bytes
+    :param names:      names of the attributes to decode
+    :type names:       sequence of strings
+    :param offsets:    start of every packet in the buffer
+    :type offsets:     sequence of integers or NumPy array
+    :return:           a column per attribute name
+    :rtype:            dictionary of numpy.ma.MaskedArray or
+                       numpy.ndarray
+    """
+    if numpy is None:
+        raise ImportError('DecodeBatch requires numpy, install pyrad '
+                          'with the numpy extra')
+
+    columns = _Columns(dictionary, names)
+    count = _Index(packets, offsets, columns)
+
+    result = {}
+    for column in columns.values():
+        dtype = FIXED_TYPES.get(column.attribute.type)
+        if dtype is None:
+            result[column.name] = _ObjectColumn(column, count)
+        else:
+            result[column.name] = _FixedColumn(column, count, dtype)
+    return result
@@ -4,6 +4,7 @@
 
 __docformat__ = "epytext en"
 
+import collections
 import hashlib
 import select
 import socket
@@ -137,19 +138,18 @@ class Client(host.Host):
         :raise Timeout: RADIUS server does not reply
         """
         self._SocketOpen()
+        raw = None
 
         for attempt in range(self.retries):
-            if attempt and pkt.code == packet.AccountingRequest:
-                if "Acct-Delay-Time" in pkt:
-                    pkt["Acct-Delay-Time"] = \
-                            pkt["Acct-Delay-Time"][0] + self.timeout
-                else:
-                    pkt["Acct-Delay-Time"] = self.timeout
+            if raw is None:
+                raw = pkt.RequestPacket()
+            else:
+                raw = self._UpdateDelayTime(pkt, raw)
 
             now = time.time()
             waitto = now + self.timeout
 
-            self._socket.sendto(pkt.RequestPacket(), (self.server, port))
+            self._socket.sendto(raw, (self.server, port))
 
             while now < waitto:
                 ready = self._poll.poll((waitto - now) * 1000)
@@ -171,6 +171,123 @@ class Client(host.Host):
 
         raise Timeout
 
+    def _UpdateDelayTime(self, pkt, raw):
+        """Account for a retransmission in Acct-Delay-Time.
+        Other requests are sent again unchanged.
+
+        :param pkt: the packet to send again
+        :type pkt:  pyrad.packet.Packet
+        :param raw: the packet as sent before
+        :type raw:  bytes
+        :return:    raw packet to send
+        :rtype:     bytes
+        """
+        if pkt.code != packet.AccountingRequest:
+            return raw
+        if "Acct-Delay-Time" in pkt:
+            pkt["Acct-Delay-Time"] = \
+                    pkt["Acct-Delay-Time"][0] + self.timeout
+        else:
+            pkt["Acct-Delay-Time"] = self.timeout
+        return pkt.RetransmitPacket(raw, pkt["Acct-Delay-Time"][0])
+
+    def _PacketPort(self, pkt):
+        if isinstance(pkt, packet.AuthPacket):
+            return self.authport
+        elif isinstance(pkt, packet.CoAPacket):
+            return self.coaport
+        return self.acctport
+
+    def SendPackets(self, packets, window=256):
+        """Send several packets to a RADIUS server concurrently.
+        Up to window requests are kept in flight on the client socket.
+        Replies are matched to their request by id and authenticator and
+        every request is retransmitted on its own schedule, so results
+        are produced in the order the replies arrive. Requests in flight
+        need distinct ids; a packet whose id is still in use waits until
+        that request has completed. Unlike SendPacket no EAP-MD5
+        exchange is performed.
+
+        :param packets: the packets to send
+        :type packets:  iterable of pyrad.packet.Packet
+        :param  window: maximum number of requests in flight
+        :type   window: integer
+        :return:        generator of (request, reply) tuples, with None
+                        as reply for requests the server did not answer
+        :rtype:         generator
+        """
+        self._SocketOpen()
+        packets = iter(packets)
+        pending = {}
+        # Every request uses the same timeout, so deadlines are queued
+        # in increasing order. Entries for answered requests or earlier
+        # attempts are skipped when they come up.
+        timers = collections.deque()
+        held = None
+        exhausted = False
+
+        while True:
+            while not exhausted and len(pending) < window:
+                if held is None:
+                    held = next(packets, None)
+                    if held is None:
+                        exhausted = True
+                        break
+                if held.id in pending:
+                    break
+                if self.retries < 1:
+                    yield (held, None)
+                else:
+                    raw = held.RequestPacket()
+                    pending[held.id] = [held, 0, raw]
+                    self._socket.sendto(raw,
+                                        (self.server, self._PacketPort(held)))
+                    timers.append((time.time() + self.timeout, held.id, 0))
+                held = None
+
+            if not pending:
+                return
+
+            now = time.time()
+            while timers and timers[0][0] <= now:
+                (deadline, id, attempt) = timers.popleft()
+                entry = pending.get(id)
+                if entry is None or entry[1] != attempt:
+                    continue
+                pkt = entry[0]
+                if attempt + 1 >= self.retries:
+                    del pending[id]
+                    yield (pkt, None)
+                    continue
+                entry[1] = attempt + 1
+                entry[2] = self._UpdateDelayTime(pkt, entry[2])
+                self._socket.sendto(entry[2],
+                                    (self.server, self._PacketPort(pkt)))
+                timers.append((now + self.timeout, id, attempt + 1))
+
+            if not timers:
+                continue
+
+            ready = self._poll.poll(max(timers[0][0] - time.time(), 0) * 1000)
+            if not ready:
+                continue
+
+            rawreply = self._socket.recv(4096)
+            if len(rawreply) < 20:
+                continue
+            entry = pending.get(rawreply[1])
+            if entry is None:
+                continue
+
+            pkt = entry[0]
+            try:
+                reply = pkt.CreateReply(packet=rawreply)
+                if pkt.VerifyReply(reply, rawreply):
+                    del pending[pkt.id]
+                    yield (pkt, reply)
+            except packet.PacketError:
+                pass
+
     def SendPacket(self, pkt):
         """Send a packet to a RADIUS server.
 
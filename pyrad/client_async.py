@@ -4,8 +4,10 @@
 
 __docformat__ = "epytext en"
 
-from datetime import datetime
 import asyncio
+import collections
+import heapq
+import itertools
 import logging
 import random
 
@@ -31,62 +33,81 @@ class DatagramProtocolClient(asyncio.Protocol):
         random_generator = random.SystemRandom()
         self.packet_id = random_generator.randrange(0, 256)
 
-        self.timeout_future = None
-
-    async def __timeout_handler__(self):
-
-        try:
-
-            while True:
-
-                req2delete = []
-                now = datetime.now()
-                next_weak_up = self.timeout
-                # noinspection PyShadowingBuiltins
-                for id, req in self.pending_requests.items():
-
-                    secs = (req['send_date'] - now).seconds
-                    if secs > self.timeout:
-                        if req['retries'] == self.retries:
-                            self.logger.debug('[%s:%d] For request %d execute all retries', self.server, self.port, id)
-                            req['future'].set_exception(
-                                TimeoutError('Timeout on Reply')
-                            )
-                            req2delete.append(id)
-                        else:
-                            # Send again packet
-                            req['send_date'] = now
-                            req['retries'] += 1
-                            self.logger.debug('[%s:%d] For request %d execute retry %d', self.server, self.port, id, req['retries'])
-                            self.transport.sendto(req['packet'].RequestPacket())
-                    elif next_weak_up > secs:
-                        next_weak_up = secs
-
-                # noinspection PyShadowingBuiltins
-                for id in req2delete:
-                    # Remove request for map
-                    del self.pending_requests[id]
-
-                await asyncio.sleep(next_weak_up)
-
-        except asyncio.CancelledError:
-            pass
+        # Heap of (deadline, sequence, id) entries, ordered by deadline on
+        # the loop clock. Entries of answered requests are left in place
+        # and skipped when they expire.
+        self.timers = []
+        self.timer_sequence = itertools.count()
+        self.timer_handle = None
+        self.timer_deadline = None
+
+    def __schedule__(self, id, deadline):
+        heapq.heappush(self.timers, (deadline, next(self.timer_sequence), id))
+        if self.timer_deadline is None or deadline < self.timer_deadline:
+            self.__arm_timer__(deadline)
+
+    def __arm_timer__(self, deadline):
+        if self.timer_handle:
+            self.timer_handle.cancel()
+        self.timer_deadline = deadline
+        self.timer_handle = self.client.loop.call_at(
+            deadline, self.__timeout_handler__)
+
+    def __timeout_handler__(self):
+        self.timer_handle = None
+        self.timer_deadline = None
+        now = self.client.loop.time()
+
+        while self.timers and self.timers[0][0] <= now:
+            # noinspection PyShadowingBuiltins
+            (deadline, _, id) = heapq.heappop(self.timers)
+            req = self.pending_requests.get(id)
+            if req is None or req['deadline'] != deadline:
+                # Answered, or rescheduled by a later retry
+                continue
+
+            if req['future'].done():
+                del self.pending_requests[id]
+            elif req['retries'] == self.retries:
+                self.logger.debug('[%s:%d] For request %d execute all retries',
+                                  self.server, self.port, id)
+                req['future'].set_exception(
+                    TimeoutError('Timeout on Reply')
+                )
+                del self.pending_requests[id]
+            else:
+                # Send again packet
+                req['retries'] += 1
+                req['deadline'] = now + self.timeout
+                self.logger.debug('[%s:%d] For request %d execute retry %d',
+                                  self.server, self.port, id, req['retries'])
+                self.transport.sendto(req['raw'])
+                heapq.heappush(self.timers, (req['deadline'],
+                                             next(self.timer_sequence), id))
+
+        if self.timers:
+            self.__arm_timer__(self.timers[0][0])
 
     def send_packet(self, packet, future):
-        if packet.id in self.pending_requests:
+        pending = self.pending_requests.get(packet.id)
+        if pending is not None and not pending['future'].done():
             raise Exception('Packet with id %d already present' % packet.id)
 
-        # Store packet on pending requests map
+        deadline = self.client.loop.time() + self.timeout
+        # Store packet on pending requests map, with its encoding for
+        # retransmissions
+        raw = packet.RequestPacket()
         self.pending_requests[packet.id] = {
             'packet': packet,
-            'creation_date': datetime.now(),
+            'raw': raw,
             'retries': 0,
             'future': future,
-            'send_date': datetime.now()
+            'deadline': deadline
         }
 
         # In queue packet raw on socket buffer
-        self.transport.sendto(packet.RequestPacket())
+        self.transport.sendto(raw)
+        self.__schedule__(packet.id, deadline)
 
     def connection_made(self, transport):
         self.transport = transport
@@ -98,14 +119,6 @@ class DatagramProtocolClient(asyncio.Protocol):
                 socket.getsockname()[1]
         )
 
-        pre_loop = asyncio.get_event_loop()
-        asyncio.set_event_loop(loop=self.client.loop)
-        # Start asynchronous timer handler
-        self.timeout_future = asyncio.ensure_future(
-            self.__timeout_handler__()
-        )
-        asyncio.set_event_loop(loop=pre_loop)
-
     def error_received(self, exc):
         self.logger.error('[%s:%d] Error received: %s', self.server, self.port, exc)
 
@@ -144,10 +157,11 @@ class DatagramProtocolClient(asyncio.Protocol):
             self.logger.debug('[%s:%d] Closing transport...', self.server, self.port)
             self.transport.close()
             self.transport = None
-        if self.timeout_future:
-            self.timeout_future.cancel()
-            await self.timeout_future
-            self.timeout_future = None
+        if self.timer_handle:
+            self.timer_handle.cancel()
+            self.timer_handle = None
+            self.timer_deadline = None
+        self.timers = []
 
     def create_id(self):
         self.packet_id = (self.packet_id + 1) % 256
@@ -161,6 +175,48 @@ class DatagramProtocolClient(asyncio.Protocol):
         return self
 
 
+class IdentifierPool:
+    """Free list of (protocol, packet id) pairs.
+    Every transport has its own source port and therefore its own 256
+    packet identifiers. Pooling the identifiers of several transports to
+    the same server port allows more than 256 requests in flight.
+
+    :ivar protocols: transports whose identifiers are pooled
+    :type protocols: list of DatagramProtocolClient
+    """
+
+    def __init__(self):
+        self.protocols = []
+        self.free = collections.deque()
+
+    def add_protocol(self, protocol):
+        self.protocols.append(protocol)
+        self.free.extend((protocol, id) for id in range(256))
+
+    def clear(self):
+        self.protocols = []
+        self.free.clear()
+
+    def acquire(self):
+        """Take a free identifier.
+
+        :return: transport and packet id to use
+        :rtype:  tuple of DatagramProtocolClient and integer
+        """
+        if not self.free:
+            raise Exception('No free packet identifier')
+        return self.free.popleft()
+
+    # noinspection PyShadowingBuiltins
+    def release(self, protocol, id):
+        """Return an identifier to the pool once its request completed.
+        Identifiers of transports that have since been removed are
+        dropped.
+        """
+        if protocol in self.protocols:
+            self.free.append((protocol, id))
+
+
 class ClientAsync:
     """Basic RADIUS client.
     This class implements a basic RADIUS client. It can send requests
@@ -170,13 +226,13 @@ class ClientAsync:
     :ivar retries: number of times to retry sending a RADIUS request
     :type retries: integer
     :ivar timeout: number of seconds to wait for an answer
-    :type timeout: integer
+    :type timeout: float
     """
     # noinspection PyShadowingBuiltins
     def __init__(self, server, auth_port=1812, acct_port=1813,
                  coa_port=3799, secret=b'', dict=None,
                  loop=None, retries=3, timeout=30,
-                 logger_name='pyrad'):
+                 logger_name='pyrad', sockets_per_port=1):
 
         """Constructor.
 
@@ -194,6 +250,17 @@ class ClientAsync:
         :type       dict: pyrad.dictionary.Dictionary
         :param      loop: Python loop handler
         :type       loop:  asyncio event loop
+        :param   retries: number of times to retry sending a request
+        :type    retries: integer
+        :param   timeout: seconds to wait for a reply before sending a
+                          request again, fractions are allowed
+        :type    timeout: float
+        :param sockets_per_port: number of source sockets to open per
+                          server port. With more than one socket,
+                          SendPacket assigns every packet a free (socket,
+                          id) pair, overriding the packet id, so more than
+                          256 requests can be in flight.
+        :type  sockets_per_port: integer
         """
         if not loop:
             self.loop = asyncio.get_event_loop()
@@ -207,14 +274,19 @@ class ClientAsync:
         self.timeout = timeout
         self.dict = dict
 
+        self.sockets_per_port = sockets_per_port
+
         self.auth_port = auth_port
         self.protocol_auth = None
+        self.auth_pool = IdentifierPool()
 
         self.acct_port = acct_port
         self.protocol_acct = None
+        self.acct_pool = IdentifierPool()
 
         self.protocol_coa = None
         self.coa_port = coa_port
+        self.coa_pool = IdentifierPool()
 
     async def initialize_transports(self, enable_acct=False,
                                     enable_auth=False, enable_coa=False,
@@ -227,88 +299,71 @@ class ClientAsync:
             raise Exception('No transports selected')
 
         if enable_acct and not self.protocol_acct:
-            self.protocol_acct = DatagramProtocolClient(
-                self.server,
-                self.acct_port,
-                self.logger, self,
-                retries=self.retries,
-                timeout=self.timeout
-            )
-            bind_addr = None
-            if local_addr and local_acct_port:
-                bind_addr = (local_addr, local_acct_port)
-
-            acct_connect = self.loop.create_datagram_endpoint(
-                self.protocol_acct,
-                reuse_port=True,
-                remote_addr=(self.server, self.acct_port),
-                local_addr=bind_addr
-            )
-            task_list.append(acct_connect)
+            task_list.extend(self.__create_transports__(
+                self.acct_port, self.acct_pool, local_addr, local_acct_port))
+            self.protocol_acct = self.acct_pool.protocols[0]
 
         if enable_auth and not self.protocol_auth:
-            self.protocol_auth = DatagramProtocolClient(
-                self.server,
-                self.auth_port,
-                self.logger, self,
-                retries=self.retries,
-                timeout=self.timeout
-            )
-            bind_addr = None
-            if local_addr and local_auth_port:
-                bind_addr = (local_addr, local_auth_port)
-
-            auth_connect = self.loop.create_datagram_endpoint(
-                self.protocol_auth,
-                reuse_port=True,
-                remote_addr=(self.server, self.auth_port),
-                local_addr=bind_addr
-            )
-            task_list.append(auth_connect)
+            task_list.extend(self.__create_transports__(
+                self.auth_port, self.auth_pool, local_addr, local_auth_port))
+            self.protocol_auth = self.auth_pool.protocols[0]
 
         if enable_coa and not self.protocol_coa:
-            self.protocol_coa = DatagramProtocolClient(
+            task_list.extend(self.__create_transports__(
+                self.coa_port, self.coa_pool, local_addr, local_coa_port))
+            self.protocol_coa = self.coa_pool.protocols[0]
+
+        await asyncio.ensure_future(
+            asyncio.gather(
+                *task_list,
+                return_exceptions=False,
+            ),
+            loop=self.loop
+        )
+
+    def __create_transports__(self, port, pool, local_addr, local_port):
+        task_list = []
+        for index in range(self.sockets_per_port):
+            protocol = DatagramProtocolClient(
                 self.server,
-                self.coa_port,
+                port,
                 self.logger, self,
                 retries=self.retries,
                 timeout=self.timeout
             )
             bind_addr = None
-            if local_addr and local_coa_port:
-                bind_addr = (local_addr, local_coa_port)
+            if local_addr and local_port:
+                # Only the first socket can use the requested source port
+                bind_addr = (local_addr, local_port if index == 0 else 0)
 
-            coa_connect = self.loop.create_datagram_endpoint(
-                self.protocol_coa,
+            connect = self.loop.create_datagram_endpoint(
+                protocol,
                 reuse_port=True,
-                remote_addr=(self.server, self.coa_port),
+                remote_addr=(self.server, port),
                 local_addr=bind_addr
             )
-            task_list.append(coa_connect)
-
-        await asyncio.ensure_future(
-            asyncio.gather(
-                *task_list,
-                return_exceptions=False,
-            ),
-            loop=self.loop
-        )
+            pool.add_protocol(protocol)
+            task_list.append(connect)
+        return task_list
 
     # noinspection SpellCheckingInspection
     async def deinitialize_transports(self, deinit_coa=True,
                                       deinit_auth=True,
                                       deinit_acct=True):
         if self.protocol_coa and deinit_coa:
-            await self.protocol_coa.close_transport()
-            del self.protocol_coa
+            for protocol in self.coa_pool.protocols:
+                await protocol.close_transport()
+            self.coa_pool.clear()
             self.protocol_coa = None
         if self.protocol_auth and deinit_auth:
-            await self.protocol_auth.close_transport()
-            del self.protocol_auth
+            for protocol in self.auth_pool.protocols:
+                await protocol.close_transport()
+            self.auth_pool.clear()
             self.protocol_auth = None
         if self.protocol_acct and deinit_acct:
-            await self.protocol_acct.close_transport()
-            del self.protocol_acct
+            for protocol in self.acct_pool.protocols:
+                await protocol.close_transport()
+            self.acct_pool.clear()
             self.protocol_acct = None
 
     # noinspection PyPep8Naming
@@ -391,21 +446,36 @@ class ClientAsync:
             if not self.protocol_auth:
                 raise Exception('Transport not initialized')
 
-            self.protocol_auth.send_packet(pkt, ans)
+            self.__send_packet__(self.protocol_auth, self.auth_pool, pkt, ans)
 
         elif isinstance(pkt, AcctPacket):
             if not self.protocol_acct:
                 raise Exception('Transport not initialized')
 
-            self.protocol_acct.send_packet(pkt, ans)
+            self.__send_packet__(self.protocol_acct, self.acct_pool, pkt, ans)
 
         elif isinstance(pkt, CoAPacket):
             if not self.protocol_coa:
                 raise Exception('Transport not initialized')
 
-            self.protocol_coa.send_packet(pkt, ans)
+            self.__send_packet__(self.protocol_coa, self.coa_pool, pkt, ans)
 
         else:
             raise Exception('Unsupported packet')
 
         return ans
+
+    def __send_packet__(self, protocol, pool, pkt, ans):
+        if self.sockets_per_port == 1:
+            protocol.send_packet(pkt, ans)
+            return
+
+        # noinspection PyShadowingBuiltins
+        (protocol, id) = pool.acquire()
+        pkt.id = id
+        try:
+            protocol.send_packet(pkt, ans)
+        except Exception:
+            pool.release(protocol, id)
+            raise
+        ans.add_done_callback(lambda future: pool.release(protocol, id))
@@ -1,150 +1,72 @@
-class Vsa:
-    def __init__(self, datatype, length, vendor_id, attributes):
-        self._type = datatype
-        self._len = length
-        self._vendor_id = vendor_id
-        self._attributes: tuple[Tlv] = attributes
-
-    @property
-    def datatype(self):
-        return self._type
-
-    @datatype.setter
-    def datatype(self, datatype):
-        self._type = datatype
+class _Value:
+    """Base of the structured attribute values. Subclasses list their
+    fields in __slots__, so values carry no per-instance dictionary."""
+    __slots__ = ()
 
-    @property
-    def length(self):
-        return self._len
+    def _Fields(self):
+        return tuple(getattr(self, name) for name in self._fields)
 
-    @length.setter
-    def length(self, length):
-        self._len = length
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._Fields() == other._Fields()
 
-    @property
-    def vendor_id(self):
-        return self._vendor_id
+    def __hash__(self):
+        # Lists of sub attributes hash as tuples
+        return hash(tuple(tuple(field) if isinstance(field, list) else field
+                          for field in self._Fields()))
 
-    @vendor_id.setter
-    def vendor_id(self, vendor_id):
-        self._vendor_id = vendor_id
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join(map(repr, self._Fields())))
 
-    @property
-    def attributes(self):
-        return self._attributes
 
-    @attributes.setter
-    def attributes(self, attributes):
-        self._attributes = attributes
+class Vsa(_Value):
+    __slots__ = ('datatype', 'length', 'vendor_id', 'attributes')
+    _fields = __slots__
 
-class Tlv:
-    def __init__(self, datatype, length, value):
-        self._type: int = datatype
-        self._len: int = length
-        self._val: any = value
-
-    @property
-    def datatype(self):
-        return self._type
+    def __init__(self, datatype, length, vendor_id, attributes):
+        self.datatype: int = datatype
+        self.length: int = length
+        self.vendor_id: int = vendor_id
+        self.attributes: list[Tlv] = attributes
 
-    @datatype.setter
-    def datatype(self, datatype):
-        self._type = datatype
 
-    @property
-    def length(self):
-        return self._len
+class Tlv(_Value):
+    __slots__ = ('datatype', 'length', 'value')
+    _fields = __slots__
 
-    @length.setter
-    def length(self, length):
-        self._len = length
+    def __init__(self, datatype, length, value):
+        self.datatype: int = datatype
+        self.length: int = length
+        self.value: any = value
 
-    @property
-    def value(self):
-        return self._val
 
-    @value.setter
-    def value(self, value):
-        self._val = value
+class Extended(_Value):
+    __slots__ = ('datatype', 'length', 'extended_type', 'value')
+    _fields = __slots__
 
-class Extended:
     def __init__(self, datatype, length, extended_type, value):
-        self._type: int = datatype
-        self._len = length
-        self._extended_type = extended_type
-        self._val: any = value
-
-    @property
-    def datatype(self):
-        return self._type
-
-    @datatype.setter
-    def datatype(self, datatype):
-        self._type = datatype
-
-    @property
-    def length(self):
-        return self._len
-
-    @length.setter
-    def length(self, length):
-        self._len = length
+        self.datatype: int = datatype
+        self.length: int = length
+        self.extended_type: int = extended_type
+        self.value: any = value
 
-    @property
-    def extended_type(self):
-        return self._extended_type
-
-    @extended_type.setter
-    def extended_type(self, extended_type):
-        self._extended_type = extended_type
-
-    @property
-    def value(self):
-        return self._val
-
-    @value.setter
-    def value(self, value):
-        self._val = value
 
 class LongExtended(Extended):
+    __slots__ = ('more',)
+    _fields = ('datatype', 'length', 'extended_type', 'more', 'value')
+
     def __init__(self, datatype, length, extended_type, more, value):
         Extended.__init__(self, datatype, length, extended_type, value)
-        self._more = more
+        self.more: bool = more
 
-    @property
-    def more(self):
-        return self._more
 
-    @more.setter
-    def more(self, more):
-        self._more = more
+class Evs(_Value):
+    __slots__ = ('vendor_id', 'evs_type', 'evs_value')
+    _fields = __slots__
 
-class Evs:
     def __init__(self, vendor_id, evs_type, evs_value):
-        self._vendor_id = vendor_id
-        self._evs_type = evs_type
-        self._evs_value = evs_value
-
-    @property
-    def vendor_id(self):
-        return self._vendor_id
-
-    @vendor_id.setter
-    def vendor_id(self, vendor_id):
-        self._vendor_id = vendor_id
-
-    @property
-    def evs_type(self):
-        return self._evs_type
-
-    @evs_type.setter
-    def evs_type(self, evs_type):
-        self._evs_type = evs_type
-
-    @property
-    def evs_value(self):
-        return self._evs_value
-
-    @evs_value.setter
-    def evs_value(self, evs_value):
-        self._evs_value = evs_value
\ No newline at end of file
+        self.vendor_id: int = vendor_id
+        self.evs_type: int = evs_type
+        self.evs_value: any = evs_value
@@ -8,6 +8,8 @@ Implements an iterable file format that handles the
 RADIUS $INCLUDE directives behind the scene.
 """
 
+import hashlib
+import io
 import os
 
 
@@ -41,8 +43,12 @@ class DictFile(object):
 
     An iterable file type that handles $INCLUDE
     directives internally.
+
+    For every file read, C{states} records its path, the modification
+    time and size it had before it was read, and the SHA-256 digest of
+    the content that was read.
     """
-    __slots__ = ('stack')
+    __slots__ = ('stack', 'files', 'states')
 
     def __init__(self, fil):
         """
@@ -50,6 +56,8 @@ class DictFile(object):
         @type fil: string or file
         """
         self.stack = []
+        self.files = []
+        self.states = []
         self.__ReadNode(fil)
 
     def __ReadNode(self, fil):
@@ -59,9 +67,14 @@ class DictFile(object):
                 fname = fil
             else:
                 fname = os.path.join(parentdir, fil)
-            fd = open(fname, "rt")
-            node = _Node(fd, fil, parentdir)
-            fd.close()
+            with open(fname, "rb") as fd:
+                st = os.fstat(fd.fileno())
+                data = fd.read()
+            node = _Node(io.TextIOWrapper(io.BytesIO(data)), fil, parentdir)
+            path = os.path.realpath(fname)
+            self.files.append(path)
+            self.states.append((path, st.st_mtime_ns, st.st_size,
+                                hashlib.sha256(data).hexdigest()))
         else:
             node = _Node(fil, '', parentdir)
         self.stack.append(node)
@@ -96,6 +109,29 @@ class DictFile(object):
         else:
             return ''
 
+    def Tokens(self):
+        """Iterate over the statements of the dictionary files.
+        Every line is tokenized once, with comments and empty lines
+        skipped and $INCLUDE directives followed.
+
+        :return: file name, line number and tokens of each statement
+        :rtype:  generator of (string, integer, list of strings) tuples
+        """
+        while self.stack:
+            node = self.stack[-1]
+            if node.current >= node.length:
+                self.stack.pop()
+                continue
+            line = node.lines[node.current]
+            node.current += 1
+            tokens = line.split('#', 1)[0].split()
+            if not tokens:
+                continue
+            if tokens[0].upper() == '$INCLUDE':
+                self.__ReadNode(' '.join(tokens[1:]))
+                continue
+            yield (node.name, node.current, tokens)
+
     def __iter__(self):
         return self
 
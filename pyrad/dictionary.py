@@ -80,12 +80,20 @@ These datatypes are parsed but not supported:
 from pyrad import bidict
 from pyrad import tools
 from pyrad import dictfile
-from copy import copy
+import hashlib
 import logging
+import os
+import pickle
 from pyrad import varlenparser
 
 __docformat__ = 'epytext en'
 
+logger = logging.getLogger('pyrad')
+
+# Version of the compiled dictionary cache format. Caches written with
+# another version are ignored.
+CACHE_VERSION = 1
+
 
 DATATYPES = frozenset(['string', 'ipaddr', 'integer', 'date', 'octets',
                        'abinary', 'ipv6addr', 'ipv6prefix', 'short', 'byte',
@@ -126,12 +134,21 @@ class ParseError(Exception):
 
 
 class Attribute(object):
+    """Attribute definition.
+
+    :ivar encoder: encode a value of this attribute to its wire format
+    :type encoder: callable
+    :ivar decoder: decode the wire format of this attribute to a value
+    :type decoder: callable
+    """
     def __init__(self, name, code, datatype, is_sub_attribute=False, vendor='', values=None,
-                 encrypt=0, has_tag=False):
-        datatype, length = varlenparser.VarLenParser().start(datatype)
+                 encrypt=0, has_tag=False, attrcodes=None):
+        datatype, length = varlenparser.ParseDataType(datatype)
 
         if datatype not in DATATYPES:
             raise ValueError('Invalid data type')
+        self.encoder, self.decoder = tools.CompileCodec(datatype, attrcodes)
+        self._attrcodes = attrcodes
         self.name = name
         self.code = code
         self.type = datatype
@@ -146,6 +163,88 @@ class Attribute(object):
             for (key, value) in values.items():
                 self.values.Add(key, value)
 
+    def __getstate__(self):
+        # The compiled codecs are closures and cannot be pickled.
+        state = self.__dict__.copy()
+        del state['encoder']
+        del state['decoder']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.encoder, self.decoder = tools.CompileCodec(self.type,
+                                                        self._attrcodes)
+
+
+class ResolvedAttribute(object):
+    """An attribute together with its packet keys, as returned by
+    :obj:`KeyResolver`.
+
+    :ivar attribute: the attribute
+    :type attribute: Attribute
+    :ivar key:       key of the attribute in packets
+    :type key:       integer, (vendor code, attribute code) tuple or string
+    :ivar packed:    key packed into an integer by
+                     :obj:`pyrad.tools.PackKey`
+    :type packed:    integer
+    """
+    __slots__ = ('attribute', 'key', 'packed')
+
+    def __init__(self, attribute, key, packed):
+        self.attribute = attribute
+        self.key = key
+        self.packed = packed
+
+
+class KeyResolver(dict):
+    """Map attribute names to :obj:`ResolvedAttribute` entries. Each name
+    is resolved against the dictionary the first time it is looked up,
+    so later lookups cost a single dictionary access.
+    """
+
+    def __init__(self, dictionary):
+        """
+        :param dictionary: dictionary to resolve names with
+        :type dictionary:  Dictionary or SharedDictionary
+        """
+        dict.__init__(self)
+        self.dictionary = dictionary
+        self.names = {}
+
+    def __missing__(self, name):
+        attr = self.dictionary.attributes[name]
+        if attr.vendor and not attr.is_sub_attribute:
+            key = (self.dictionary.vendors.GetForward(attr.vendor), attr.code)
+        else:
+            key = attr.code
+        try:
+            packed = tools.PackKey(key)
+        except (TypeError, ValueError):
+            packed = None
+        resolved = self[name] = ResolvedAttribute(attr, key, packed)
+        return resolved
+
+    def Name(self, key):
+        """Return the name of the attribute with a packet key, or the
+        key itself if it is unknown.
+
+        :param key: packet key
+        :type key:  integer, (vendor code, attribute code) tuple or string
+        """
+        try:
+            return self.names[key]
+        except KeyError:
+            pass
+        attrindex = self.dictionary.attrindex
+        if not attrindex.HasBackward(key):
+            return key
+        name = self.names[key] = attrindex.GetBackward(key)
+        return name
+
+    def clear(self):
+        dict.clear(self)
+        self.names.clear()
+
 
 class Dictionary(object):
     """RADIUS dictionary class.
@@ -158,31 +257,120 @@ class Dictionary(object):
     :type attrindex:  bidict
     :ivar attributes: bidict mapping attribute name to attribute class
     :type attributes: bidict
+    :ivar files:      paths of all dictionary files read, including
+                      $INCLUDE files
+    :type files:      list of strings
+    :ivar resolver:   attribute names resolved to their packet keys
+    :type resolver:   KeyResolver
     """
 
-    def __init__(self, dict=None, *dicts):
+    def __init__(self, dict=None, *dicts, cache=None):
         """
+        The parsed dictionary can be kept in a compiled cache file. The
+        cache is used instead of parsing when the files it was built
+        from, including $INCLUDE files, are unchanged: their size and
+        modification time match, or else their content hash does.
+        Otherwise the dictionaries are parsed and the cache is written
+        again. The cache is a pickle, so it must not be writable by
+        untrusted users. It is only used when all dictionaries are given
+        as paths.
+
         :param dict:  path of dictionary file or file-like object to read
         :type dict:   string or file
         :param dicts: list of dictionaries
         :type dicts:  sequence of strings or files
+        :param cache: path of the compiled dictionary cache
+        :type cache:  string
         """
         self.vendors = bidict.BiDict()
         self.vendors.Add('', 0)
         self.attrindex = bidict.BiDict()
         self.attributes = {}
         self.defer_parse = []
+        self.files = []
+        self.__file_states = []
+        self.resolver = KeyResolver(self)
 
         self.attrcodes = bidict.BiDict()
 
         self.varlen_parser = varlenparser.VarLenParser()
 
-        if dict:
-            self.ReadDictionary(dict)
+        sources = ([dict] if dict else []) + list(dicts)
+        if cache and not all(isinstance(i, str) for i in sources):
+            cache = None
+        if cache:
+            sources = [os.path.realpath(i) for i in sources]
+            if self.__LoadCache(cache, sources):
+                return
 
-        for i in dicts:
+        for i in sources:
             self.ReadDictionary(i)
 
+        if cache:
+            self.__SaveCache(cache, sources)
+
+    @staticmethod
+    def __FileDigest(path):
+        with open(path, 'rb') as fd:
+            return hashlib.sha256(fd.read()).hexdigest()
+
+    def __LoadCache(self, cache, sources):
+        try:
+            with open(cache, 'rb') as fd:
+                snapshot = pickle.load(fd)
+            if snapshot['version'] != CACHE_VERSION or \
+                    snapshot['sources'] != sources:
+                return False
+            states = []
+            refreshed = False
+            for (path, mtime, size, digest) in snapshot['files']:
+                st = os.stat(path)
+                if (st.st_mtime_ns, st.st_size) != (mtime, size):
+                    if st.st_size != size or \
+                            self.__FileDigest(path) != digest:
+                        return False
+                    # Touched but unchanged: store the new state so the
+                    # next load does not hash the file again.
+                    mtime = st.st_mtime_ns
+                    refreshed = True
+                states.append((path, mtime, size, digest))
+        except Exception:
+            return False
+
+        self.vendors = snapshot['vendors']
+        self.attrindex = snapshot['attrindex']
+        self.attributes = snapshot['attributes']
+        self.attrcodes = snapshot['attrcodes']
+        self.files = [path for (path, _, _, _) in states]
+        self.__file_states = states
+        if refreshed:
+            self.__SaveCache(cache, sources)
+        return True
+
+    def __SaveCache(self, cache, sources):
+        tmp = '%s.%d.tmp' % (cache, os.getpid())
+        try:
+            # The states were taken when the files were read, so a file
+            # changed after parsing does not match the cache.
+            snapshot = {
+                'version': CACHE_VERSION,
+                'sources': sources,
+                'files': self.__file_states,
+                'vendors': self.vendors,
+                'attrindex': self.attrindex,
+                'attributes': self.attributes,
+                'attrcodes': self.attrcodes,
+            }
+            with open(tmp, 'wb') as fd:
+                pickle.dump(snapshot, fd, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache)
+        except OSError as err:
+            logger.warning('Cannot write dictionary cache %s: %s', cache, err)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
     def __len__(self):
         return len(self.attributes)
 
@@ -239,28 +427,31 @@ class Dictionary(object):
 
         self.attrcodes.Add(code, datatype)
 
-        codes = code.split('.')
-
-        # Codes can be sent as hex, or octal or decimal string representations.
-        tmp = []
-        for c in codes:
-          if not c: # TODO :: add parsing for implicit parent codes
-            pass
-          elif c.startswith('0x'):
-            tmp.append(int(c, 16))
-          elif c.startswith('0o'):
-            tmp.append(int(c, 8))
-          else:
-            tmp.append(int(c, 10))
-        codes = tmp
+        if code.isdigit():
+            codes = [int(code)]
+        else:
+            # Codes can be sent as hex, or octal or decimal string representations.
+            codes = []
+            for c in code.split('.'):
+              if not c: # TODO :: add parsing for implicit parent codes
+                pass
+              elif c.startswith('0x'):
+                codes.append(int(c, 16))
+              elif c.startswith('0o'):
+                codes.append(int(c, 8))
+              else:
+                codes.append(int(c, 10))
 
         is_sub_attribute = (len(codes) > 1)
         code = int(codes[-1])
         parent_codes = [c for c in codes[:-1]]
 
-        datatype = datatype.split("[")[0]
-
-        datatype, length = self.varlen_parser.start(datatype)
+        try:
+            datatype, length = varlenparser.ParseDataType(datatype)
+        except ValueError:
+            raise ParseError('Illegal type: ' + datatype,
+                             file=state['file'],
+                             line=state['line'])
         if datatype not in DATATYPES:
             raise ParseError('Illegal type: ' + datatype,
                              file=state['file'],
@@ -277,7 +468,8 @@ class Dictionary(object):
                 key = code
 
         self.attrindex.Add(attribute, key)
-        self.attributes[attribute] = Attribute(attribute, code, datatype, is_sub_attribute, vendor, encrypt=encrypt, has_tag=has_tag)
+        self.attributes[attribute] = Attribute(attribute, code, datatype, is_sub_attribute, vendor, encrypt=encrypt, has_tag=has_tag,
+                                               attrcodes=self.attrcodes)
         if datatype == 'tlv' or datatype == 'evs':
             # save attribute in tlvs
             state['tlvs'][code] = self.attributes[attribute]
@@ -297,7 +489,7 @@ class Dictionary(object):
             child_attribute.parent = state['tlvs'][parent_codes[0]]
             return state['tlvs'][parent_codes[0]]
 
-    def __ParseValue(self, state, tokens, defer):
+    def __ParseValue(self, state, tokens, defer=True):
         if len(tokens) != 4:
             raise ParseError('Incorrect number of tokens for value definition',
                              file=state['file'],
@@ -309,7 +501,8 @@ class Dictionary(object):
             adef = self.attributes[attr]
         except KeyError:
             if defer:
-                self.defer_parse.append((copy(state), copy(tokens)))
+                self.defer_parse.append((state['file'], state['line'],
+                                         tokens))
                 return
             raise ParseError('Value defined for unknown attribute ' + attr,
                              file=state['file'],
@@ -317,8 +510,8 @@ class Dictionary(object):
 
         if adef.type in ['integer', 'signed', 'short', 'byte', 'integer64']:
             value = int(value, 0)
-        value = tools.EncodeAttr(adef.type, value, self.attrcodes)
-        self.attributes[attr].values.Add(key, value)
+        value = adef.encoder(value)
+        adef.values.Add(key, value)
 
     def __ParseVendor(self, state, tokens):
         if len(tokens) not in [3, 4]:
@@ -403,34 +596,29 @@ class Dictionary(object):
         """
 
         fil = dictfile.DictFile(file)
+        self.resolver.clear()
 
         state = {}
         state['vendor'] = ''
         state['tlvs'] = {}
         self.defer_parse = []
-        for line in fil:
-            state['file'] = fil.File()
-            state['line'] = fil.Line()
-            line = line.split('#', 1)[0].strip()
-
-            tokens = line.split()
-            if not tokens:
-                continue
-
-            key = tokens[0].upper()
-            if key == 'ATTRIBUTE':
-                self.__ParseAttribute(state, tokens)
-            elif key == 'VALUE':
-                self.__ParseValue(state, tokens, True)
-            elif key == 'VENDOR':
-                self.__ParseVendor(state, tokens)
-            elif key == 'BEGIN-VENDOR':
-                self.__ParseBeginVendor(state, tokens)
-            elif key == 'END-VENDOR':
-                self.__ParseEndVendor(state, tokens)
-
-        for state, tokens in self.defer_parse:
-            key = tokens[0].upper()
-            if key == 'VALUE':
-                self.__ParseValue(state, tokens, False)
+        handlers = {
+            'ATTRIBUTE': self.__ParseAttribute,
+            'VALUE': self.__ParseValue,
+            'VENDOR': self.__ParseVendor,
+            'BEGIN-VENDOR': self.__ParseBeginVendor,
+            'END-VENDOR': self.__ParseEndVendor,
+        }
+        for (filename, line, tokens) in fil.Tokens():
+            handler = handlers.get(tokens[0].upper())
+            if handler is not None:
+                state['file'] = filename
+                state['line'] = line
+                handler(state, tokens)
+
+        for (filename, line, tokens) in self.defer_parse:
+            state = {'file': filename, 'line': line}
+            self.__ParseValue(state, tokens, False)
         self.defer_parse = []
+        self.files.extend(fil.files)
+        self.__file_states.extend(fil.states)
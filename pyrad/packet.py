@@ -4,6 +4,7 @@
 #
 # A RADIUS packet as defined in RFC 2138
 
+from array import array
 from collections import OrderedDict
 import struct
 try:
@@ -27,6 +28,7 @@ except ImportError:
     # BBB for python 2.4
     import md5
     md5_constructor = md5.new
+import functools
 from pyrad import tools
 
 # Packet codes
@@ -48,6 +50,42 @@ CoANAK = 45
 # Current ID
 CurrentID = random_generator.randrange(1, 255)
 
+# Precompiled wire formats
+_HEADER = struct.Struct('!BBH16s')
+_ATTR_HEADER = struct.Struct('!BB')
+_LENGTH_HEADER = struct.Struct('!BBH')
+_VSA_HEADER = struct.Struct('!LBB')
+_UINT32 = struct.Struct('!L')
+
+# Number of shared secrets for which primed hash contexts are kept.
+_SECRET_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=_SECRET_CACHE_SIZE)
+def _PrimedContexts(secret):
+    return (md5_constructor(secret), hmac_new(secret))
+
+
+def _SecretMd5(secret):
+    """Return an MD5 context that has already hashed the secret.
+
+    :param secret: RADIUS secret
+    :type secret:  bytes
+    :rtype:        hashlib MD5 object
+    """
+    return _PrimedContexts(secret)[0].copy()
+
+
+def _SecretHmac(secret):
+    """Return an HMAC-MD5 context keyed with the secret. The key setup
+    is done once per secret; every call returns a fresh copy.
+
+    :param secret: RADIUS secret
+    :type secret:  bytes
+    :rtype:        hmac.HMAC
+    """
+    return _PrimedContexts(secret)[1].copy()
+
 
 class PacketError(Exception):
     pass
@@ -68,6 +106,8 @@ class Packet(OrderedDict):
     Normally you will not use this class directly, but one of the
     :obj:`AuthPacket` or :obj:`AcctPacket` classes.
     """
+    _lazy_index = None
+    _lazy_data = None
 
     def __init__(self, code=0, id=None, secret=b'', authenticator=None,
                  **attributes):
@@ -83,6 +123,8 @@ class Packet(OrderedDict):
         :type code:    integer (8bits)
         :param packet: raw packet to decode
         :type packet:  string
+        :param lazy:   only decode attributes when they are accessed
+        :type lazy:    boolean
         """
         OrderedDict.__init__(self)
         self.code = code
@@ -109,14 +151,15 @@ class Packet(OrderedDict):
 
         if 'packet' in attributes:
             self.raw_packet = attributes['packet']
-            self.DecodePacket(self.raw_packet)
+            self.DecodePacket(self.raw_packet,
+                              lazy=attributes.get('lazy', False))
 
         if 'message_authenticator' in attributes:
             self.message_authenticator = attributes['message_authenticator']
 
         for (key, value) in attributes.items():
             if key in [
-                'dict', 'fd', 'packet',
+                'dict', 'fd', 'packet', 'lazy',
                 'message_authenticator',
             ]:
                 continue
@@ -141,32 +184,75 @@ class Packet(OrderedDict):
         return self.message_authenticator
 
     def _refresh_message_authenticator(self):
-        hmac_constructor = hmac_new(self.secret)
+        """Recalculate the Message-Authenticator attribute.
 
-        # Maintain a zero octets content for md5 and hmac calculation.
-        self['Message-Authenticator'] = 16 * b'\00'
-        attr = self._PktEncodeAttributes()
+        :return: encoded attributes, including the new Message-Authenticator
+        :rtype:  bytes
+        """
+        return bytes(self._PktEncodeSigned(True)[20:])
 
-        header = struct.pack('!BBH', self.code, self.id,
-                             (20 + len(attr)))
+    def _PktEncodeSigned(self, sign):
+        """Encode the packet header and attributes into one buffer.
 
-        hmac_constructor.update(header[0:4])
-        if self.code in (AccountingRequest, DisconnectRequest,
-                         CoARequest, AccountingResponse):
-            hmac_constructor.update(16 * b'\00')
-        else:
+        The attributes are encoded only once. If sign is true a zeroed
+        Message-Authenticator is encoded as a placeholder, the HMAC-MD5 is
+        calculated over the buffer and the digest is patched in place. The
+        authenticator field is left for the caller to fill in.
+
+        :param sign: calculate the Message-Authenticator
+        :type sign:  boolean
+        :return:     encoded packet
+        :rtype:      bytearray
+        """
+        if sign:
+            # Maintain a zero octets content for md5 and hmac calculation.
+            self['Message-Authenticator'] = 16 * b'\00'
+        (buf, offset) = self._PktEncodeAttributeBuffer(bytearray(20))
+        _LENGTH_HEADER.pack_into(buf, 0, self.code, self.id, len(buf))
+        if not sign:
+            return buf
+
+        if self.code not in (AccountingRequest, DisconnectRequest,
+                             CoARequest, AccountingResponse):
             # NOTE: self.authenticator on reply packet is initialized
             #       with request authenticator by design.
             #       For AccessAccept, AccessReject and AccessChallenge
             #       it is needed use original Authenticator.
-            #       For AccessAccept, AccessReject and AccessChallenge
-            #       it is needed use original Authenticator.
             if self.authenticator is None:
                 raise Exception('No authenticator found')
-            hmac_constructor.update(self.authenticator)
-
-        hmac_constructor.update(attr)
-        self['Message-Authenticator'] = hmac_constructor.digest()
+            authenticator = self.authenticator
+        else:
+            authenticator = 16 * b'\00'
+
+        with memoryview(buf) as view:
+            hmac_constructor = _SecretHmac(self.secret)
+            hmac_constructor.update(view[:4])
+            hmac_constructor.update(authenticator)
+            hmac_constructor.update(view[20:])
+        digest = hmac_constructor.digest()
+        buf[offset:offset + 16] = digest
+        self['Message-Authenticator'] = digest
+        return buf
+
+    def _PktAuthenticate(self, buf, authenticator):
+        """Calculate the MD5 authenticator of an encoded packet and store
+        it in the authenticator field.
+
+        :param buf:           encoded packet
+        :type buf:            bytearray
+        :param authenticator: authenticator field content to hash
+        :type authenticator:  bytes
+        :return:              calculated authenticator
+        :rtype:               bytes
+        """
+        with memoryview(buf) as view:
+            hash = md5_constructor(view[:4])
+            hash.update(authenticator)
+            hash.update(view[20:])
+        hash.update(self.secret)
+        digest = hash.digest()
+        buf[4:20] = digest
+        return digest
 
     def verify_message_authenticator(self, secret=None,
                                      original_authenticator=None,
@@ -208,7 +294,7 @@ class Packet(OrderedDict):
         header = struct.pack('!BBH', self.code, self.id,
                              (20 + len(attr)))
 
-        hmac_constructor = hmac_new(key)
+        hmac_constructor = _SecretHmac(key)
         hmac_constructor.update(header)
         if self.code in (AccountingRequest, DisconnectRequest,
                          CoARequest, AccountingResponse):
@@ -249,17 +335,15 @@ class Packet(OrderedDict):
             #salt decrypt attribute
             value = self.SaltDecrypt(value)
 
-        if attr.values.HasBackward(value):
-            return attr.values.GetBackward(value)
-        else:
-            return tools.DecodeAttr(attr.type, value, self.dict.attrcodes)
+        name = attr.values.backward.get(value)
+        if name is not None:
+            return name
+        return attr.decoder(value)
 
     def _EncodeValue(self, attr, value):
-        result = ''
-        if attr.values.HasForward(value):
-            result = attr.values.GetForward(value)
-        else:
-            result = tools.EncodeAttr(attr.type, value)
+        result = attr.values.forward.get(value)
+        if result is None:
+            result = attr.encoder(value)
 
         if attr.encrypt == 2:
             # salt encrypt attribute
@@ -275,8 +359,8 @@ class Packet(OrderedDict):
             values = [values]
 
         key, _, tag = key.partition(":")
-        attr = self.dict.attributes[key]
-        key = self._EncodeKey(key)
+        resolved = self.dict.resolver[key]
+        (attr, key) = (resolved.attribute, resolved.key)
         if tag:
             tag = struct.pack('B', int(tag))
             if attr.type == "integer":
@@ -289,19 +373,11 @@ class Packet(OrderedDict):
     def _EncodeKey(self, key):
         if not isinstance(key, str):
             return key
-
-        attr = self.dict.attributes[key]
-        if attr.vendor and not attr.is_sub_attribute:  #sub attribute keys don't need vendor
-            return (self.dict.vendors.GetForward(attr.vendor), attr.code)
-        else:
-            return attr.code
+        return self.dict.resolver[key].key
 
     def _DecodeKey(self, key):
         """Turn a key into a string if possible"""
-
-        if self.dict.attrindex.HasBackward(key):
-            return self.dict.attrindex.GetBackward(key)
-        return key
+        return self.dict.resolver.Name(key)
 
     def AddAttribute(self, key, value):
         """Add an attribute to the packet.
@@ -312,6 +388,7 @@ class Packet(OrderedDict):
         :param value: value
         :type value:  depends on type of attribute
         """
+        self._LazyMaterialize()
         attr = self.dict.attributes[key.partition(':')[0]]
 
         (key, value) = self._EncodeKeyValues(key, value)
@@ -333,10 +410,15 @@ class Packet(OrderedDict):
 
     def __getitem__(self, key):
         if not isinstance(key, str):
+            if self._lazy_index is not None:
+                self._LazyLoad(key)
             return OrderedDict.__getitem__(self, key)
 
-        values = OrderedDict.__getitem__(self, self._EncodeKey(key))
-        attr = self.dict.attributes[key]
+        resolved = self.dict.resolver[key]
+        if self._lazy_index is not None:
+            self._LazyLoad(resolved.key)
+        values = OrderedDict.__getitem__(self, resolved.key)
+        attr = resolved.attribute
         if attr.type == 'tlv':  # return map from sub attribute code to its values
             res = {}
             for (sub_attr_key, sub_attr_val) in values.items():
@@ -353,25 +435,97 @@ class Packet(OrderedDict):
 
     def __contains__(self, key):
         try:
-            return OrderedDict.__contains__(self, self._EncodeKey(key))
+            key = self._EncodeKey(key)
         except KeyError:
             return False
+        if self._lazy_index is not None:
+            self._LazyLoad(key)
+        return OrderedDict.__contains__(self, key)
 
     has_key = __contains__
 
     def __delitem__(self, key):
+        self._LazyMaterialize()
         OrderedDict.__delitem__(self, self._EncodeKey(key))
 
     def __setitem__(self, key, item):
+        self._LazyMaterialize()
         if isinstance(key, str):
             (key, item) = self._EncodeKeyValues(key, item)
             OrderedDict.__setitem__(self, key, item)
         else:
             OrderedDict.__setitem__(self, key, item)
 
+    def __iter__(self):
+        self._LazyMaterialize()
+        return OrderedDict.__iter__(self)
+
+    def __len__(self):
+        self._LazyMaterialize()
+        return OrderedDict.__len__(self)
+
+    def clear(self):
+        self._lazy_index = None
+        self._lazy_data = None
+        OrderedDict.clear(self)
+
+    def pop(self, *args):
+        self._LazyMaterialize()
+        return OrderedDict.pop(self, *args)
+
     def keys(self):
+        self._LazyMaterialize()
         return [self._DecodeKey(key) for key in OrderedDict.keys(self)]
 
+    def values(self):
+        self._LazyMaterialize()
+        return OrderedDict.values(self)
+
+    def items(self):
+        self._LazyMaterialize()
+        return OrderedDict.items(self)
+
+    def __reversed__(self):
+        self._LazyMaterialize()
+        return OrderedDict.__reversed__(self)
+
+    def __repr__(self):
+        self._LazyMaterialize()
+        return OrderedDict.__repr__(self)
+
+    def __eq__(self, other):
+        self._LazyMaterialize()
+        if isinstance(other, Packet):
+            other._LazyMaterialize()
+        return OrderedDict.__eq__(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = OrderedDict.__hash__
+
+    def copy(self):
+        self._LazyMaterialize()
+        return OrderedDict.copy(self)
+
+    def popitem(self, *args, **kwargs):
+        self._LazyMaterialize()
+        return OrderedDict.popitem(self, *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        self._LazyMaterialize()
+        for other in args:
+            if isinstance(other, Packet):
+                other._LazyMaterialize()
+        return OrderedDict.update(self, *args, **kwargs)
+
+    def move_to_end(self, key, last=True):
+        self._LazyMaterialize()
+        return OrderedDict.move_to_end(self, self._EncodeKey(key), last)
+
     @staticmethod
     def CreateAuthenticator():
         """Create a packet authenticator. All RADIUS packets contain a sixteen
@@ -411,16 +565,9 @@ class Packet(OrderedDict):
 
         assert(self.secret is not None)
 
-        if self.message_authenticator:
-            self._refresh_message_authenticator()
-
-        attr = self._PktEncodeAttributes()
-        header = struct.pack('!BBH', self.code, self.id, (20 + len(attr)))
-
-        authenticator = md5_constructor(header[0:4] + self.authenticator
-                                        + attr + self.secret).digest()
-
-        return header + authenticator + attr
+        buf = self._PktEncodeSigned(self.message_authenticator)
+        self._PktAuthenticate(buf, self.authenticator)
+        return bytes(buf)
 
     def VerifyReply(self, reply, rawreply=None):
         if reply.id != self.id:
@@ -455,71 +602,99 @@ class Packet(OrderedDict):
 
     def _PktEncodeTlv(self, tlv_key, tlv_value):
         tlv_attr = self.dict.attributes[self._DecodeKey(tlv_key)]
-        curr_avp = b''
+        curr_avp = []
+        curr_len = 0
         avps = []
-        max_sub_attribute_len = max(map(lambda item: len(item[1]), tlv_value.items()))
+        max_sub_attribute_len = max(map(len, tlv_value.values()))
         for i in range(max_sub_attribute_len):
-            sub_attr_encoding = b''
-            for (code, datalst) in tlv_value.items():
-                if i < len(datalst):
-                    sub_attr_encoding += self._PktEncodeAttribute(code, datalst[i])
+            sub_attr_encoding = b''.join(
+                self._PktEncodeAttribute(code, datalst[i])
+                for (code, datalst) in tlv_value.items() if i < len(datalst))
             # split above 255. assuming len of one instance of all sub tlvs is lower than 255
-            if (len(sub_attr_encoding) + len(curr_avp)) < 245:
-                curr_avp += sub_attr_encoding
+            if (len(sub_attr_encoding) + curr_len) < 245:
+                curr_avp.append(sub_attr_encoding)
+                curr_len += len(sub_attr_encoding)
             else:
-                avps.append(curr_avp)
-                curr_avp = sub_attr_encoding
-        avps.append(curr_avp)
-        tlv_avps = []
-        for avp in avps:
-            value = struct.pack('!BB', tlv_attr.code, (len(avp) + 2)) + avp
-            tlv_avps.append(value)
+                avps.append(b''.join(curr_avp))
+                curr_avp = [sub_attr_encoding]
+                curr_len = len(sub_attr_encoding)
+        avps.append(b''.join(curr_avp))
+
+        result = []
         if tlv_attr.vendor:
-            vendor_avps = b''
-            for avp in tlv_avps:
-                vendor_avps += struct.pack(
-                    '!BBL', 26, (len(avp) + 6),
-                    self.dict.vendors.GetForward(tlv_attr.vendor)
-                ) + avp
-            return vendor_avps
+            vendor = self.dict.vendors.GetForward(tlv_attr.vendor)
+            for avp in avps:
+                result.append(struct.pack('!BBLBB', 26, len(avp) + 8, vendor,
+                                          tlv_attr.code, len(avp) + 2))
+                result.append(avp)
         else:
-            return b''.join(tlv_avps)
-
-    def _PktEncodeAttributes(self):
-        result = b''
+            for avp in avps:
+                result.append(_ATTR_HEADER.pack(tlv_attr.code, len(avp) + 2))
+                result.append(avp)
+        return b''.join(result)
+
+    def _PktEncodeAttributeBuffer(self, buf=None):
+        """Encode all attributes into a single buffer.
+
+        The offset of the Message-Authenticator value is returned as well,
+        so callers can patch the digest in place once it is known.
+
+        :param buf: buffer to append the attributes to
+        :type buf:  bytearray
+        :return:    encoded attributes and Message-Authenticator value offset
+                    (None if the packet has no Message-Authenticator)
+        :rtype:     tuple of bytearray and integer
+        """
+        if buf is None:
+            buf = bytearray()
+        ma_offset = None
         for (code, datalst) in self.items():
-            attribute = self.dict.attributes.get(self._DecodeKey(code))
-            if attribute and attribute.type == 'tlv':
-                result += self._PktEncodeTlv(code, datalst)
+            # TLV attributes are stored as maps of their sub attributes
+            if isinstance(datalst, dict):
+                buf += self._PktEncodeTlv(code, datalst)
+            elif isinstance(code, tuple):
+                (vendor, subcode) = code
+                for data in datalst:
+                    buf += _ATTR_HEADER.pack(26, len(data) + 8)
+                    buf += _VSA_HEADER.pack(vendor, subcode, len(data) + 2)
+                    buf += data
             else:
                 for data in datalst:
-                    result += self._PktEncodeAttribute(code, data)
-        return result
+                    buf += _ATTR_HEADER.pack(code, len(data) + 2)
+                    if code == 80:
+                        ma_offset = len(buf)
+                    buf += data
+        return (buf, ma_offset)
+
+    def _PktEncodeAttributes(self):
+        return bytes(self._PktEncodeAttributeBuffer()[0])
 
     def _PktDecodeVendorAttribute(self, data):
         # Check if this packet is long enough to be in the
         # RFC2865 recommended form
         if len(data) < 6:
-            return [(26, data)]
+            return [(26, bytes(data))]
 
-        (vendor, atype, length) = struct.unpack('!LBB', data[:6])[0:3]
+        (vendor, atype, length) = _VSA_HEADER.unpack_from(data)
         attribute = self.dict.attributes.get(self._DecodeKey((vendor, atype)))
         try:
             if attribute and attribute.type == 'tlv':
                 self._PktDecodeTlvAttribute((vendor, atype), data[6:length + 4])
                 tlvs = []  # tlv is added to the packet inside _PktDecodeTlvAttribute
             else:
-                tlvs = [((vendor, atype), data[6:length + 4])]
+                tlvs = [((vendor, atype), bytes(data[6:length + 4]))]
         except:
-            return [(26, data)]
+            return [(26, bytes(data))]
 
         sumlength = 4 + length
         while len(data) > sumlength:
             try:
-                atype, length = struct.unpack('!BB', data[sumlength:sumlength+2])[0:2]
-            except:
-                return [(26, data)]
-            tlvs.append(((vendor, atype), data[sumlength+2:sumlength+length]))
+                atype, length = _ATTR_HEADER.unpack_from(data, sumlength)
+            except struct.error:
+                return [(26, bytes(data))]
+            if length < 2:
+                return [(26, bytes(data))]
+            tlvs.append(((vendor, atype), bytes(data[sumlength+2:sumlength+length])))
             sumlength += length
         return tlvs
 
@@ -528,20 +703,79 @@ class Packet(OrderedDict):
         loc = 0
 
         while loc < len(data):
-            atype, length = struct.unpack('!BB', data[loc:loc+2])[0:2]
-            sub_attributes.setdefault(atype, []).append(data[loc+2:loc+length])
+            atype, length = _ATTR_HEADER.unpack_from(data, loc)
+            if length < 2:
+                raise PacketError('TLV length is too small (%d)' % length)
+            sub_attributes.setdefault(atype, []).append(bytes(data[loc+2:loc+length]))
             loc += length
 
-    def DecodePacket(self, packet):
+    def _PktIsPlainAttribute(self, key):
+        """Check if an attribute can be stored without further decoding.
+
+        :param key: attribute type code
+        :type key:  integer
+        :return:    False for vendor, Message-Authenticator, extended
+                    and TLV attributes
+        :rtype:     boolean
+        """
+        if key in (26, 80):
+            return False
+        attribute = self.dict.attributes.get(self._DecodeKey(key))
+        return not (attribute and
+                    attribute.type in ('extended', 'long-extended', 'tlv'))
+
+    def _PktDecodeAttribute(self, key, value):
+        """Decode a single attribute and store it in the packet.
+
+        :param key:   attribute type code
+        :type key:    integer
+        :param value: attribute payload (without type and length)
+        :type value:  bytes-like object
+        """
+        if key == 26:
+            for (key, value) in self._PktDecodeVendorAttribute(value):
+                self.setdefault(key, []).append(value)
+            return
+        if key == 80:
+            # POST: Message Authenticator AVP is present.
+            self.message_authenticator = True
+            self.setdefault(key, []).append(bytes(value))
+            return
+
+        attribute = self.dict.attributes.get(self._DecodeKey(key))
+        datatype = attribute.type if attribute else None
+        if datatype == 'extended' and len(value) >= 1:
+            full_key = f'{key}.{value[0]}'
+            self.setdefault(full_key, []).append(bytes(value))
+        elif datatype == 'long-extended' and len(value) >= 2:
+            full_key = f'{key}.{value[0]}'
+            self._PktDecodeLongExtendedAttribute(full_key, value[1], bytes(value))
+        elif datatype == 'tlv':
+            self._PktDecodeTlvAttribute(key, value)
+        else:
+            self.setdefault(key, []).append(bytes(value))
+
+    def DecodePacket(self, packet, lazy=False):
         """Initialize the object from raw packet data.  Decode a packet as
         received from the network and decode it.
 
+        The packet is walked once with a moving offset over a
+        :obj:`memoryview`, so decoding time is linear in the number of
+        attributes.
+
+        In lazy mode only the header and the attribute framing are
+        validated. The offsets of the attributes are indexed and an
+        attribute is only decoded when it is looked up; any other use
+        of the mapping decodes the remaining attributes first.
+
         :param packet: raw packet
-        :type packet:  string"""
+        :type packet:  string
+        :param lazy:   defer attribute decoding until first access
+        :type lazy:    boolean"""
 
         try:
             (self.code, self.id, length, self.authenticator) = \
-                    struct.unpack('!BBH16s', packet[0:20])
+                    _HEADER.unpack_from(packet)
 
         except struct.error:
             raise PacketError('Packet header is corrupt')
@@ -552,10 +786,56 @@ class Packet(OrderedDict):
 
         self.clear()
 
-        packet = packet[20:]
-        while packet:
+        if lazy:
+            self._lazy_index = self._PktIndexAttributes(packet, length)
+            self._lazy_data = packet
+        else:
+            self._PktDecodeAttributes(packet, length)
+
+    def _PktDecodeAttributes(self, packet, length):
+        unpack_header = _ATTR_HEADER.unpack_from
+        setdefault = self.setdefault
+        plain_keys = {}
+        with memoryview(packet) as view:
+            offset = 20
+            while offset < length:
+                try:
+                    (key, attrlen) = unpack_header(view, offset)
+                except struct.error:
+                    raise PacketError('Attribute header is corrupt')
+
+                if attrlen < 2:
+                    raise PacketError(
+                            'Attribute length is too small (%d)' % attrlen)
+
+                plain = plain_keys.get(key)
+                if plain is None:
+                    plain = plain_keys[key] = self._PktIsPlainAttribute(key)
+                if plain:
+                    setdefault(key, []).append(
+                        bytes(view[offset + 2:offset + attrlen]))
+                else:
+                    self._PktDecodeAttribute(
+                        key, view[offset + 2:offset + attrlen])
+                offset += attrlen
+
+    def _PktIndexAttributes(self, packet, length):
+        """Validate the attribute framing and index attribute offsets.
+
+        Attributes are grouped by type code; vendor specific attributes
+        are grouped by (26, vendor id) so a lookup only has to decode the
+        attributes of a single vendor.
+
+        :return: map of group to a list of (start, end) value offsets
+        :rtype:  dict
+        """
+        unpack_header = _ATTR_HEADER.unpack_from
+        unpack_vendor = _VSA_HEADER.unpack_from
+        index = {}
+        offset = 20
+        while offset < length:
             try:
-                (key, attrlen) = struct.unpack('!BB', packet[0:2])
+                (key, attrlen) = unpack_header(packet, offset)
             except struct.error:
                 raise PacketError('Attribute header is corrupt')
 
@@ -563,30 +843,48 @@ class Packet(OrderedDict):
                 raise PacketError(
                         'Attribute length is too small (%d)' % attrlen)
 
-            value = packet[2:attrlen]
-            attribute = self.dict.attributes.get(self._DecodeKey(key))
-            if key == 26:
-                for (key, value) in self._PktDecodeVendorAttribute(value):
-                    self.setdefault(key, []).append(value)
+            group = key
+            if key == 26 and attrlen >= 8:
+                group = (26, unpack_vendor(packet, offset + 2)[0])
             elif key == 80:
                 # POST: Message Authenticator AVP is present.
                 self.message_authenticator = True
-                self.setdefault(key, []).append(value)
-            elif attribute and attribute.type == 'extended':
-                extended_key = struct.unpack('!B', packet[2])
-                full_key = f'{key}.{extended_key}'
-                self.setdefault(full_key, []).append(value)
-            elif attribute and attribute.type == 'long-extended':
-                extended_key, flags = struct.unpack('!BB', packet[2:4])
-                full_key = f'{key}.{extended_key}'
-                self._PktDecodeLongExtendedAttribute(full_key, flags, value)
-
-            elif attribute and attribute.type == 'tlv':
-                self._PktDecodeTlvAttribute(key,value)
-            else:
-                self.setdefault(key, []).append(value)
+            index.setdefault(group, []).append((offset + 2, offset + attrlen))
+            offset += attrlen
+        return index
+
+    def _LazyLoad(self, key):
+        """Decode the indexed attributes that can produce a key.
 
-            packet = packet[attrlen:]
+        :param key: encoded attribute key
+        :type key:  integer, string or (vendor code, attribute code) tuple
+        """
+        index = self._lazy_index
+        if isinstance(key, tuple):
+            groups = [(26, key[0])]
+        elif isinstance(key, str):
+            groups = [int(key.partition('.')[0])]
+        elif key == 26:
+            # Malformed vendor attributes are stored under code 26
+            groups = [g for g in index if isinstance(g, tuple)] + [26]
+        else:
+            groups = [key]
+
+        with memoryview(self._lazy_data) as view:
+            for group in groups:
+                code = group[0] if isinstance(group, tuple) else group
+                for (start, end) in index.pop(group, ()):
+                    self._PktDecodeAttribute(code, view[start:end])
+
+    def _LazyMaterialize(self):
+        """Decode all attributes of a lazily decoded packet."""
+        if self._lazy_index is None:
+            return
+        data = self._lazy_data
+        self._lazy_index = None
+        self._lazy_data = None
+        OrderedDict.clear(self)
+        self._PktDecodeAttributes(data, len(data))
 
     def _PktDecodeLongExtendedAttribute(self, code, flags, value):
         if self.expecting_long_extended and self.prev_long_extended_key != code:
@@ -603,18 +901,9 @@ class Packet(OrderedDict):
 
         self.long_extended_value_buffer = b''
 
-    def _salt_en_decrypt(self, data, salt):
-        result = b''
-        last = self.authenticator + salt
-        while data:
-            hash = md5_constructor(self.secret + last).digest()
-            for i in range(16):
-                result += bytes((hash[i] ^ data[i],))
-
-            last = result[-16:]
-            data = data[16:]
-        return result
-
+    def _salt_en_decrypt(self, data, salt, decrypt=False):
+        return _CryptBlocks(self.secret, self.authenticator + salt, data,
+                            decrypt)
 
     def SaltCrypt(self, value):
         """SaltEncrypt
@@ -658,7 +947,7 @@ class Packet(OrderedDict):
         salt = value[:2]
 
         #decrypt
-        value = self._salt_en_decrypt(value[2:], salt)
+        value = self._salt_en_decrypt(value[2:], salt, decrypt=True)
 
         #remove padding
         length = value[0]
@@ -712,30 +1001,17 @@ class AuthPacket(Packet):
         if self.id is None:
             self.id = self.CreateID()
 
-        if self.message_authenticator:
-            self._refresh_message_authenticator()
-
-        attr = self._PktEncodeAttributes()
+        buf = self._PktEncodeSigned(self.message_authenticator)
+        if self.auth_type == 'eap-md5':
+            buf += _ATTR_HEADER.pack(80, 18) + 16 * b'\x00'
+        _HEADER.pack_into(buf, 0, self.code, self.id, len(buf),
+                          self.authenticator)
         if self.auth_type == 'eap-md5':
-            header = struct.pack(
-                '!BBH16s', self.code, self.id, (20 + 18 + len(attr)), self.authenticator
-            )
-            digest = hmac_new(
-                self.secret,
-                header
-                + attr
-                + struct.pack('!BB16s', 80, struct.calcsize('!BB16s'), b''),
-            ).digest()
-            return (
-                header
-                + attr
-                + struct.pack('!BB16s', 80, struct.calcsize('!BB16s'), digest)
-            )
-
-        header = struct.pack('!BBH16s', self.code, self.id,
-                             (20 + len(attr)), self.authenticator)
-
-        return header + attr
+            hmac_constructor = _SecretHmac(self.secret)
+            hmac_constructor.update(buf)
+            buf[-16:] = hmac_constructor.digest()
+
+        return bytes(buf)
 
     def PwDecrypt(self, password):
         """De-Obfuscate a RADIUS password. RADIUS hides passwords in packets by
@@ -751,20 +1027,11 @@ class AuthPacket(Packet):
         :return:         plaintext password
         :rtype:          unicode string
         """
-        buf = password
-        pw = b''
-
-        last = self.authenticator
-        while buf:
-            hash = md5_constructor(self.secret + last).digest()
-            for i in range(16):
-                pw += bytes((hash[i] ^ buf[i],))
-            (last, buf) = (buf[:16], buf[16:])
+        pw = _CryptBlocks(self.secret, self.authenticator, password, True)
 
         # This is safe even with UTF-8 encoding since no valid encoding of UTF-8
         # (other than encoding U+0000 NULL) will produce a bytestream containing 0x00 byte.
-        while pw.endswith(b'\x00'):
-            pw = pw[:-1]
+        pw = pw.rstrip(b'\x00')
 
         # If the shared secret with the client is not the same, then de-obfuscating the password
         # field may yield illegal UTF-8 bytes. Therefore, in order not to provoke an Exception here
@@ -796,17 +1063,7 @@ class AuthPacket(Packet):
         if len(password) % 16 != 0:
             buf += b'\x00' * (16 - (len(password) % 16))
 
-        result = b''
-
-        last = self.authenticator
-        while buf:
-            hash = md5_constructor(self.secret + last).digest()
-            for i in range(16):
-                result += bytes((hash[i] ^ buf[i],))
-            last = result[-16:]
-            buf = buf[16:]
-
-        return result
+        return _CryptBlocks(self.secret, self.authenticator, buf)
 
     def VerifyChapPasswd(self, userpwd):
         """ Verify RADIUS ChapPasswd
@@ -903,17 +1160,55 @@ class AcctPacket(Packet):
         if self.id is None:
             self.id = self.CreateID()
 
-        if self.message_authenticator:
-            self._refresh_message_authenticator()
-
-        attr = self._PktEncodeAttributes()
-        header = struct.pack('!BBH', self.code, self.id, (20 + len(attr)))
-        self.authenticator = md5_constructor(header[0:4] + 16 * b'\x00' +
-                                             attr + self.secret).digest()
+        buf = self._PktEncodeSigned(self.message_authenticator)
+        self.authenticator = self._PktAuthenticate(buf, 16 * b'\x00')
+        return bytes(buf)
+
+    def RetransmitPacket(self, packet, delay):
+        """Update the Acct-Delay-Time of an encoded request before it is
+        sent again. Only that attribute is patched, or appended if the
+        request does not have one yet; the other attributes are not
+        encoded again. The Message-Authenticator and the request
+        authenticator are recalculated.
+
+        :param packet: raw packet as returned by RequestPacket
+        :type packet:  bytes
+        :param delay:  new Acct-Delay-Time in seconds
+        :type delay:   integer
+        :return:       raw packet
+        :rtype:        bytes
+        """
+        buf = bytearray(packet)
+        delay_offset = signature_offset = None
+        offset = 20
+        while offset + 2 <= len(buf):
+            (key, attrlen) = _ATTR_HEADER.unpack_from(buf, offset)
+            if attrlen < 2:
+                raise PacketError('Attribute header is corrupt')
+            if key == 41 and attrlen == 6:
+                delay_offset = offset + 2
+            elif key == 80 and attrlen == 18:
+                signature_offset = offset + 2
+            offset += attrlen
+
+        if delay_offset is None:
+            buf += _ATTR_HEADER.pack(41, 6) + _UINT32.pack(int(delay))
+            _LENGTH_HEADER.pack_into(buf, 0, self.code, self.id, len(buf))
+        else:
+            _UINT32.pack_into(buf, delay_offset, int(delay))
 
-        ans = header + self.authenticator + attr
+        if signature_offset is not None:
+            buf[signature_offset:signature_offset + 16] = 16 * b'\x00'
+            with memoryview(buf) as view:
+                hmac_constructor = _SecretHmac(self.secret)
+                hmac_constructor.update(view[:4])
+                hmac_constructor.update(16 * b'\x00')
+                hmac_constructor.update(view[20:])
+            digest = hmac_constructor.digest()
+            buf[signature_offset:signature_offset + 16] = digest
 
-        return ans
+        self.authenticator = self._PktAuthenticate(buf, 16 * b'\x00')
+        return bytes(buf)
 
 
 class CoAPacket(Packet):
@@ -967,22 +1262,489 @@ class CoAPacket(Packet):
         :rtype:  string
         """
 
-        attr = self._PktEncodeAttributes()
-
         if self.id is None:
             self.id = self.CreateID()
 
-        header = struct.pack('!BBH', self.code, self.id, (20 + len(attr)))
-        self.authenticator = md5_constructor(header[0:4] + 16 * b'\x00' +
-                                             attr + self.secret).digest()
+        buf = self._PktEncodeSigned(self.message_authenticator)
+        self.authenticator = self._PktAuthenticate(buf, 16 * b'\x00')
+        return bytes(buf)
 
-        if self.message_authenticator:
-            self._refresh_message_authenticator()
-            attr = self._PktEncodeAttributes()
-            self.authenticator = md5_constructor(header[0:4] + 16 * b'\x00' +
-                                                 attr + self.secret).digest()
 
-        return header + self.authenticator + attr
+class SlimPacket(object):
+    """Compact, read-mostly alternative to :obj:`Packet`.
+
+    A SlimPacket keeps the raw packet in a single buffer and indexes its
+    attributes in one flat array of (key, offset, length) entries in
+    wire order, instead of an ordered dictionary with a list of bytes
+    objects per attribute. This makes it cheap to hold many in-flight
+    requests, for example in a busy server.
+
+    The mapping interface matches :obj:`Packet`: attribute names give
+    decoded values, raw keys give lists of bytes. Values read with a
+    raw key are copies, and attributes that are set or replaced are
+    appended to the buffer and move to the end of the packet.
+    """
+    __slots__ = ('code', 'id', 'secret', 'authenticator', 'dict',
+                 'message_authenticator', 'buffer', 'avps')
+
+    def __init__(self, code=0, id=None, secret=b'', authenticator=None,
+                 dict=None, packet=None):
+        """Constructor
+
+        :param dict:   RADIUS dictionary
+        :type dict:    pyrad.dictionary.Dictionary class
+        :param secret: secret needed to communicate with a RADIUS server
+        :type secret:  string
+        :param id:     packet identification number
+        :type id:      integer (8 bits)
+        :param code:   packet type code
+        :type code:    integer (8bits)
+        :param packet: raw packet to decode
+        :type packet:  string
+        """
+        if not isinstance(secret, bytes):
+            raise TypeError('secret must be a binary string')
+        if authenticator is not None and \
+                not isinstance(authenticator, bytes):
+            raise TypeError('authenticator must be a binary string')
+        self.code = code
+        self.id = id if id is not None else CreateID()
+        self.secret = secret
+        self.authenticator = authenticator
+        self.dict = dict
+        self.message_authenticator = None
+        # Locally built packets keep an empty header, see raw_packet
+        self.buffer = bytearray(20)
+        self.avps = array('Q')
+        if packet is not None:
+            self.DecodePacket(packet)
+
+    _DecodeValue = Packet._DecodeValue
+    _EncodeValue = Packet._EncodeValue
+    _EncodeKey = Packet._EncodeKey
+    _DecodeKey = Packet._DecodeKey
+    _EncodeKeyValues = Packet._EncodeKeyValues
+    _salt_en_decrypt = Packet._salt_en_decrypt
+    SaltCrypt = Packet.SaltCrypt
+    SaltDecrypt = Packet.SaltDecrypt
+    VerifyReply = Packet.VerifyReply
+    PwDecrypt = AuthPacket.PwDecrypt
+    VerifyAcctRequest = AcctPacket.VerifyAcctRequest
+
+    @property
+    def raw_packet(self):
+        """The decoded packet, or None for packets built locally."""
+        length = _LENGTH_HEADER.unpack_from(self.buffer)[2]
+        if not length:
+            return None
+        return bytes(self.buffer[:length])
+
+    def CreateReply(self, **attributes):
+        """Create a new :obj:`Packet` as a reply to this one. This method
+        makes sure the authenticator and secret are copied over
+        to the new instance.
+        """
+        return Packet(id=self.id, secret=self.secret,
+                      authenticator=self.authenticator, dict=self.dict,
+                      **attributes)
+
+    def DecodePacket(self, packet):
+        """Initialize the object from raw packet data. The attribute
+        framing is checked as by :obj:`Packet.DecodePacket`, but values
+        are only indexed and decoded when they are looked up.
+
+        :param packet: raw packet
+        :type packet:  string
+        """
+        try:
+            (self.code, self.id, length, self.authenticator) = \
+                    _HEADER.unpack_from(packet)
+        except struct.error:
+            raise PacketError('Packet header is corrupt')
+        if len(packet) != length:
+            raise PacketError('Packet has invalid length')
+        if length > 8192:
+            raise PacketError('Packet length is too long (%d)' % length)
+
+        self.buffer = buffer = bytearray(packet)
+        self.avps = avps = array('Q')
+        attributes = self.dict.attributes
+        datatypes = {}
+        fragments = None
+        offset = 20
+        while offset < length:
+            try:
+                (key, attrlen) = _ATTR_HEADER.unpack_from(buffer, offset)
+            except struct.error:
+                raise PacketError('Attribute header is corrupt')
+            if attrlen < 2:
+                raise PacketError(
+                        'Attribute length is too small (%d)' % attrlen)
+            (start, end) = (offset + 2, min(offset + attrlen, length))
+            offset += attrlen
+
+            if key == 26:
+                avps.extend(self._PktIndexVendorAttribute(start, end))
+                continue
+            if key == 80:
+                self.message_authenticator = True
+
+            datatype = datatypes.get(key, False)
+            if datatype is False:
+                attribute = attributes.get(self._DecodeKey(key))
+                datatype = datatypes[key] = attribute and attribute.type
+            if datatype == 'extended' and end > start:
+                key = tools.PackKey(f'{key}.{buffer[start]}')
+            elif datatype == 'long-extended' and end - start >= 2:
+                key = tools.PackKey(f'{key}.{buffer[start]}')
+                if fragments is not None and fragments[0] != key:
+                    raise PacketError(
+                            'Inconsistent long extended attribute key')
+                if buffer[start + 1] > 128:
+                    if fragments is None:
+                        fragments = (key, [])
+                    fragments[1].append(bytes(buffer[start:end]))
+                    continue
+                if fragments is not None:
+                    fragments[1].append(bytes(buffer[start:end]))
+                    value = b''.join(fragments[1])
+                    fragments = None
+                    (start, end) = (len(buffer), len(buffer) + len(value))
+                    buffer += value
+            elif datatype == 'tlv':
+                self._PktCheckTlv(start, end)
+            avps.extend((key, start, end - start))
+
+    def _PktCheckTlv(self, start, end):
+        while start < end:
+            length = self.buffer[start + 1] if start + 1 < end else 0
+            if length < 2:
+                raise PacketError('TLV length is too small (%d)' % length)
+            start += length
+
+    def _PktIndexVendorAttribute(self, start, end):
+        """Index the sub attributes of a vendor specific attribute, or the
+        whole attribute under code 26 if it is not in the RFC2865
+        recommended form."""
+        buffer = self.buffer
+        if end - start < 6:
+            return (26, start, end - start)
+
+        (vendor, atype, length) = _VSA_HEADER.unpack_from(buffer, start)
+        entries = []
+        offset = start + 4
+        try:
+            while offset < end:
+                (atype, length) = _ATTR_HEADER.unpack_from(buffer, offset)
+                if length < 2:
+                    raise PacketError('Vendor attribute length is too small')
+                key = (vendor, atype)
+                vend = min(offset + length, end)
+                attribute = self.dict.attributes.get(self._DecodeKey(key))
+                if attribute and attribute.type == 'tlv':
+                    self._PktCheckTlv(offset + 2, vend)
+                entries.extend((tools.PackKey(key), offset + 2,
+                                vend - offset - 2))
+                offset += length
+        except (struct.error, PacketError):
+            return (26, start, end - start)
+        return entries
+
+    def _Values(self, packed):
+        buffer = self.buffer
+        entries = iter(self.avps)
+        return [bytes(buffer[offset:offset + length])
+                for (key, offset, length) in zip(entries, entries, entries)
+                if key == packed]
+
+    def _PackedKey(self, key):
+        if isinstance(key, str):
+            return self.dict.resolver[key].packed
+        return tools.PackKey(key)
+
+    def _RawValue(self, key, resolved=None):
+        """Return the raw values stored under a key, as :obj:`Packet`
+        stores them."""
+        if resolved is None:
+            packed = tools.PackKey(key)
+            attribute = self.dict.attributes.get(self._DecodeKey(key))
+        else:
+            (packed, attribute) = (resolved.packed, resolved.attribute)
+        values = self._Values(packed)
+        if not values:
+            raise KeyError(key)
+        if not (attribute and attribute.type == 'tlv'):
+            return values
+        sub_attributes = {}
+        for value in values:
+            offset = 0
+            while offset < len(value):
+                (atype, length) = _ATTR_HEADER.unpack_from(value, offset)
+                sub_attributes.setdefault(atype, []).append(
+                    value[offset + 2:offset + length])
+                offset += length
+        return sub_attributes
+
+    def _Append(self, packed, values):
+        buffer = self.buffer
+        for value in values:
+            self.avps.extend((packed, len(buffer), len(value)))
+            buffer += value
+
+    def _Remove(self, packed):
+        avps = self.avps
+        kept = array('Q')
+        for i in range(0, len(avps), 3):
+            if avps[i] != packed:
+                kept.extend(avps[i:i + 3])
+        if len(kept) == len(avps):
+            return False
+        self.avps = kept
+        return True
+
+    def AddAttribute(self, key, value):
+        """Add an attribute to the packet.
+
+        :param key:   attribute name or identification
+        :type key:    string, attribute code or (vendor code, attribute code)
+                      tuple
+        :param value: value
+        :type value:  depends on type of attribute
+        """
+        resolved = self.dict.resolver[key.partition(':')[0]]
+        (key, values) = self._EncodeKeyValues(key, value)
+        attr = resolved.attribute
+        if attr.is_sub_attribute:
+            values = [_ATTR_HEADER.pack(key, len(v) + 2) + v for v in values]
+            resolved = self.dict.resolver[attr.parent.name]
+        self._Append(resolved.packed, values)
+
+    def get(self, key, failobj=None):
+        try:
+            return self[key]
+        except KeyError:
+            return failobj
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return self._RawValue(key)
+
+        resolved = self.dict.resolver[key]
+        values = self._RawValue(resolved.key, resolved)
+        attr = resolved.attribute
+        if attr.type == 'tlv':
+            res = {}
+            for (sub_attr_key, sub_attr_val) in values.items():
+                sub_attr_name = attr.sub_attributes[sub_attr_key]
+                sub_attr = self.dict.attributes[sub_attr_name]
+                res[sub_attr_name] = [self._DecodeValue(sub_attr, v)
+                                      for v in sub_attr_val]
+            return res
+        return [self._DecodeValue(attr, v) for v in values]
+
+    def __contains__(self, key):
+        try:
+            packed = self._PackedKey(key)
+        except KeyError:
+            return False
+        avps = self.avps
+        for i in range(0, len(avps), 3):
+            if avps[i] == packed:
+                return True
+        return False
+
+    has_key = __contains__
+
+    def __setitem__(self, key, item):
+        packed = self._PackedKey(key.partition(':')[0]
+                                 if isinstance(key, str) else key)
+        (key, item) = self._EncodeKeyValues(key, item)
+        self._Remove(packed)
+        self._Append(packed, item)
+
+    def __delitem__(self, key):
+        if not self._Remove(self._PackedKey(key)):
+            raise KeyError(key)
+
+    def pop(self, key, *args):
+        try:
+            key = self._EncodeKey(key)
+            value = self._RawValue(key)
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        self._Remove(tools.PackKey(key))
+        return value
+
+    def clear(self):
+        self.avps = array('Q')
+
+    def _RawKeys(self):
+        avps = self.avps
+        return [tools.UnpackKey(packed) for packed in
+                OrderedDict.fromkeys(avps[i] for i in range(0, len(avps), 3))]
+
+    def __iter__(self):
+        return iter(self._RawKeys())
+
+    def __len__(self):
+        return len(self._RawKeys())
+
+    def keys(self):
+        return [self._DecodeKey(key) for key in self._RawKeys()]
+
+    def values(self):
+        return [self._RawValue(key) for key in self._RawKeys()]
+
+    def items(self):
+        return [(key, self._RawValue(key)) for key in self._RawKeys()]
+
+    def _PktEncodeAttributes(self):
+        """Encode the attributes in wire order, one attribute per entry."""
+        buffer = self.buffer
+        avps = self.avps
+        result = bytearray()
+        for i in range(0, len(avps), 3):
+            key = tools.UnpackKey(avps[i])
+            value = buffer[avps[i + 1]:avps[i + 1] + avps[i + 2]]
+            if isinstance(key, tuple):
+                result += _ATTR_HEADER.pack(26, len(value) + 8)
+                result += _VSA_HEADER.pack(key[0], key[1], len(value) + 2)
+            else:
+                if isinstance(key, str):
+                    key = int(key.partition('.')[0])
+                result += _ATTR_HEADER.pack(key, len(value) + 2)
+            result += value
+        return bytes(result)
+
+
+class PacketTemplate(object):
+    """Pre-encoded attributes for packets that are built many times with
+    the same static attributes, such as the replies of a server or the
+    requests of a load generator.
+
+    The static attributes are encoded once when the template is created.
+    Packets created from the template get a copy of the encoded values,
+    so only the attributes that vary per packet are encoded when the
+    packet is created. The packets are normal packets of the class that
+    fits the packet code, and are signed when they are encoded.
+
+    Attributes that are encrypted with a salt depend on the request
+    authenticator, so they cannot be part of a template.
+    """
+
+    def __init__(self, code, dict, **attributes):
+        """Constructor
+
+        :param code:       packet type code
+        :type code:        integer (8bits)
+        :param dict:       RADIUS dictionary
+        :type dict:        pyrad.dictionary.Dictionary class
+        :param attributes: static attributes, as passed to :obj:`Packet`
+        """
+        self.code = code
+        self.dict = dict
+        self.packet_class = _PACKET_CLASSES.get(code, Packet)
+
+        for key in attributes:
+            name = key.replace('_', '-').partition(':')[0]
+            if dict.attributes[name].encrypt == 2:
+                raise ValueError('Attribute %s cannot be pre-encoded' % name)
+        encoded = Packet(id=0, dict=dict, **attributes)
+        self.attributes = list(OrderedDict.items(encoded))
+
+    def CreatePacket(self, id=None, secret=b'', authenticator=None,
+                     **attributes):
+        """Create a packet with the static attributes of the template
+        followed by the given attributes.
+
+        :param id:            packet identification number
+        :type id:             integer (8 bits)
+        :param secret:        secret needed to communicate with a RADIUS
+                              server
+        :type secret:         string
+        :param authenticator: packet authenticator
+        :type authenticator:  bytes
+        :return:              new packet
+        :rtype:               Packet
+        """
+        pkt = self.packet_class(code=self.code, id=id, secret=secret,
+                                authenticator=authenticator, dict=self.dict)
+        for (key, values) in self.attributes:
+            if isinstance(values, list):
+                values = list(values)
+            else:
+                values = {code: list(sub) for (code, sub) in values.items()}
+            OrderedDict.__setitem__(pkt, key, values)
+        for (key, value) in attributes.items():
+            pkt.AddAttribute(key.replace('_', '-'), value)
+        return pkt
+
+    def CreateReply(self, request, **attributes):
+        """Create a reply to a request. The identifier, secret and
+        authenticator are copied from the request, as by
+        :obj:`Packet.CreateReply`.
+
+        :param request: request to reply to
+        :type request:  Packet
+        :return:        new reply packet
+        :rtype:         Packet
+        """
+        reply = self.CreatePacket(request.id, request.secret,
+                                  request.authenticator, **attributes)
+        if isinstance(reply, AuthPacket):
+            reply.auth_type = getattr(request, 'auth_type', reply.auth_type)
+        return reply
+
+
+_PACKET_CLASSES = {
+    AccessRequest: AuthPacket,
+    AccessAccept: AuthPacket,
+    AccessReject: AuthPacket,
+    AccessChallenge: AuthPacket,
+    StatusServer: AuthPacket,
+    AccountingRequest: AcctPacket,
+    AccountingResponse: AcctPacket,
+    CoARequest: CoAPacket,
+    CoAACK: CoAPacket,
+    CoANAK: CoAPacket,
+    DisconnectRequest: CoAPacket,
+    DisconnectACK: CoAPacket,
+    DisconnectNAK: CoAPacket,
+}
+
+
+def _CryptBlocks(secret, last, data, decrypt=False):
+    """XOR data with the RADIUS MD5 key stream, one 16 byte block at a time.
+
+    The key for every block is MD5(secret + last), where last starts as
+    the given initial value and then is the previous ciphertext block, as
+    used for User-Password (RFC 2865) and Tunnel-Password (RFC 2868).
+
+    :param secret:  RADIUS secret
+    :type secret:   bytes
+    :param last:    initial value hashed with the secret
+    :type last:     bytes
+    :param data:    data to encrypt or decrypt
+    :type data:     bytes
+    :param decrypt: True if data is ciphertext
+    :type decrypt:  boolean
+    :return:        encrypted or decrypted data
+    :rtype:         bytes
+    """
+    seeded = _SecretMd5(secret)
+    result = bytearray(len(data))
+    for offset in range(0, len(data), 16):
+        block = data[offset:offset + 16]
+        size = len(block)
+        hash = seeded.copy()
+        hash.update(last)
+        out = (int.from_bytes(hash.digest()[:size], 'big') ^
+               int.from_bytes(block, 'big')).to_bytes(size, 'big')
+        result[offset:offset + size] = out
+        last = block if decrypt else out
+    return bytes(result)
 
 
 def CreateID():
@@ -0,0 +1,469 @@
+# proxy_async.py
+#
+# A RADIUS proxy built on ServerAsync and ClientAsync
+
+import asyncio
+import itertools
+import logging
+import struct
+
+from pyrad.client_async import ClientAsync
+from pyrad.packet import AuthPacket, AcctPacket, StatusServer
+from pyrad.packet import _CryptBlocks
+from pyrad.server_async import ServerAsync
+
+# Raw attribute codes handled by the proxy
+PROXY_STATE = 33
+CHAP_PASSWORD = 3
+CHAP_CHALLENGE = 60
+MESSAGE_AUTHENTICATOR = 80
+
+POLICY_FAIL_OVER = 'fail-over'
+POLICY_LOAD_BALANCE = 'load-balance'
+
+
+class HomeServer:
+    """A RADIUS server requests are forwarded to.
+    A home server is marked dead after max_failures consecutive requests
+    went unanswered. Dead home servers receive no requests; they are
+    probed with Status-Server every status_interval seconds and marked
+    alive again once they answer.
+
+    :ivar alive: whether requests are forwarded to this server
+    :type alive: boolean
+    :ivar outstanding: number of forwarded requests awaiting a reply
+    :type outstanding: integer
+    """
+
+    def __init__(self, server, secret, auth_port=1812, acct_port=1813,
+                 coa_port=3799, retries=3, timeout=5, sockets_per_port=1,
+                 max_failures=3, status_interval=10):
+        """Constructor.
+
+        :param           server: hostname or IP address of the server
+        :type            server: string
+        :param           secret: RADIUS secret shared with the server
+        :type            secret: bytes
+        :param        auth_port: port for authentication packets
+        :type         auth_port: integer
+        :param        acct_port: port for accounting packets
+        :type         acct_port: integer
+        :param         coa_port: port for CoA packets
+        :type          coa_port: integer
+        :param          retries: number of times to send a request
+        :type           retries: integer
+        :param          timeout: seconds to wait for a reply before
+                                 sending a request again
+        :type           timeout: float
+        :param sockets_per_port: source sockets per port, see ClientAsync
+        :type  sockets_per_port: integer
+        :param     max_failures: unanswered requests in a row after which
+                                 the server is marked dead
+        :type      max_failures: integer
+        :param  status_interval: seconds between Status-Server probes of a
+                                 dead server
+        :type   status_interval: float
+        """
+        self.server = server
+        self.secret = secret
+        self.auth_port = auth_port
+        self.acct_port = acct_port
+        self.coa_port = coa_port
+        self.retries = retries
+        self.timeout = timeout
+        self.sockets_per_port = sockets_per_port
+        self.max_failures = max_failures
+        self.status_interval = status_interval
+
+        self.client = None
+        self.alive = True
+        self.failures = 0
+        self.outstanding = 0
+        self.probe_task = None
+        self.logger = None
+
+    async def initialize(self, loop, dictionary, logger_name='pyrad',
+                         enable_auth=False, enable_acct=False,
+                         enable_coa=False):
+        self.logger = logging.getLogger(logger_name)
+        if self.client is None:
+            self.client = ClientAsync(self.server,
+                                      auth_port=self.auth_port,
+                                      acct_port=self.acct_port,
+                                      coa_port=self.coa_port,
+                                      secret=self.secret,
+                                      dict=dictionary, loop=loop,
+                                      retries=self.retries,
+                                      timeout=self.timeout,
+                                      logger_name=logger_name,
+                                      sockets_per_port=self.sockets_per_port)
+        await self.client.initialize_transports(enable_auth=enable_auth,
+                                                enable_acct=enable_acct,
+                                                enable_coa=enable_coa)
+
+    async def deinitialize(self):
+        if self.probe_task:
+            self.probe_task.cancel()
+            await asyncio.gather(self.probe_task, return_exceptions=True)
+            self.probe_task = None
+        if self.client:
+            await self.client.deinitialize_transports()
+
+    async def send(self, pkt):
+        """Send a request and wait for the reply, keeping track of the
+        health of the server.
+
+        :param pkt: request created by this server's client
+        :type  pkt: pyrad.packet.Packet
+        :return:    reply packet
+        :rtype:     pyrad.packet.Packet
+        :raise TimeoutError: the server did not reply
+        """
+        self.outstanding += 1
+        try:
+            reply = await self.client.SendPacket(pkt)
+        except TimeoutError:
+            self.failed()
+            raise
+        finally:
+            self.outstanding -= 1
+        self.answered()
+        return reply
+
+    def answered(self):
+        self.failures = 0
+        if not self.alive:
+            self.logger.info('Home server %s is alive', self.server)
+            self.alive = True
+
+    def failed(self):
+        self.failures += 1
+        if self.alive and self.failures >= self.max_failures:
+            self.logger.warning('Home server %s is dead', self.server)
+            self.alive = False
+            if self.probe_task is None:
+                self.probe_task = self.client.loop.create_task(
+                    self.__probe__())
+
+    async def status(self):
+        """Send a Status-Server request.
+
+        :return: reply packet
+        :rtype:  pyrad.packet.Packet
+        :raise TimeoutError: the server did not reply
+        """
+        if self.client.protocol_auth:
+            pkt = self.client.CreateAuthPacket(code=StatusServer)
+            pkt.add_message_authenticator()
+            return await self.client.SendPacket(pkt)
+        if not self.client.protocol_acct:
+            raise Exception('No transport to send Status-Server on')
+
+        # Status-Server is an AuthPacket, but servers without an
+        # authentication port are probed on their accounting port.
+        pkt = AuthPacket(code=StatusServer,
+                         id=self.client.protocol_acct.create_id(),
+                         secret=self.secret, dict=self.client.dict)
+        pkt.add_message_authenticator()
+        future = asyncio.Future(loop=self.client.loop)
+        self.client.__send_packet__(self.client.protocol_acct,
+                                    self.client.acct_pool, pkt, future)
+        return await future
+
+    async def __probe__(self):
+        try:
+            while not self.alive:
+                await asyncio.sleep(self.status_interval)
+                try:
+                    await self.status()
+                except TimeoutError:
+                    continue
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    # Keep probing, the server would stay dead otherwise
+                    self.logger.error('Status-Server to home server %s '
+                                      'failed: %s', self.server, exc)
+                    continue
+                self.answered()
+        finally:
+            self.probe_task = None
+
+    def __str__(self):
+        return 'HomeServer(server=%s)' % self.server
+
+
+class HomeServerPool:
+    """A group of home servers that can handle the same requests.
+
+    With the fail-over policy requests go to the first live server in
+    the list. With the load-balance policy they go to the live server
+    with the fewest requests in flight.
+    """
+
+    def __init__(self, servers, policy=POLICY_FAIL_OVER):
+        """Constructor.
+
+        :param servers: home servers in order of preference
+        :type  servers: list of HomeServer
+        :param  policy: fail-over or load-balance
+        :type   policy: string
+        """
+        if policy not in (POLICY_FAIL_OVER, POLICY_LOAD_BALANCE):
+            raise ValueError('Unknown home server pool policy %s' % policy)
+        self.servers = list(servers)
+        self.policy = policy
+        self.next = 0
+
+    def select(self, exclude=()):
+        """Pick the home server for a request.
+
+        :param exclude: home servers already tried for this request
+        :type  exclude: collection of HomeServer
+        :return:        home server or None if no live server is left
+        :rtype:         HomeServer
+        """
+        candidates = [server for server in self.servers
+                      if server.alive and server not in exclude]
+        if not candidates:
+            return None
+        if self.policy == POLICY_FAIL_OVER:
+            return candidates[0]
+
+        # Start at a rotating position so idle servers share the load.
+        self.next = (self.next + 1) % len(candidates)
+        candidates = candidates[self.next:] + candidates[:self.next]
+        return min(candidates, key=lambda server: server.outstanding)
+
+
+class ProxyAsync(ServerAsync):
+    """RADIUS proxy.
+    Requests received from clients are forwarded to a home server of
+    the pool for their type and the reply is returned to the client.
+    If a home server does not answer, the request is tried on the next
+    live server of the pool.
+
+    User-Password and salt encrypted attributes are encrypted again with
+    the secret of the home server. The proxy adds its own Proxy-State
+    attribute to forwarded requests and removes it from the replies.
+    A client retransmission of a request in flight is dropped. Once the
+    reply is sent, it is kept for cleanup_delay seconds and sent again
+    for client retransmissions.
+    """
+
+    def __init__(self, auth_pool=None, acct_pool=None, coa_pool=None,
+                 cleanup_delay=5, **kwargs):
+        """Constructor.
+
+        :param     auth_pool: home servers for authentication requests
+        :type      auth_pool: HomeServerPool
+        :param     acct_pool: home servers for accounting requests
+        :type      acct_pool: HomeServerPool
+        :param      coa_pool: home servers for CoA and Disconnect requests
+        :type       coa_pool: HomeServerPool
+        :param cleanup_delay: seconds a reply is kept to answer client
+                              retransmissions
+        :type  cleanup_delay: float
+
+        Other keyword arguments are passed to ServerAsync.
+        """
+        ServerAsync.__init__(self, **kwargs)
+        self.auth_pool = auth_pool
+        self.acct_pool = acct_pool
+        self.coa_pool = coa_pool
+        self.cleanup_delay = cleanup_delay
+        # (client address, id, authenticator) -> reply, None while the
+        # request is in flight
+        self.proxy_states = {}
+        self.proxy_state_counter = itertools.count()
+
+    def __home_servers__(self):
+        servers = {}
+        for (pool, kind) in ((self.auth_pool, 'auth'),
+                             (self.acct_pool, 'acct'),
+                             (self.coa_pool, 'coa')):
+            if pool is not None:
+                for server in pool.servers:
+                    servers.setdefault(server, set()).add(kind)
+        return servers
+
+    async def initialize_home_servers(self):
+        """Open the client transports of all home servers."""
+        for (server, kinds) in self.__home_servers__().items():
+            await server.initialize(self.loop, self.dict,
+                                    logger_name=self.logger.name,
+                                    enable_auth='auth' in kinds,
+                                    enable_acct='acct' in kinds,
+                                    enable_coa='coa' in kinds)
+
+    async def deinitialize_home_servers(self):
+        for server in self.__home_servers__():
+            await server.deinitialize()
+
+    def handle_auth_packet(self, protocol, pkt, addr):
+        return self.proxy_packet(protocol, pkt, addr, self.auth_pool)
+
+    def handle_acct_packet(self, protocol, pkt, addr):
+        return self.proxy_packet(protocol, pkt, addr, self.acct_pool)
+
+    def handle_coa_packet(self, protocol, pkt, addr):
+        return self.proxy_packet(protocol, pkt, addr, self.coa_pool)
+
+    def handle_disconnect_packet(self, protocol, pkt, addr):
+        return self.proxy_packet(protocol, pkt, addr, self.coa_pool)
+
+    async def proxy_packet(self, protocol, pkt, addr, pool):
+        """Forward a request to a home server of pool and send the reply
+        to the client.
+
+        :param protocol: transport the request was received on
+        :type  protocol: DatagramProtocolServer
+        :param      pkt: request
+        :type       pkt: pyrad.packet.Packet
+        :param     addr: client address
+        :type      addr: tuple
+        :param     pool: home servers for the request
+        :type      pool: HomeServerPool
+        """
+        key = (addr, pkt.id, pkt.authenticator)
+        if key in self.proxy_states:
+            reply = self.proxy_states[key]
+            if reply is None:
+                self.logger.debug('[%s:%d] Drop duplicate request %d from %s',
+                                  protocol.ip, protocol.port, pkt.id, addr)
+            else:
+                protocol.transport.sendto(reply, addr)
+            return
+
+        if pool is None:
+            self.logger.warning('[%s:%d] No home servers for request %d '
+                                'from %s', protocol.ip, protocol.port, pkt.id,
+                                addr)
+            return
+
+        self.proxy_states[key] = None
+        reply = None
+        try:
+            reply = await self.forward(pkt, pool)
+        finally:
+            if reply is None:
+                del self.proxy_states[key]
+
+        if reply is None:
+            self.logger.warning('[%s:%d] No reply for request %d from %s',
+                                protocol.ip, protocol.port, pkt.id, addr)
+            return
+
+        raw = reply.ReplyPacket()
+        self.proxy_states[key] = raw
+        self.loop.call_later(self.cleanup_delay, self.proxy_states.pop,
+                             key, None)
+        protocol.transport.sendto(raw, addr)
+
+    async def forward(self, pkt, pool):
+        """Forward a request to the home servers of pool, trying the next
+        live server whenever one does not answer.
+
+        :param  pkt: request received from a client
+        :type   pkt: pyrad.packet.Packet
+        :param pool: home servers for the request
+        :type  pool: HomeServerPool
+        :return:     reply for the client or None if no server answered
+        :rtype:      pyrad.packet.Packet
+        """
+        tried = []
+        while True:
+            server = pool.select(exclude=tried)
+            if server is None:
+                return None
+            tried.append(server)
+
+            (request, state) = self.__create_request__(pkt, server)
+            try:
+                reply = await server.send(request)
+            except TimeoutError:
+                self.logger.info('Request %d timed out on home server %s',
+                                 pkt.id, server.server)
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.logger.error('Request %d failed on home server %s: %s',
+                                  pkt.id, server.server, exc)
+                continue
+            return self.__create_reply__(pkt, request, reply, state)
+
+    def __create_request__(self, pkt, server):
+        if isinstance(pkt, AuthPacket):
+            request = server.client.CreateAuthPacket(code=pkt.code)
+            # Password attributes are encrypted with the new authenticator
+            request.authenticator = request.CreateAuthenticator()
+            if CHAP_PASSWORD in pkt and CHAP_CHALLENGE not in pkt:
+                # The CHAP challenge defaults to the request authenticator
+                request[CHAP_CHALLENGE] = [pkt.authenticator]
+        elif isinstance(pkt, AcctPacket):
+            request = server.client.CreateAcctPacket(code=pkt.code)
+        else:
+            request = server.client.CreateCoAPacket(code=pkt.code)
+
+        self.__copy_attributes__(pkt, request)
+        if MESSAGE_AUTHENTICATOR in pkt:
+            request.add_message_authenticator()
+
+        state = struct.pack('!L', next(self.proxy_state_counter) & 0xffffffff)
+        request.setdefault(PROXY_STATE, []).append(state)
+        return (request, state)
+
+    def __create_reply__(self, pkt, request, reply, state):
+        # Salt encrypted attributes of the reply use the authenticator of
+        # the request sent to the home server.
+        reply.authenticator = request.authenticator
+        states = reply.get(PROXY_STATE)
+        if states and states[-1] == state:
+            states.pop()
+            if not states:
+                del reply[PROXY_STATE]
+
+        answer = pkt.CreateReply()
+        answer.code = reply.code
+        self.__copy_attributes__(reply, answer)
+        if MESSAGE_AUTHENTICATOR in pkt or MESSAGE_AUTHENTICATOR in reply:
+            answer.message_authenticator = True
+        return answer
+
+    def __copy_attributes__(self, source, target):
+        for key in source:
+            if key == MESSAGE_AUTHENTICATOR:
+                continue
+            values = source[key]
+            if isinstance(values, dict):
+                target[key] = {sub_key: list(sub_values)
+                               for (sub_key, sub_values) in values.items()}
+                continue
+
+            attr = source.dict.attributes.get(source._DecodeKey(key))
+            encrypt = attr.encrypt if attr is not None else 0
+            if encrypt == 1:
+                values = [_PwRecrypt(source, target, value)
+                          for value in values]
+            elif encrypt == 2:
+                values = [target.SaltCrypt(source.SaltDecrypt(value))
+                          for value in values]
+            elif encrypt == 3:
+                self.logger.warning('Drop attribute %s, Ascend encrypted '
+                                    'attributes can not be proxied', attr.name)
+                continue
+            target.setdefault(key, []).extend(values)
+
+
+def _PwRecrypt(source, target, value):
+    """Decrypt a User-Password style value of source and encrypt it for
+    target. The password is kept as bytes, so passwords that are not
+    valid UTF-8 pass unchanged."""
+    password = _CryptBlocks(source.secret, source.authenticator, value, True)
+    password = password.rstrip(b'\x00')
+    if len(password) % 16 != 0:
+        password += b'\x00' * (16 - len(password) % 16)
+    if target.authenticator is None:
+        target.authenticator = target.CreateAuthenticator()
+    return _CryptBlocks(target.secret, target.authenticator, password)
@@ -2,8 +2,14 @@
 #
 # Copyright 2003-2004,2007,2016 Wichert Akkerman <wichert@wiggy.net>
 
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import os
 import select
+import signal
 import socket
+import threading
+import time
 from pyrad import host
 from pyrad import packet
 import logging
@@ -59,13 +65,24 @@ class Server(host.Host):
     :type  _poll: select.poll class instance
     :ivar _fdmap: map of filedescriptors to network sockets
     :type _fdmap: dictionary
+    :ivar addresses: IP addresses the server is bound to
+    :type addresses: list of strings
+    :ivar  wakeups: number of times a socket was reported readable
+    :type  wakeups: integer
+    :ivar  packets: number of datagrams read
+    :type  packets: integer
+    :ivar     shed: number of packets dropped because the handler queue
+                    was full
+    :type     shed: integer
     :cvar MaxPacketSize: maximum size of a RADIUS packet
     :type MaxPacketSize: integer
     """
     MaxPacketSize = 8192
 
     def __init__(self, addresses=[], authport=1812, acctport=1813, coaport=3799,
-                 hosts=None, dict=None, auth_enabled=True, acct_enabled=True, coa_enabled=False):
+                 hosts=None, dict=None, auth_enabled=True, acct_enabled=True, coa_enabled=False,
+                 lazy_decode=False, reuse_port=False, batch_size=1,
+                 threads=0, max_queue=None, shed_policy='drop'):
         """Constructor.
 
         :param     addresses: IP addresses to listen on
@@ -86,6 +103,31 @@ class Server(host.Host):
         :type   acct_enabled: bool
         :param   coa_enabled: enable coa server (default False)
         :type    coa_enabled: bool
+        :param   lazy_decode: only decode attributes of received packets
+                              when a handler accesses them (default False)
+        :type    lazy_decode: bool
+        :param    reuse_port: set SO_REUSEPORT on the listening sockets so
+                              several processes can bind the same ports
+                              (default False)
+        :type     reuse_port: bool
+        :param    batch_size: maximum number of datagrams read from a socket
+                              each time it becomes readable. Replies to a
+                              batch are sent once the whole batch has been
+                              processed (default 1)
+        :type     batch_size: integer
+        :param       threads: number of threads to run the packet handlers
+                              in. With 0 handlers run in the main loop
+                              (default 0)
+        :type        threads: integer
+        :param     max_queue: maximum number of packets queued for or being
+                              processed by the handler threads (default four
+                              times the number of threads)
+        :type      max_queue: integer
+        :param   shed_policy: what to do with a packet when the handler
+                              queue is full: 'drop' discards it, 'block'
+                              stops reading packets until there is room
+                              (default 'drop')
+        :type    shed_policy: string
         """
         host.Host.__init__(self, authport, acctport, coaport, dict)
         if hosts is None:
@@ -99,6 +141,26 @@ class Server(host.Host):
         self.acctfds = []
         self.coa_enabled = coa_enabled
         self.coafds = []
+        self.lazy_decode = lazy_decode
+        self.reuse_port = reuse_port
+        self.addresses = []
+        self._running = False
+        self._wakeup = None
+        self.batch_size = batch_size
+        self.wakeups = 0
+        self.packets = 0
+        self._buffer = None
+        self._replies = None
+        self._loop_thread = None
+
+        if shed_policy not in ('drop', 'block'):
+            raise ValueError('Unknown shed policy %s' % shed_policy)
+        self.threads = threads
+        self.max_queue = max_queue
+        self.shed_policy = shed_policy
+        self.shed = 0
+        self._executor = None
+        self._pending = None
 
         for addr in addresses:
             self.BindToAddress(addr)
@@ -134,23 +196,45 @@ class Server(host.Host):
         addrFamily = self._GetAddrInfo(addr)
         for (family, address) in addrFamily:
             if self.auth_enabled:
-                authfd = socket.socket(family, socket.SOCK_DGRAM)
-                authfd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                authfd.bind((address, self.authport))
-                self.authfds.append(authfd)
+                self.authfds.append(
+                    self._BindSocket(family, address, self.authport))
 
             if self.acct_enabled:
-                acctfd = socket.socket(family, socket.SOCK_DGRAM)
-                acctfd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                acctfd.bind((address, self.acctport))
-                self.acctfds.append(acctfd)
+                self.acctfds.append(
+                    self._BindSocket(family, address, self.acctport))
 
             if self.coa_enabled:
-                coafd = socket.socket(family, socket.SOCK_DGRAM)
-                coafd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                coafd.bind((address, self.coaport))
-                self.coafds.append(coafd)
-
+                self.coafds.append(
+                    self._BindSocket(family, address, self.coaport))
+        self.addresses.append(addr)
+
+    def _BindSocket(self, family, address, port):
+        """Create a UDP socket bound to an address and port.
+
+        :param family:  address family
+        :type  family:  integer
+        :param address: IP address to bind to
+        :type  address: string
+        :param port:    port to bind to
+        :type  port:    integer
+        :return:        bound socket
+        :rtype:         socket.socket
+        """
+        fd = socket.socket(family, socket.SOCK_DGRAM)
+        fd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            fd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        fd.bind((address, port))
+        return fd
+
+    def _CloseSockets(self):
+        """Close all listening sockets.
+        """
+        for fd in self.authfds + self.acctfds + self.coafds:
+            fd.close()
+        self.authfds = []
+        self.acctfds = []
+        self.coafds = []
 
     def HandleAuthPacket(self, pkt):
         """Authentication packet handler.
@@ -219,7 +303,7 @@ class Server(host.Host):
         if pkt.code != packet.AccessRequest:
             raise ServerPacketError(
                 'Received non-authentication packet on authentication port')
-        self.HandleAuthPacket(pkt)
+        self._DispatchPacket(self.HandleAuthPacket, pkt)
 
     def _HandleAcctPacket(self, pkt):
         """Process a packet received on the accounting port.
@@ -235,7 +319,7 @@ class Server(host.Host):
                             packet.AccountingResponse]:
             raise ServerPacketError(
                     'Received non-accounting packet on accounting port')
-        self.HandleAcctPacket(pkt)
+        self._DispatchPacket(self.HandleAcctPacket, pkt)
 
     def _HandleCoaPacket(self, pkt):
         """Process a packet received on the coa port.
@@ -248,9 +332,9 @@ class Server(host.Host):
         """
         self._AddSecret(pkt)
         if pkt.code == packet.CoARequest:
-            self.HandleCoaPacket(pkt)
+            self._DispatchPacket(self.HandleCoaPacket, pkt)
         elif pkt.code == packet.DisconnectRequest:
-            self.HandleDisconnectPacket(pkt)
+            self._DispatchPacket(self.HandleDisconnectPacket, pkt)
         else:
             raise ServerPacketError('Received non-coa packet on coa port')
 
@@ -264,7 +348,11 @@ class Server(host.Host):
         :return: RADIUS packet
         :rtype:  Packet class instance
         """
-        (data, source) = fd.recvfrom(self.MaxPacketSize)
+        if self._buffer is None:
+            (data, source) = fd.recvfrom(self.MaxPacketSize)
+        else:
+            (size, source) = fd.recvfrom_into(self._buffer)
+            data = self._buffer[:size].tobytes()
         pkt = pktgen(data)
         pkt.source = source
         pkt.fd = fd
@@ -282,19 +370,129 @@ class Server(host.Host):
             self._realacctfds = list(map(lambda x: x.fileno(), self.acctfds))
         if self.coa_enabled:
             self._realcoafds = list(map(lambda x: x.fileno(), self.coafds))
+        if self.batch_size > 1:
+            for fd in self.authfds + self.acctfds + self.coafds:
+                fd.setblocking(False)
+            self._buffer = memoryview(bytearray(self.MaxPacketSize))
 
-    def CreateReplyPacket(self, pkt, **attributes):
+    def CreateReplyPacket(self, pkt, template=None, **attributes):
         """Create a reply packet.
         Create a new packet which can be returned as a reply to a received
         packet.
 
-        :param pkt:   original packet
-        :type pkt:    Packet instance
+        :param pkt:      original packet
+        :type pkt:       Packet instance
+        :param template: template with the static reply attributes
+        :type template:  pyrad.packet.PacketTemplate
         """
-        reply = pkt.CreateReply(**attributes)
+        if template is not None:
+            reply = template.CreateReply(pkt, **attributes)
+        else:
+            reply = pkt.CreateReply(**attributes)
         reply.source = pkt.source
         return reply
 
+    def SendReplyPacket(self, fd, pkt):
+        """Send a packet.
+        While a batch of requests is being processed the encoded reply
+        is queued, and sent when the batch is complete. Replies from
+        handler threads are always sent immediately.
+
+        :param fd: socket to send packet with
+        :type  fd: socket class instance
+        :param pkt: packet to send
+        :type  pkt: Packet class instance
+        """
+        if (self._replies is None or
+                threading.get_ident() != self._loop_thread):
+            host.Host.SendReplyPacket(self, fd, pkt)
+        else:
+            self._replies.append((fd, pkt.ReplyPacket(), pkt.source))
+
+    def _FlushReplies(self):
+        """Send all replies queued while processing a batch.
+        """
+        (replies, self._replies) = (self._replies, None)
+        for (fd, data, target) in replies:
+            try:
+                fd.sendto(data, target)
+            except OSError as err:
+                logger.error('Failed to send reply to %s: %s',
+                             target, err)
+
+    def _DispatchPacket(self, handler, pkt):
+        """Run a packet handler, in a handler thread if enabled.
+
+        :param handler: packet handler
+        :type  handler: callable
+        :param     pkt: packet to process
+        :type      pkt: Packet class instance
+        """
+        if self._executor is None:
+            handler(pkt)
+            return
+
+        if self.shed_policy == 'block':
+            self._pending.acquire()
+        elif not self._pending.acquire(blocking=False):
+            self.shed += 1
+            raise ServerPacketError('Handler queue is full')
+        try:
+            future = self._executor.submit(handler, pkt)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(self._HandlerDone)
+
+    def _HandlerDone(self, future):
+        self._pending.release()
+        err = future.exception()
+        if isinstance(err, ServerPacketError):
+            logger.info('Dropping packet: ' + str(err))
+        elif isinstance(err, packet.PacketError):
+            logger.info('Received a broken packet: ' + str(err))
+        elif err is not None:
+            logger.error('Packet handler failed', exc_info=err)
+
+    def _ProcessBatch(self, fd):
+        """Process all available data, up to batch_size packets.
+        Broken and dropped packets are logged and do not end the batch.
+
+        :param  fd: socket to read packets from
+        :type   fd: socket class instance
+        :return: number of datagrams read
+        :rtype:  integer
+        """
+        count = 0
+        if self.batch_size > 1:
+            self._replies = []
+        try:
+            while count < self.batch_size:
+                try:
+                    self._ProcessInput(fd)
+                except BlockingIOError:
+                    break
+                except ServerPacketError as err:
+                    logger.info('Dropping packet: ' + str(err))
+                except packet.PacketError as err:
+                    logger.info('Received a broken packet: ' + str(err))
+                count += 1
+        finally:
+            if self._replies is not None:
+                self._FlushReplies()
+            self.wakeups += 1
+            self.packets += count
+        return count
+
+    def PacketsPerWakeup(self):
+        """Return the average number of datagrams read per wakeup.
+
+        :rtype: float
+        """
+        if not self.wakeups:
+            return 0.0
+        return self.packets / self.wakeups
+
     def _ProcessInput(self, fd):
         """Process available data.
         If this packet should be dropped instead of processed a
@@ -309,13 +507,16 @@ class Server(host.Host):
         :type   fd: socket class instance
         """
         if self.auth_enabled and fd.fileno() in self._realauthfds:
-            pkt = self._GrabPacket(lambda data, s=self: s.CreateAuthPacket(packet=data), fd)
+            pkt = self._GrabPacket(lambda data, s=self: s.CreateAuthPacket(
+                packet=data, lazy=s.lazy_decode), fd)
             self._HandleAuthPacket(pkt)
         elif self.acct_enabled and fd.fileno() in self._realacctfds:
-            pkt = self._GrabPacket(lambda data, s=self: s.CreateAcctPacket(packet=data), fd)
+            pkt = self._GrabPacket(lambda data, s=self: s.CreateAcctPacket(
+                packet=data, lazy=s.lazy_decode), fd)
             self._HandleAcctPacket(pkt)
         elif self.coa_enabled:
-            pkt = self._GrabPacket(lambda data, s=self: s.CreateCoAPacket(packet=data), fd)
+            pkt = self._GrabPacket(lambda data, s=self: s.CreateCoAPacket(
+                packet=data, lazy=s.lazy_decode), fd)
             self._HandleCoaPacket(pkt)
         else:
             raise ServerPacketError('Received packet for unknown handler')
@@ -324,21 +525,216 @@ class Server(host.Host):
         """Main loop.
         This method is the main loop for a RADIUS server. It waits
         for packets to arrive via the network and calls other methods
-        to process them.
+        to process them. It returns once Stop() has been called.
         """
         self._poll = select.poll()
         self._fdmap = {}
         self._PrepareSockets()
 
-        while True:
-            for (fd, event) in self._poll.poll():
-                if event == select.POLLIN:
-                    try:
-                        fdo = self._fdmap[fd]
-                        self._ProcessInput(fdo)
-                    except ServerPacketError as err:
-                        logger.info('Dropping packet: ' + str(err))
-                    except packet.PacketError as err:
-                        logger.info('Received a broken packet: ' + str(err))
+        self._loop_thread = threading.get_ident()
+        if self.threads:
+            self._executor = ThreadPoolExecutor(
+                self.threads, thread_name_prefix='pyrad-handler')
+            self._pending = threading.BoundedSemaphore(
+                self.max_queue or 4 * self.threads)
+
+        # Set the flag before the wakeup pipe exists, so a Stop() that
+        # sees the pipe is never overridden.
+        self._running = True
+        (wakeup_r, self._wakeup) = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(self._wakeup, False)
+        self._poll.register(wakeup_r, select.POLLIN)
+        try:
+            while self._running:
+                for (fd, event) in self._poll.poll():
+                    if not self._running:
+                        break
+                    elif fd == wakeup_r:
+                        self._DrainWakeup(wakeup_r)
+                    elif event == select.POLLIN:
+                        self._ProcessBatch(self._fdmap[fd])
+                    else:
+                        logger.error('Unexpected event in server main loop')
+        finally:
+            self._running = False
+            (wakeup_w, self._wakeup) = (self._wakeup, None)
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _DrainWakeup(self, fd):
+        try:
+            while os.read(fd, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def Stop(self):
+        """Stop the main loop.
+        Run() returns after the packet that is being processed, if any,
+        has been handled. This method may be called from a signal handler
+        or another thread.
+        """
+        self._running = False
+        if self._wakeup is not None:
+            try:
+                os.write(self._wakeup, b'\x00')
+            except OSError:
+                pass
+
+    def RunWorkers(self, count, restart_delay=1.0):
+        """Run the server in several pre-forked worker processes.
+        Every worker binds its own sockets to all addresses the server
+        was bound to, using SO_REUSEPORT, so the kernel balances the
+        incoming packets across the workers. The workers then call Run().
+
+        The calling process supervises the workers until it receives
+        SIGTERM or SIGINT, at which point all workers are stopped and
+        this method returns. SIGHUP restarts the workers one by one: a
+        replacement is started before the old worker is stopped, so the
+        ports are never left without a listener. Workers that die are
+        restarted. A worker that dies within restart_delay seconds of
+        being started is only restarted after restart_delay seconds, so
+        workers that fail at startup do not make the supervisor fork in
+        a tight loop.
+
+        This is only available on platforms with fork() and SO_REUSEPORT.
+
+        :param         count: number of worker processes
+        :type          count: integer
+        :param restart_delay: seconds before a worker that died shortly
+                              after its start is restarted
+        :type  restart_delay: float
+        """
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise NotImplementedError('SO_REUSEPORT is not supported')
+
+        self.reuse_port = True
+        # The workers bind their own sockets. Sockets left open here
+        # would be part of the SO_REUSEPORT group but never read.
+        self._CloseSockets()
+
+        watched = {signal.SIGCHLD, signal.SIGHUP, signal.SIGTERM,
+                   signal.SIGINT}
+        oldmask = signal.pthread_sigmask(signal.SIG_BLOCK, watched)
+        workers = {}  # process id -> start time
+        retiring = set()
+        restarts = []  # times at which to start a replacement worker
+
+        def Spawn():
+            workers[self._SpawnWorker(oldmask)] = time.monotonic()
+
+        try:
+            for _ in range(count):
+                Spawn()
+
+            while True:
+                if restarts:
+                    info = signal.sigtimedwait(
+                        watched, max(0, min(restarts) - time.monotonic()))
                 else:
-                    logger.error('Unexpected event in server main loop')
+                    info = signal.sigwaitinfo(watched)
+
+                now = time.monotonic()
+                for due in [due for due in restarts if due <= now]:
+                    restarts.remove(due)
+                    Spawn()
+                if info is None:
+                    continue
+
+                if info.si_signo == signal.SIGCHLD:
+                    for pid in self._ReapWorkers():
+                        if pid in retiring:
+                            retiring.discard(pid)
+                        elif pid in workers:
+                            uptime = now - workers.pop(pid)
+                            if uptime < restart_delay:
+                                logger.error('Worker %d died after %.1f '
+                                             'seconds, restarting in %.1f '
+                                             'seconds', pid, uptime,
+                                             restart_delay)
+                                restarts.append(now + restart_delay)
+                            else:
+                                logger.error('Worker %d died, restarting',
+                                             pid)
+                                Spawn()
+                elif info.si_signo == signal.SIGHUP:
+                    logger.info('Restarting %d workers', len(workers))
+                    for pid in list(workers):
+                        Spawn()
+                        del workers[pid]
+                        retiring.add(pid)
+                        self._SignalWorker(pid, signal.SIGTERM)
+                else:
+                    break
+        finally:
+            pids = set(workers) | retiring
+            for pid in pids:
+                self._SignalWorker(pid, signal.SIGTERM)
+            for pid in pids:
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+            signal.pthread_sigmask(signal.SIG_SETMASK, oldmask)
+
+    def _SpawnWorker(self, sigmask):
+        """Fork a worker process.
+
+        :param sigmask: signal mask to restore in the worker
+        :type  sigmask: set of signals
+        :return:        process id of the worker
+        :rtype:         integer
+        """
+        pid = os.fork()
+        if pid:
+            return pid
+
+        status = 1
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, self._StopWorker)
+            signal.pthread_sigmask(signal.SIG_SETMASK, sigmask)
+            (addresses, self.addresses) = (self.addresses, [])
+            for addr in addresses:
+                self.BindToAddress(addr)
+            self.Run()
+            status = 0
+        except Exception:
+            logger.exception('Worker %d failed', os.getpid())
+        finally:
+            os._exit(status)
+
+    def _StopWorker(self, signum, frame):
+        if self._wakeup is None:
+            # Not serving yet, so there is nothing to finish.
+            os._exit(0)
+        self.Stop()
+
+    def _ReapWorkers(self):
+        """Collect exited worker processes without blocking.
+
+        :return: process ids of the exited workers
+        :rtype:  list of integers
+        """
+        pids = []
+        while True:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            pids.append(pid)
+        return pids
+
+    def _SignalWorker(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as err:
+            if err.errno != errno.ESRCH:
+                raise
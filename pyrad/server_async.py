@@ -3,13 +3,14 @@
 # Copyright 2018-2019 Geaaru <geaaru@gmail.com>
 
 import asyncio
+import inspect
 import logging
 import traceback
 
 from abc import abstractmethod, ABCMeta
 from enum import Enum
 from datetime import datetime
-from pyrad.packet import Packet, AccessAccept, AccessReject, \
+from pyrad.packet import AccessAccept, AccessReject, \
     AccountingRequest, AccountingResponse, \
     DisconnectACK, DisconnectNAK, DisconnectRequest, CoARequest, \
     CoAACK, CoANAK, AccessRequest, AuthPacket, AcctPacket, CoAPacket, \
@@ -36,6 +37,7 @@ class DatagramProtocolServer(asyncio.Protocol):
         self.hosts = hosts
         self.server_type = server_type
         self.request_callback = request_callback
+        self.handler_tasks = set()
 
     def connection_made(self, transport):
         self.transport = transport
@@ -63,44 +65,48 @@ class DatagramProtocolServer(asyncio.Protocol):
             self.logger.warn('[%s:%d] Drop package from unknown source %s', self.ip, self.port, addr)
             return
 
-        try:
-            self.logger.debug('[%s:%d] Received from %s packet: %s', self.ip, self.port, addr, data.hex())
-            req = Packet(packet=data, dict=self.server.dict)
-        except Exception as exc:
-            self.logger.error('[%s:%d] Error on decode packet: %s', self.ip, self.port, exc)
+        self.logger.debug('[%s:%d] Received from %s packet: %s', self.ip, self.port, addr, data.hex())
+        if len(data) < 20:
+            self.logger.error('[%s:%d] Error on decode packet: Packet header is corrupt',
+                              self.ip, self.port)
             return
+        # The packet is only decoded once, by the class matching its code.
+        code = data[0]
 
         try:
-            if req.code in (AccountingResponse, AccessAccept, AccessReject, CoANAK, CoAACK, DisconnectNAK, DisconnectACK):
-                raise ServerPacketError('Invalid response packet %d' % req.code)
+            if code in (AccountingResponse, AccessAccept, AccessReject, CoANAK, CoAACK, DisconnectNAK, DisconnectACK):
+                raise ServerPacketError('Invalid response packet %d' % code)
 
             elif self.server_type == ServerType.Auth:
-                if req.code != AccessRequest:
+                if code != AccessRequest:
                     raise ServerPacketError('Received non-auth packet on auth port')
                 req = AuthPacket(secret=remote_host.secret,
                                  dict=self.server.dict,
-                                 packet=data)
+                                 packet=data,
+                                 lazy=self.server.lazy_decode)
                 if self.server.enable_pkt_verify:
                     if not req.VerifyAuthRequest():
                         raise PacketError('Packet verification failed')
 
             elif self.server_type == ServerType.Coa:
-                if req.code != DisconnectRequest and req.code != CoARequest:
+                if code != DisconnectRequest and code != CoARequest:
                     raise ServerPacketError('Received non-coa packet on coa port')
                 req = CoAPacket(secret=remote_host.secret,
                                 dict=self.server.dict,
-                                packet=data)
+                                packet=data,
+                                lazy=self.server.lazy_decode)
                 if self.server.enable_pkt_verify:
                     if not req.VerifyCoARequest():
                         raise PacketError('Packet verification failed')
 
             elif self.server_type == ServerType.Acct:
 
-                if req.code != AccountingRequest:
+                if code != AccountingRequest:
                     raise ServerPacketError('Received non-acct packet on acct port')
                 req = AcctPacket(secret=remote_host.secret,
                                  dict=self.server.dict,
-                                 packet=data)
+                                 packet=data,
+                                 lazy=self.server.lazy_decode)
                 if self.server.enable_pkt_verify:
                     if not req.VerifyAcctRequest():
                         raise PacketError('Packet verification failed')
@@ -125,6 +131,14 @@ class DatagramProtocolServer(asyncio.Protocol):
             self.transport.close()
             self.transport = None
 
+        tasks = list(self.handler_tasks)
+        if tasks:
+            self.logger.debug('[%s:%d] Cancel %d running handlers...',
+                              self.ip, self.port, len(tasks))
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     def __str__(self):
         return 'DatagramProtocolServer(ip=%s, port=%d)' % (self.ip, self.port)
 
@@ -139,7 +153,25 @@ class ServerAsync(metaclass=ABCMeta):
                  coa_port=3799, hosts=None, dictionary=None,
                  loop=None, logger_name='pyrad',
                  enable_pkt_verify=False,
-                 debug=False):
+                 debug=False, lazy_decode=False,
+                 max_concurrent=None, request_timeout=None):
+        """Constructor.
+
+        Packet handlers may be coroutine functions. Their coroutines run
+        as tasks, so handlers can await I/O without blocking the event
+        loop. These tasks are cancelled when the transport that received
+        the request is closed.
+
+        :param max_concurrent:  maximum number of coroutine handlers that
+                                run at the same time; further requests wait
+                                for a free slot (default unlimited)
+        :type max_concurrent:   integer
+        :param request_timeout: seconds a coroutine handler may take,
+                                including the time spent waiting for a free
+                                slot, before it is cancelled (default no
+                                limit)
+        :type request_timeout:  float
+        """
 
         if not loop:
             self.loop = asyncio.get_event_loop()
@@ -163,6 +195,10 @@ class ServerAsync(metaclass=ABCMeta):
 
         self.dict = dictionary
         self.enable_pkt_verify = enable_pkt_verify
+        self.lazy_decode = lazy_decode
+        self.max_concurrent = max_concurrent
+        self.request_timeout = request_timeout
+        self._handler_semaphore = None
 
         self.debug = debug
 
@@ -170,17 +206,24 @@ class ServerAsync(metaclass=ABCMeta):
 
         try:
             if protocol.server_type == ServerType.Acct:
-                self.handle_acct_packet(protocol, req, addr)
+                result = self.handle_acct_packet(protocol, req, addr)
             elif protocol.server_type == ServerType.Auth:
-                self.handle_auth_packet(protocol, req, addr)
+                result = self.handle_auth_packet(protocol, req, addr)
             elif protocol.server_type == ServerType.Coa and \
                     req.code == CoARequest:
-                self.handle_coa_packet(protocol, req, addr)
+                result = self.handle_coa_packet(protocol, req, addr)
             elif protocol.server_type == ServerType.Coa and \
                     req.code == DisconnectRequest:
-                self.handle_disconnect_packet(protocol, req, addr)
+                result = self.handle_disconnect_packet(protocol, req, addr)
             else:
                 self.logger.error('[%s:%s] Unexpected request found', protocol.ip, protocol.port)
+                return
+
+            if inspect.isawaitable(result):
+                task = self.loop.create_task(
+                    self.__run_handler__(protocol, result, addr))
+                protocol.handler_tasks.add(task)
+                task.add_done_callback(protocol.handler_tasks.discard)
         except Exception as exc:
             if self.debug:
                 self.logger.exception('[%s:%s] Unexpected error', protocol.ip, protocol.port)
@@ -188,6 +231,38 @@ class ServerAsync(metaclass=ABCMeta):
             else:
                 self.logger.error('[%s:%s] Unexpected error: %s', protocol.ip, protocol.port, exc)
 
+    async def __run_handler__(self, protocol, handler, addr):
+        try:
+            if self.request_timeout is None:
+                await self.__limit_handler__(handler)
+            else:
+                await asyncio.wait_for(self.__limit_handler__(handler),
+                                       self.request_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning('[%s:%s] Handler for request from %s timed out',
+                                protocol.ip, protocol.port, addr)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            if self.debug:
+                self.logger.exception('[%s:%s] Unexpected error', protocol.ip, protocol.port)
+            else:
+                self.logger.error('[%s:%s] Unexpected error: %s', protocol.ip, protocol.port, exc)
+        finally:
+            # Handlers cancelled while waiting for a slot never started.
+            if inspect.iscoroutine(handler):
+                handler.close()
+
+    async def __limit_handler__(self, handler):
+        if self.max_concurrent is None:
+            await handler
+            return
+
+        if self._handler_semaphore is None:
+            self._handler_semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self._handler_semaphore:
+            await handler
+
     def __is_present_proto__(self, ip, port):
         if port == self.auth_port:
             for proto in self.auth_protocols:
@@ -205,14 +280,18 @@ class ServerAsync(metaclass=ABCMeta):
 
     # noinspection PyPep8Naming
     @staticmethod
-    def CreateReplyPacket(pkt, **attributes):
+    def CreateReplyPacket(pkt, template=None, **attributes):
         """Create a reply packet.
         Create a new packet which can be returned as a reply to a received
         packet.
 
-        :param pkt:   original packet
-        :type pkt:    Packet instance
+        :param pkt:      original packet
+        :type pkt:       Packet instance
+        :param template: template with the static reply attributes
+        :type template:  pyrad.packet.PacketTemplate
         """
+        if template is not None:
+            return template.CreateReply(pkt, **attributes)
         reply = pkt.CreateReply(**attributes)
         return reply
 
@@ -0,0 +1,345 @@
+# shareddict.py
+#
+# Read-only dictionary stored in a flat buffer
+
+"""
+A parsed :obj:`pyrad.dictionary.Dictionary` is a large graph of Python
+objects. Pre-forked workers that each load the dictionary keep a copy
+of that graph per process, and even a dictionary loaded before forking
+ends up copied page by page, because reference counting writes to
+every object touched.
+
+A SharedDictionary stores the dictionary in one flat, read-only buffer,
+normally an mmap. Anonymous mmaps created before forking are shared by
+all workers, and file mappings are shared by all processes mapping the
+same file. Workers look up attributes with a binary search in the
+buffer. Only the attributes a worker actually uses are turned into
+:obj:`pyrad.dictionary.Attribute` objects, and those stay private to
+the worker.
+
+Layout of the buffer, all integers in network byte order::
+
+  magic        8 bytes
+  header       meta offset and length, name index offset and count,
+               key index offset and count
+  records      marshalled attribute records
+  meta         marshalled vendors and attribute codes
+  name index   (string offset, string length, record offset, record
+               length) entries sorted by attribute name
+  key index    the same entries sorted by attribute key, pointing at
+               the attribute name
+  strings      attribute names and keys
+"""
+
+import marshal
+import mmap
+import struct
+
+from pyrad import bidict
+from pyrad.dictionary import Attribute
+from pyrad.dictionary import KeyResolver
+
+__docformat__ = 'epytext en'
+
+MAGIC = b'PYRADSD1'
+_HEADER = struct.Struct('!8sIIIIII')
+_ENTRY = struct.Struct('!IHII')
+
+
+def _KeyBytes(key):
+    """Canonical encoding of an attribute key for the key index."""
+    return repr(key).encode('utf-8')
+
+
+def BuildSharedDictionary(dictionary):
+    """Serialize a dictionary in the SharedDictionary layout.
+
+    :param dictionary: dictionary to serialize
+    :type dictionary:  pyrad.dictionary.Dictionary
+    :return:           serialized dictionary
+    :rtype:            bytes
+    """
+    records = bytearray()
+    strings = bytearray()
+    names = []
+    keys = []
+    name_offsets = {}
+    for (name, attr) in dictionary.attributes.items():
+        record = marshal.dumps((
+            attr.name, attr.code, attr.type, attr.vendor, attr.encrypt,
+            attr.has_tag, attr.is_sub_attribute,
+            attr.parent.name if attr.parent is not None else None,
+            tuple((key, value.name, True) if isinstance(value, Attribute)
+                  else (key, value, False)
+                  for (key, value) in attr.sub_attributes.items()),
+            tuple(attr.values.forward.items()),
+            dictionary.attrindex.forward.get(name)))
+        offset = _HEADER.size + len(records)
+        records += record
+        names.append((name.encode('utf-8'), offset, len(record)))
+
+    meta = marshal.dumps((dictionary.vendors.forward,
+                          dictionary.attrcodes.forward))
+    meta_offset = _HEADER.size + len(records)
+
+    for (name, key) in dictionary.attrindex.forward.items():
+        keys.append((_KeyBytes(key), name.encode('utf-8')))
+
+    index_offset = meta_offset + len(meta)
+    key_index_offset = index_offset + len(names) * _ENTRY.size
+    strings_offset = key_index_offset + len(keys) * _ENTRY.size
+
+    def AddString(value):
+        offset = strings_offset + len(strings)
+        strings.extend(value)
+        return offset
+
+    index = bytearray()
+    for (name, offset, length) in sorted(names):
+        name_offsets[name] = AddString(name)
+        index += _ENTRY.pack(name_offsets[name], len(name), offset, length)
+    for (key, name) in sorted(keys):
+        if name not in name_offsets:
+            name_offsets[name] = AddString(name)
+        index += _ENTRY.pack(AddString(key), len(key), name_offsets[name],
+                             len(name))
+
+    header = _HEADER.pack(MAGIC, meta_offset, len(meta), index_offset,
+                          len(names), key_index_offset, len(keys))
+    return header + bytes(records) + meta + bytes(index) + bytes(strings)
+
+
+def WriteSharedDictionary(dictionary, path):
+    """Write a dictionary in the SharedDictionary layout to a file, to be
+    mapped with :obj:`SharedDictionary.Open`.
+
+    :param dictionary: dictionary to write
+    :type dictionary:  pyrad.dictionary.Dictionary
+    :param path:       file to write
+    :type path:        string
+    """
+    with open(path, 'wb') as fd:
+        fd.write(BuildSharedDictionary(dictionary))
+
+
+class _SortedIndex(object):
+    """Binary search over an index of the buffer."""
+    __slots__ = ('buffer', 'offset', 'count')
+
+    def __init__(self, buffer, offset, count):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    def Find(self, key):
+        """Return (offset, length) of the value for key, or None."""
+        buffer = self.buffer
+        (low, high) = (0, self.count)
+        while low < high:
+            middle = (low + high) // 2
+            (koffset, klength, voffset, vlength) = _ENTRY.unpack_from(
+                buffer, self.offset + middle * _ENTRY.size)
+            current = buffer[koffset:koffset + klength]
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return (voffset, vlength)
+        return None
+
+    def Keys(self):
+        for i in range(self.count):
+            (koffset, klength, _, _) = _ENTRY.unpack_from(
+                self.buffer, self.offset + i * _ENTRY.size)
+            yield self.buffer[koffset:koffset + klength]
+
+
+class _SharedAttributes(object):
+    """Mapping of attribute names to attributes, materialized on first
+    access."""
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.cache = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.cache[name]
+        except KeyError:
+            if not isinstance(name, str):
+                raise
+        found = self.shared.names.Find(name.encode('utf-8'))
+        if found is None:
+            raise KeyError(name)
+        return self.shared._Materialize(name, found)
+
+    def get(self, name, failobj=None):
+        try:
+            return self[name]
+        except KeyError:
+            return failobj
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for name in self.shared.names.Keys():
+            yield name.decode('utf-8')
+
+    def keys(self):
+        return list(self)
+
+    def __len__(self):
+        return self.shared.names.count
+
+
+class _SharedAttrIndex(object):
+    """Read-only BiDict interface to the attribute index."""
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.cache = {}
+        self.forward = {}
+
+    def HasForward(self, name):
+        return name in self.shared.attributes
+
+    def GetForward(self, name):
+        if name not in self.forward:
+            self.shared.attributes[name]
+        key = self.forward[name]
+        if key is None:
+            raise KeyError(name)
+        return key
+
+    def HasBackward(self, key):
+        try:
+            self.GetBackward(key)
+        except KeyError:
+            return False
+        return True
+
+    def GetBackward(self, key):
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable keys are not in the index
+            raise KeyError(key)
+        found = self.shared.keys.Find(_KeyBytes(key))
+        if found is None:
+            raise KeyError(key)
+        (offset, length) = found
+        name = self.shared.buffer[offset:offset + length].decode('utf-8')
+        self.cache[key] = name
+        return name
+
+    def __getitem__(self, name):
+        return self.GetForward(name)
+
+    def __len__(self):
+        return self.shared.keys.count
+
+
+class SharedDictionary(object):
+    """Read-only RADIUS dictionary stored in a flat buffer.
+    It can be used wherever packets expect a
+    :obj:`pyrad.dictionary.Dictionary`.
+
+    :ivar vendors:    bidict mapping vendor name to vendor code
+    :type vendors:    bidict
+    :ivar attrindex:  read-only mapping between attribute names and keys
+    :type attrindex:  bidict interface
+    :ivar attributes: read-only mapping of attribute name to attribute
+    :type attributes: mapping
+    :ivar resolver:   attribute names resolved to their packet keys
+    :type resolver:   pyrad.dictionary.KeyResolver
+    """
+
+    def __init__(self, buffer):
+        """
+        :param buffer: dictionary built by BuildSharedDictionary
+        :type buffer:  bytes, mmap or other buffer
+        """
+        (magic, meta_offset, meta_length, index_offset, index_count,
+         key_index_offset, key_index_count) = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a shared dictionary')
+        self.buffer = buffer
+        self.names = _SortedIndex(buffer, index_offset, index_count)
+        self.keys = _SortedIndex(buffer, key_index_offset, key_index_count)
+
+        (vendors, attrcodes) = marshal.loads(
+            buffer[meta_offset:meta_offset + meta_length])
+        self.vendors = bidict.BiDict()
+        for (name, code) in vendors.items():
+            self.vendors.Add(name, code)
+        self.attrcodes = bidict.BiDict()
+        for (code, datatype) in attrcodes.items():
+            self.attrcodes.Add(code, datatype)
+
+        self.attributes = _SharedAttributes(self)
+        self.attrindex = _SharedAttrIndex(self)
+        self.resolver = KeyResolver(self)
+
+    @classmethod
+    def FromDictionary(cls, dictionary):
+        """Copy a dictionary into an anonymous shared mmap. Create it
+        before forking workers so they all use the same memory.
+
+        :param dictionary: dictionary to share
+        :type dictionary:  pyrad.dictionary.Dictionary
+        :rtype:            SharedDictionary
+        """
+        data = BuildSharedDictionary(dictionary)
+        buffer = mmap.mmap(-1, len(data))
+        buffer.write(data)
+        return cls(buffer)
+
+    @classmethod
+    def Open(cls, path):
+        """Map a file written by WriteSharedDictionary.
+
+        :param path: file to map
+        :type path:  string
+        :rtype:      SharedDictionary
+        """
+        with open(path, 'rb') as fd:
+            return cls(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _Materialize(self, name, found):
+        (offset, length) = found
+        (name, code, datatype, vendor, encrypt, has_tag, is_sub_attribute,
+         parent, sub_attributes, values, key) = marshal.loads(
+            self.buffer[offset:offset + length])
+        attr = Attribute(name, code, datatype, is_sub_attribute, vendor,
+                         values=dict(values), encrypt=encrypt,
+                         has_tag=has_tag, attrcodes=self.attrcodes)
+        self.attrindex.forward[name] = key
+        # Cache before resolving related attributes, which may refer
+        # back to this attribute.
+        self.attributes.cache[name] = attr
+        for (subkey, value, is_attribute) in sub_attributes:
+            if is_attribute:
+                value = self.attributes[value]
+            attr.sub_attributes[subkey] = value
+        if parent is not None:
+            attr.parent = self.attributes[parent]
+        return attr
+
+    def __len__(self):
+        return len(self.attributes)
+
+    def __getitem__(self, key):
+        return self.attributes[key]
+
+    def __contains__(self, key):
+        return key in self.attributes
+
+    has_key = __contains__
@@ -5,8 +5,49 @@ from ipaddress import IPv4Address, IPv6Address
 from ipaddress import IPv4Network, IPv6Network
 import struct
 import binascii
+import functools
 from pyrad.datatypes import Tlv, Extended, LongExtended, Vsa, Evs
 
+_UINT32 = struct.Struct('!I')
+
+# Flags of packed keys for vendor and extended attributes; plain
+# attribute codes are used as is.
+_VENDOR_KEY = 1 << 40
+_EXTENDED_KEY = 2 << 40
+
+
+def PackKey(key):
+    """Pack a packet attribute key into a single integer.
+
+    :param key: attribute code, (vendor code, attribute code) tuple or
+                'type.extended type' string
+    :type key:  integer, tuple or string
+    :return:    packed key
+    :rtype:     integer
+    :raise ValueError: a code does not fit in the packed key
+    """
+    if isinstance(key, int):
+        return key
+    if isinstance(key, tuple):
+        (vendor, code) = key
+        if not 0 <= vendor <= 0xffffffff or not 0 <= code <= 0xff:
+            raise ValueError('Can not pack vendor attribute key %r' % (key,))
+        return _VENDOR_KEY | vendor << 8 | code
+    (code, _, extended) = key.partition('.')
+    (code, extended) = (int(code), int(extended))
+    if not 0 <= code <= 0xff or not 0 <= extended <= 0xff:
+        raise ValueError('Can not pack extended attribute key %r' % key)
+    return _EXTENDED_KEY | code << 8 | extended
+
+
+def UnpackKey(packed):
+    """Turn a key packed by PackKey back into a packet attribute key."""
+    if packed & _EXTENDED_KEY:
+        return '%d.%d' % (packed >> 8 & 0xff, packed & 0xff)
+    if packed & _VENDOR_KEY:
+        return (packed >> 8 & 0xffffffff, packed & 0xff)
+    return packed
+
 
 def EncodeString(origstr):
     if len(origstr) > 253:
@@ -169,7 +210,7 @@ def EncodeInteger64(num, format='!Q'):
 def EncodeDate(num):
     if not isinstance(num, int):
         raise TypeError('Can not encode non-integer as date')
-    return struct.pack('!I', num)
+    return _UINT32.pack(num)
 
 def EncodeEther(addr):
     return struct.pack('6H', *map(lambda x: int(x, 16), (addr.split(':'))))
@@ -234,7 +275,7 @@ def DecodeInteger64(num, format='!Q'):
     return (struct.unpack(format, num))[0]
 
 def DecodeDate(num):
-    return (struct.unpack('!I', num))[0]
+    return _UINT32.unpack(num)[0]
 
 def DecodeEther(addr):
     return ':'.join(map('{0:02x}'.format, struct.unpack('H'*6, addr))).upper()
@@ -242,21 +283,99 @@ def DecodeEther(addr):
 def DecodeIfid(addr):
     return ':'.join(map('{0:02x}'.format, struct.unpack('H'*8, addr))).upper()
 
-def DecodeVsa(data, attrcodes):
-    v_type = struct.unpack('B', data[0:1])
-    v_len = struct.unpack('B', data[1:2])
-    v_id = struct.unpack('I', data[2:6])
+# Deepest nesting of structured values accepted by the decoders.
+MAX_NESTING = 32
+_VENDOR_ID = struct.Struct('I')
+_EVS_HEADER = struct.Struct('!IB')
+
+
+def _DecodeStructured(datatype, data, attrcodes):
+    """Decode a VSA, TLV, extended or EVS value.
+
+    Nested values are decoded by walking offsets into data with an
+    explicit stack instead of recursing, so only leaf values are copied
+    out of the packet.
 
-    curr_attribute_start = 6
-    attributes = []
-    while curr_attribute_start < len(data):
-        datatype = struct.unpack('B', data[curr_attribute_start : curr_attribute_start + 1])[0]
-        length = struct.unpack('B', data[curr_attribute_start + 1: curr_attribute_start + 2])[0]
-        value = DecodeAttr(datatype, data[curr_attribute_start + 2 : curr_attribute_start + length], attrcodes)
+    :param datatype:  structured datatype of the value
+    :type datatype:   string
+    :param data:      encoded value
+    :type data:       bytes
+    :param attrcodes: attribute codes of the dictionary
+    :type attrcodes:  pyrad.bidict.BiDict
+    :return:          decoded value
+    :rtype:           pyrad.datatypes value
+    """
+    forward = attrcodes.forward
+    root = [None]
+    # (container, field, datatype, start, end, depth); an integer field
+    # indexes a list, anything else names an attribute
+    pending = [(root, 0, datatype, 0, len(data), 1)]
+    while pending:
+        (target, field, datatype, start, end, depth) = pending.pop()
+        # Values with a single nested value are walked in place
+        while True:
+            nested = None
+            if datatype == 'tlv':
+                (code, length) = (data[start], data[start + 1])
+                value = Tlv(code, length, None)
+                (nested, datatype) = ('value', forward[code])
+                if start + length < end:
+                    end = start + length
+                start += 2
+            elif datatype == 'vsa':
+                value = Vsa(data[start], data[start + 1],
+                            _VENDOR_ID.unpack_from(data, start + 2)[0], [])
+                offset = start + 6
+                while offset < end:
+                    (code, length) = (data[offset], data[offset + 1])
+                    if length < 2:
+                        raise ValueError('Invalid VSA sub attribute length')
+                    if (depth >= MAX_NESTING and
+                            forward[code] in STRUCTURED_TYPES):
+                        raise ValueError('Structured value nested too deeply')
+                    attribute = Tlv(code, length, None)
+                    value.attributes.append(attribute)
+                    pending.append((attribute, 'value', forward[code],
+                                    offset + 2, min(offset + length, end),
+                                    depth + 1))
+                    offset += length
+            elif datatype == 'extended':
+                (code, length) = (data[start], data[start + 1])
+                value = Extended(code, length, data[start + 2], None)
+                (nested, datatype) = (
+                    'value', forward[f'{code}.{data[start + 2]}'])
+                if start + length < end:
+                    end = start + length
+                start += 3
+            elif datatype == 'evs':
+                (vendor_id, evs_type) = _EVS_HEADER.unpack_from(data, start)
+                value = Evs(vendor_id, evs_type, None)
+                (nested, datatype) = ('evs_value', forward[evs_type])
+                start += 5
+            else:
+                try:
+                    decoder = DECODERS[datatype]
+                except KeyError:
+                    raise ValueError('Unknown attribute type %s' % datatype)
+                value = decoder(data[start:end])
+
+            if field == 'value':
+                target.value = value
+            elif field.__class__ is int:
+                target[field] = value
+            else:
+                setattr(target, field, value)
+            if nested is None:
+                break
+            depth += 1
+            if depth > MAX_NESTING and datatype in STRUCTURED_TYPES:
+                raise ValueError('Structured value nested too deeply')
+            (target, field) = (value, nested)
+    return root[0]
 
-        attributes.append(Tlv(datatype, length, value))
 
-    return Vsa(v_type, v_len, v_id, attributes)
+def DecodeVsa(data, attrcodes):
+    return _DecodeStructured('vsa', data, attrcodes)
 
 def EncodeFloat32(value):
     try:
@@ -322,12 +441,7 @@ def EncodeTlv(tlv: Tlv, attrcodes):
     return type_bstr + len_bstr + val_bstr
 
 def DecodeTlv(value, attrcodes) -> Tlv:
-    datatype = struct.unpack('B', value[0:1])[0]
-    length = struct.unpack('B', value[1:2])[0]
-
-    value = DecodeAttr(attrcodes.GetForward(datatype),
-                       value[2:length], attrcodes)
-    return Tlv(datatype, length, value)
+    return _DecodeStructured('tlv', value, attrcodes)
 
 def EncodeUint16(num):
     try:
@@ -377,15 +491,7 @@ def EncodeExtended(value: Extended, attrcodes):
     return datatype_bstr + length_bstr + extended_datatype_bstr + val_bstr
 
 def DecodeExtended(value, attrcodes):
-    datatype = struct.unpack('B', value[0:1])[0]
-    length = struct.unpack('B', value[1:2])[0]
-    extended_datatype = struct.unpack('B', value[2:3])[0]
-    full_datatype = f'{datatype}.{extended_datatype}'
-
-    value = DecodeAttr(attrcodes.GetForward(full_datatype),
-                       value[3:length], attrcodes)
-
-    return Extended(datatype, length, extended_datatype, value)
+    return _DecodeStructured('extended', value, attrcodes)
 
 def EncodeEvs(value: Evs, attrcodes):
     vendor_id_bstr = struct.pack('I', value.vendor_id)
@@ -395,130 +501,155 @@ def EncodeEvs(value: Evs, attrcodes):
     return vendor_id_bstr + evs_type_bstr + evs_value_bstr
 
 def DecodeEvs(value, attrcodes):
-    vendor_id, evs_type = struct.unpack('!IB', value[0:5])
-    evs_value = DecodeAttr(attrcodes.GetForward(evs_type), value[5:], attrcodes)
+    return _DecodeStructured('evs', value, attrcodes)
+
+def EncodeComboIp(addr):
+    if not isinstance(addr, str):
+        raise TypeError('Address has to be a string')
+    if len(addr.split('.')) == 4:
+        return EncodeAddress(addr)
+    return EncodeIPv6Address(addr)
+
+
+def _IntegerCodec(format, typename):
+    """Build an encoder and decoder pair for a fixed width integer type
+    around a single precompiled :obj:`struct.Struct`.
+    """
+    packer = struct.Struct(format)
+    pack = packer.pack
+    unpack = packer.unpack
+
+    def encode(num):
+        try:
+            num = int(num)
+        except:
+            raise TypeError('Can not encode non-integer as %s' % typename)
+        return pack(num)
+
+    def decode(num):
+        return unpack(num)[0]
+
+    return encode, decode
+
+
+_Integer = _IntegerCodec('!I', 'integer')
+_Signed = _IntegerCodec('!i', 'integer')
+_Short = _IntegerCodec('!H', 'integer')
+_Byte = _IntegerCodec('!B', 'integer')
+_Integer64 = _IntegerCodec('!Q', 'integer64')
+
+# Datatypes whose codecs need the dictionary attribute codes to resolve
+# nested values.
+STRUCTURED_TYPES = frozenset(['vsa', 'tlv', 'extended', 'evs'])
+
+ENCODERS = {
+    'string': EncodeString,
+    'octets': EncodeOctets,
+    'integer': _Integer[0],
+    'uint32': _Integer[0],
+    'ipaddr': EncodeAddress,
+    'ipv6prefix': EncodeIPv6Prefix,
+    'ipv6addr': EncodeIPv6Address,
+    'abinary': EncodeAscendBinary,
+    'signed': _Signed[0],
+    'short': _Short[0],
+    'byte': _Byte[0],
+    'date': EncodeDate,
+    'integer64': _Integer64[0],
+    'combo-ip': EncodeComboIp,
+    'ipv4prefix': EncodeIPv4Prefix,
+    'ether': EncodeEther,
+    'ifid': EncodeIfid,
+    'vsa': EncodeVsa,
+    'float32': EncodeFloat32,
+    'int64': EncodeInt64,
+    'uint8': EncodeUint8,
+    'uint64': EncodeUint64,
+    'bool': EncodeBool,
+    'tlv': EncodeTlv,
+    'uint16': EncodeUint16,
+    'long-extended': EncodeLongExtended,
+    'extended': EncodeExtended,
+    'evs': EncodeEvs,
+}
+
+DECODERS = {
+    'string': DecodeString,
+    'octets': DecodeOctets,
+    'integer': _Integer[1],
+    'uint32': _Integer[1],
+    'ipaddr': DecodeAddress,
+    'ipv6prefix': DecodeIPv6Prefix,
+    'ipv6addr': DecodeIPv6Address,
+    'abinary': DecodeAscendBinary,
+    'signed': _Signed[1],
+    'short': _Short[1],
+    'byte': _Byte[1],
+    'date': DecodeDate,
+    'integer64': _Integer64[1],
+    'combo-ip': DecodeComboIp,
+    'ipv4prefix': DecodeIPv4Prefix,
+    'ether': DecodeEther,
+    'ifid': DecodeIfid,
+    'vsa': DecodeVsa,
+    'float32': DecodeFloat32,
+    'int64': DecodeInt64,
+    'uint8': DecodeUint8,
+    'uint64': DecodeUint64,
+    'bool': DecodeBool,
+    'tlv': DecodeTlv,
+    'uint16': DecodeUint16,
+    'long-extended': DecodeLongExtended,
+    'extended': DecodeExtended,
+    'evs': DecodeEvs,
+}
+
+
+def CompileCodec(datatype, attrcodes=None):
+    """Look up the encoder and decoder for a datatype.
+
+    The returned callables take a single value argument; codecs for
+    structured types are bound to the attribute codes they need.
+
+    :param datatype:  name of the datatype
+    :type datatype:   string
+    :param attrcodes: attribute codes of the dictionary
+    :type attrcodes:  pyrad.bidict.BiDict
+    :return:          encoder and decoder
+    :rtype:           tuple of two callables
+    """
+    try:
+        encoder = ENCODERS[datatype]
+        decoder = DECODERS[datatype]
+    except KeyError:
+        raise ValueError('Unknown attribute type %s' % datatype)
+
+    if datatype in STRUCTURED_TYPES:
+        encoder = functools.partial(encoder, attrcodes=attrcodes)
+        decoder = functools.partial(decoder, attrcodes=attrcodes)
+    return encoder, decoder
 
-    return Evs(vendor_id, evs_type, evs_value)
 
 def EncodeAttr(datatype, value, attrcodes=None):
-    if datatype == 'string':
-        return EncodeString(value)
-    elif datatype == 'octets':
-        return EncodeOctets(value)
-    elif datatype == 'integer' or datatype == 'uint32':
-        return EncodeInteger(value)
-    elif datatype == 'ipaddr':
-        return EncodeAddress(value)
-    elif datatype == 'ipv6prefix':
-        return EncodeIPv6Prefix(value)
-    elif datatype == 'ipv6addr':
-        return EncodeIPv6Address(value)
-    elif datatype == 'abinary':
-        return EncodeAscendBinary(value)
-    elif datatype == 'signed':
-        return EncodeInteger(value, '!i')
-    elif datatype == 'short':
-        return EncodeInteger(value, '!H')
-    elif datatype == 'byte':
-        return EncodeInteger(value, '!B')
-    elif datatype == 'date':
-        return EncodeDate(value)
-    elif datatype == 'integer64':
-        return EncodeInteger64(value)
-    elif datatype == 'combo-ip':
-        if len(value.split('.')) == 4:
-            return EncodeAddress(value)
-    elif datatype == 'ipv4prefix':
-        return EncodeIPv4Prefix(value)
-    elif datatype == 'ether':
-        return EncodeEther(value)
-    elif datatype == 'ifid':
-        return EncodeIfid(value)
-    elif datatype == 'vsa':
-        return EncodeVsa(value, attrcodes)
-    elif datatype == 'float32':
-        return EncodeFloat32(value)
-    elif datatype == 'int64':
-        return EncodeInt64(value)
-    elif datatype == 'uint8':
-        return EncodeUint8(value)
-    elif datatype == 'uint64':
-        return EncodeUint64(value)
-    elif datatype == 'bool':
-        return EncodeBool(value)
-    elif datatype == 'tlv':
-        return EncodeTlv(value, attrcodes)
-    elif datatype == 'uint16':
-        return EncodeUint16(value)
-    elif datatype == 'long-extended':
-        return EncodeLongExtended(value)
-    elif datatype == 'extended':
-        return EncodeExtended(value, attrcodes)
-    elif datatype == 'evs':
-        return EncodeEvs(value, attrcodes)
-    else:
+    try:
+        encoder = ENCODERS[datatype]
+    except KeyError:
         raise ValueError('Unknown attribute type %s' % datatype)
 
+    if datatype in STRUCTURED_TYPES:
+        return encoder(value, attrcodes)
+    return encoder(value)
+
 
 def DecodeAttr(datatype, value, attrcodes=None):
+    try:
+        decoder = DECODERS[datatype]
+    except KeyError:
+        raise ValueError('Unknown attribute type %s' % datatype)
+
     if not isinstance(value, bytes):
         value = value.encode('utf-8')
 
-    if datatype== 'string':
-        return DecodeString(value)
-    elif datatype == 'octets':
-        return DecodeOctets(value)
-    elif datatype == 'integer' or datatype == 'uint32':
-        return DecodeInteger(value)
-    elif datatype == 'ipaddr':
-        return DecodeAddress(value)
-    elif datatype == 'ipv6prefix':
-        return DecodeIPv6Prefix(value)
-    elif datatype == 'ipv6addr':
-        return DecodeIPv6Address(value)
-    elif datatype == 'abinary':
-        return DecodeAscendBinary(value)
-    elif datatype == 'signed':
-        return DecodeInteger(value, '!i')
-    elif datatype == 'short':
-        return DecodeInteger(value, '!H')
-    elif datatype == 'byte':
-        return DecodeInteger(value, '!B')
-    elif datatype == 'date':
-        return DecodeDate(value)
-    elif datatype == 'integer64':
-        return DecodeInteger64(value)
-    elif datatype == 'combo-ip':
-        if len(value) == '4':
-            return DecodeAddress(value)
-        return DecodeIPv6Address(value)
-    elif datatype == 'ipv4prefix':
-        return DecodeIPv4Prefix(value)
-    elif datatype == 'ether':
-        return DecodeEther(value)
-    elif datatype == 'ifid':
-        return DecodeIfid(value)
-    elif datatype == 'vsa':
-        return DecodeVsa(value, attrcodes)
-    elif datatype == 'float32':
-        return DecodeFloat32(value)
-    elif datatype == 'int64':
-        return DecodeInt64(value)
-    elif datatype == 'uint8':
-        return DecodeUint8(value)
-    elif datatype == 'uint64':
-        return DecodeUint64(value)
-    elif datatype == 'bool':
-        return DecodeBool(value)
-    elif datatype == 'tlv':
-        return DecodeTlv(value, attrcodes)
-    elif datatype == 'uint16':
-        return DecodeUint16(value)
-    elif datatype == 'long-extended':
-        return DecodeLongExtended(value)
-    elif datatype == 'extended':
-        return DecodeExtended(value, attrcodes)
-    elif datatype == 'evs':
-        return DecodeEvs(value, attrcodes)
-    else:
-        raise ValueError('Unknown attribute type %s' % datatype)
+    if datatype in STRUCTURED_TYPES:
+        return decoder(value, attrcodes)
+    return decoder(value)
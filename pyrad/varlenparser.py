@@ -1,3 +1,23 @@
+import re
+
+# A datatype with an optional fixed length, such as octets[24]
+_DATATYPE = re.compile(r'([^\[]*)(?:\[([^\]]*)\])?')
+
+
+def ParseDataType(spec):
+    """Split a datatype specification into datatype and fixed length.
+
+    :param spec: datatype, optionally followed by a length in brackets
+    :type spec:  string
+    :return:     datatype and length, or None if no length is given
+    :rtype:      tuple of string and integer
+    """
+    (datatype, length) = _DATATYPE.match(spec).groups()
+    if length is None:
+        return (datatype, None)
+    return (datatype, int(length))
+
+
 class VarLenParser:
     """
     Data type parser to support fixed length datatypes.
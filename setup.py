@@ -30,6 +30,7 @@ setup(name='pyrad',
       keywords=['radius', 'authentication'],
       zip_safe=True,
       include_package_data=True,
+      extras_require={'numpy': ['numpy>=1.13']},
       tests_require='nose>=0.10.0b1',
       test_suite='nose.collector',
       )
@@ -23,6 +23,9 @@ class MockPacket:
     def RequestPacket(self):
         return "request packet"
 
+    def RetransmitPacket(self, packet, delay):
+        return packet
+
     def __contains__(self, key):
         return key in self.data
     has_key = __contains__
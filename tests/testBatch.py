@@ -0,0 +1,134 @@
+from io import StringIO
+import struct
+import unittest
+
+from pyrad.batch import DecodeBatch
+from pyrad.batch import numpy
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AcctPacket
+from pyrad.packet import PacketError
+
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  NAS-IP-Address       4   ipaddr
+ATTRIBUTE  NAS-Port             5   integer
+ATTRIBUTE  Class                25  octets
+ATTRIBUTE  Acct-Status-Type     40  integer
+ATTRIBUTE  Event-Timestamp      55  date
+ATTRIBUTE  Acct-Input-Gigawords 52  integer64
+ATTRIBUTE  Tunnel-Password      69  string  encrypt=2
+VALUE      Acct-Status-Type     Start   1
+VENDOR     Simplon              16
+BEGIN-VENDOR Simplon
+ATTRIBUTE  Simplon-Number       1   integer
+ATTRIBUTE  Simplon-String       2   string
+ATTRIBUTE  Simplon-Tlv          3   tlv
+ATTRIBUTE  Simplon-Tlv-Number   1   integer
+END-VENDOR Simplon
+"""
+
+
+def Attribute(code, value):
+    return struct.pack('!BB', code, len(value) + 2) + value
+
+
+def Packet(*attributes):
+    attrs = b''.join(attributes)
+    return struct.pack('!BBH', 4, 1, 20 + len(attrs)) + 16 * b'\x00' + attrs
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class DecodeBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.dict = Dictionary(StringIO(DICTIONARY))
+        self.packets = [
+            Packet(Attribute(1, b'alice'),
+                   Attribute(4, b'\xc0\xa8\x00\x01'),
+                   Attribute(5, struct.pack('!L', 10)),
+                   Attribute(55, struct.pack('!L', 1700000000)),
+                   Attribute(52, struct.pack('!Q', 1 << 40)),
+                   Attribute(26, struct.pack('!LBBL', 16, 1, 6, 7))),
+            Packet(Attribute(5, struct.pack('!L', 20)),
+                   Attribute(5, struct.pack('!L', 30)),
+                   Attribute(40, struct.pack('!L', 1)),
+                   Attribute(26, struct.pack('!LBB', 16, 2, 5) + b'abc')),
+            Packet(Attribute(1, b'bob'),
+                   Attribute(25, b'\xff\x00'),
+                   Attribute(5, b'\x00\x01')),
+        ]
+
+    def testFixedWidthColumns(self):
+        columns = DecodeBatch(self.dict, self.packets,
+                              ['NAS-Port', 'NAS-IP-Address',
+                               'Event-Timestamp', 'Acct-Input-Gigawords',
+                               'Acct-Status-Type', 'Simplon-Number'])
+        port = columns['NAS-Port']
+        self.assertEqual(port.dtype, numpy.uint32)
+        self.assertEqual(port.tolist(), [10, 20, None])
+        self.assertEqual(columns['NAS-IP-Address'].tolist(),
+                         [0xc0a80001, None, None])
+        self.assertEqual(columns['Event-Timestamp'].tolist(),
+                         [1700000000, None, None])
+        gigawords = columns['Acct-Input-Gigawords']
+        self.assertEqual(gigawords.dtype, numpy.uint64)
+        self.assertEqual(gigawords.tolist(), [1 << 40, None, None])
+        self.assertEqual(columns['Acct-Status-Type'].tolist(),
+                         [None, 1, None])
+        self.assertEqual(columns['Simplon-Number'].tolist(), [7, None, None])
+
+    def testObjectColumns(self):
+        columns = DecodeBatch(self.dict, self.packets,
+                              ['User-Name', 'Class', 'Simplon-String'])
+        self.assertEqual(columns['User-Name'].dtype, object)
+        self.assertEqual(columns['User-Name'].tolist(),
+                         ['alice', None, 'bob'])
+        self.assertEqual(columns['Class'].tolist(), [None, None, b'\xff\x00'])
+        self.assertEqual(columns['Simplon-String'].tolist(),
+                         [None, 'abc', None])
+
+    def testMatchesPacket(self):
+        names = ['User-Name', 'NAS-Port', 'Simplon-Number']
+        packets = self.packets[:2]
+        columns = DecodeBatch(self.dict, packets, names)
+        for (row, raw) in enumerate(packets):
+            pkt = AcctPacket(packet=raw, dict=self.dict)
+            for name in names:
+                value = columns[name][row]
+                if name in pkt:
+                    self.assertEqual(value, pkt[name][0])
+                else:
+                    self.assertIn(value, (None, numpy.ma.masked))
+
+    def testOffsets(self):
+        buffer = b''.join(self.packets)
+        offsets = numpy.cumsum([0] + [len(p) for p in self.packets[:-1]])
+        columns = DecodeBatch(self.dict, buffer, ['NAS-Port', 'User-Name'],
+                              offsets=offsets)
+        self.assertEqual(columns['NAS-Port'].tolist(), [10, 20, None])
+        self.assertEqual(columns['User-Name'].tolist(),
+                         ['alice', None, 'bob'])
+
+    def testEmpty(self):
+        columns = DecodeBatch(self.dict, [], ['NAS-Port', 'User-Name'])
+        self.assertEqual(len(columns['NAS-Port']), 0)
+        self.assertEqual(len(columns['User-Name']), 0)
+
+    def testInvalidPacket(self):
+        packets = [self.packets[0], self.packets[1][:-1]]
+        with self.assertRaisesRegex(PacketError, 'Packet 1'):
+            DecodeBatch(self.dict, packets, ['NAS-Port'])
+        packets = [Packet(b'\x05\x01')]
+        self.assertRaises(PacketError, DecodeBatch, self.dict, packets,
+                          ['NAS-Port'])
+        self.assertRaises(PacketError, DecodeBatch, self.dict, [b'\x04'],
+                          ['NAS-Port'])
+
+    def testUnsupportedAttributes(self):
+        self.assertRaises(ValueError, DecodeBatch, self.dict, self.packets,
+                          ['Simplon-Tlv'])
+        self.assertRaises(ValueError, DecodeBatch, self.dict, self.packets,
+                          ['Tunnel-Password'])
+        self.assertRaises(ValueError, DecodeBatch, self.dict, self.packets,
+                          ['NAS-Port', 'NAS-Port'])
+        self.assertRaises(KeyError, DecodeBatch, self.dict, self.packets,
+                          ['Unknown-Attribute'])
@@ -1,18 +1,32 @@
+import asyncio
+import logging
 import select
 import socket
+import threading
 import unittest
+from io import StringIO
 from .mock import MockPacket
 from .mock import MockPoll
 from .mock import MockSocket
 from pyrad.client import Client
 from pyrad.client import Timeout
+from pyrad.client_async import ClientAsync
+from pyrad.client_async import DatagramProtocolClient
+from pyrad.client_async import IdentifierPool
 from pyrad.packet import AuthPacket
 from pyrad.packet import AcctPacket
 from pyrad.packet import AccessRequest
 from pyrad.packet import AccountingRequest
+from pyrad.packet import AccessAccept
+from pyrad.dictionary import Dictionary
+from pyrad.packet import Packet
 
 BIND_IP = "127.0.0.1"
 BIND_PORT = 53535
+DICTIONARY = """
+ATTRIBUTE  User-Name            1   string
+ATTRIBUTE  Acct-Delay-Time      41  integer
+"""
 
 
 class ConstructionTests(unittest.TestCase):
@@ -182,3 +196,270 @@ class OtherTests(unittest.TestCase):
         self.assertTrue(packet.dict is self.client.dict)
         self.assertEqual(packet.id, 15)
         self.assertEqual(packet.secret, b'zeer geheim')
+
+
+class PipelineTests(unittest.TestCase):
+    def setUp(self):
+        self.dict = Dictionary(StringIO(DICTIONARY))
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind((BIND_IP, 0))
+        port = self.server.getsockname()[1]
+        self.client = Client(BIND_IP, authport=port, acctport=port,
+                             secret=b'secret', dict=self.dict,
+                             retries=2, timeout=0.2)
+
+    def tearDown(self):
+        self.client._CloseSocket()
+        self.server.close()
+
+    def Respond(self, count, reverse=False):
+        """Answer count requests, in reverse order once all of them have
+        arrived if reverse is set."""
+        def Answer(data, addr):
+            request = Packet(packet=data, secret=b'secret', dict=self.dict)
+            reply = request.CreateReply()
+            reply.code = AccessAccept
+            self.server.sendto(reply.ReplyPacket(), addr)
+
+        def Run():
+            requests = []
+            for _ in range(count):
+                requests.append(self.server.recvfrom(4096))
+                if not reverse:
+                    Answer(*requests.pop())
+            for (data, addr) in reversed(requests):
+                Answer(data, addr)
+        thread = threading.Thread(target=Run)
+        thread.start()
+        return thread
+
+    def testRepliesInArrivalOrder(self):
+        packets = [self.client.CreateAuthPacket(id=i, User_Name='user')
+                   for i in range(3)]
+        thread = self.Respond(3, reverse=True)
+        results = list(self.client.SendPackets(packets))
+        thread.join()
+        self.assertEqual([pkt.id for (pkt, reply) in results], [2, 1, 0])
+        for (pkt, reply) in results:
+            self.assertEqual(reply.code, AccessAccept)
+            self.assertEqual(reply.id, pkt.id)
+
+    def testDuplicateIdWaits(self):
+        packets = [self.client.CreateAuthPacket(id=7, User_Name='user')
+                   for i in range(2)]
+        thread = self.Respond(2)
+        results = list(self.client.SendPackets(packets))
+        thread.join()
+        self.assertEqual([pkt for (pkt, reply) in results], packets)
+        self.assertTrue(all(reply is not None for (pkt, reply) in results))
+
+    def testWindow(self):
+        self.server.settimeout(0.1)
+        packets = [self.client.CreateAuthPacket(id=i, User_Name='user')
+                   for i in range(3)]
+        self.client.retries = 1
+        results = self.client.SendPackets(packets, window=2)
+        self.assertEqual(next(results), (packets[0], None))
+        self.server.recvfrom(4096)
+        self.server.recvfrom(4096)
+        self.assertRaises(socket.timeout, self.server.recvfrom, 4096)
+        self.assertEqual(list(results), [(packets[1], None),
+                                         (packets[2], None)])
+
+    def testTimeoutRetransmits(self):
+        self.client.timeout = 1
+        pkt = self.client.CreateAcctPacket(id=3, User_Name='user')
+        results = list(self.client.SendPackets([pkt]))
+        self.assertEqual(results, [(pkt, None)])
+        self.assertEqual(pkt['Acct-Delay-Time'], [1])
+        self.server.settimeout(0.1)
+        first = Packet(packet=self.server.recvfrom(4096)[0], dict=self.dict)
+        second = Packet(packet=self.server.recvfrom(4096)[0], dict=self.dict)
+        self.assertNotIn('Acct-Delay-Time', first)
+        self.assertEqual(second['Acct-Delay-Time'], [1])
+
+
+class FakeClient:
+    """Stands in for the ClientAsync owning a protocol."""
+
+
+class FakeTransport:
+    def __init__(self):
+        self.output = []
+
+    def sendto(self, data):
+        self.output.append(data)
+
+    def close(self):
+        pass
+
+
+class AsyncClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.dict = Dictionary(StringIO(DICTIONARY))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def CreateProtocol(self, retries=2, timeout=0.02):
+        client = FakeClient()
+        client.loop = self.loop
+        client.dict = self.dict
+        protocol = DatagramProtocolClient('127.0.0.1', 1812,
+                                          logging.getLogger('pyrad'), client,
+                                          retries=retries, timeout=timeout)
+        protocol.transport = FakeTransport()
+        return protocol
+
+    def Send(self, protocol, id):
+        pkt = AuthPacket(id=id, secret=b'secret', dict=self.dict,
+                         User_Name='user')
+        future = self.loop.create_future()
+        protocol.send_packet(pkt, future)
+        return (pkt, future)
+
+    def Reply(self, protocol, raw):
+        request = AuthPacket(packet=raw, secret=b'secret', dict=self.dict)
+        protocol.datagram_received(request.CreateReply().ReplyPacket(),
+                                   ('127.0.0.1', 1812))
+
+    def Wait(self, future):
+        return self.loop.run_until_complete(asyncio.wait_for(future, 5))
+
+
+class RetransmitTests(AsyncClientTestCase):
+    def testRetransmitCachedPacket(self):
+        protocol = self.CreateProtocol(retries=1)
+        (pkt, future) = self.Send(protocol, 1)
+        raw = protocol.transport.output[0]
+        # Retransmissions resend the encoded packet, not the packet
+        pkt['User-Name'] = 'changed'
+        self.assertRaises(TimeoutError, self.Wait, future)
+        self.assertEqual(protocol.transport.output, [raw, raw])
+
+    def testTimeout(self):
+        protocol = self.CreateProtocol(retries=2)
+        (pkt, future) = self.Send(protocol, 1)
+        self.assertRaises(TimeoutError, self.Wait, future)
+        self.assertEqual(len(protocol.transport.output), 3)
+        self.assertEqual(protocol.pending_requests, {})
+        self.assertEqual(protocol.timers, [])
+        self.assertIsNone(protocol.timer_handle)
+
+    def testReplyAfterRetry(self):
+        protocol = self.CreateProtocol(retries=3)
+        (pkt, future) = self.Send(protocol, 1)
+        self.loop.run_until_complete(asyncio.sleep(0.03))
+        self.assertEqual(len(protocol.transport.output), 2)
+        self.assertEqual(protocol.pending_requests[1]['retries'], 1)
+        self.Reply(protocol, protocol.transport.output[0])
+        reply = self.Wait(future)
+        self.assertEqual(reply.code, AccessAccept)
+        self.assertNotIn(1, protocol.pending_requests)
+        # The stale timer entry does not send the packet again
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(len(protocol.transport.output), 2)
+        self.assertEqual(protocol.timers, [])
+
+    def testEarliestDeadlineArmed(self):
+        protocol = self.CreateProtocol(timeout=10)
+        self.Send(protocol, 1)
+        first = protocol.timer_deadline
+        protocol.timeout = 0.02
+        (pkt, future) = self.Send(protocol, 2)
+        self.assertLess(protocol.timer_deadline, first)
+        protocol.timeout = 10
+        self.Send(protocol, 3)
+        self.assertEqual(protocol.timer_deadline,
+                         protocol.pending_requests[2]['deadline'])
+        self.assertEqual(len(protocol.timers), 3)
+        self.loop.run_until_complete(asyncio.sleep(0.03))
+        # Only request 2 was resent, the timer is armed for the next
+        # deadline of any request
+        self.assertEqual([req['retries'] for req in
+                          protocol.pending_requests.values()], [0, 1, 0])
+        self.assertEqual(protocol.timer_deadline,
+                         min(req['deadline'] for req in
+                             protocol.pending_requests.values()))
+        self.loop.run_until_complete(protocol.close_transport())
+        self.assertEqual(protocol.timers, [])
+
+
+class IdentifierPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = IdentifierPool()
+        self.protocols = [object(), object()]
+        for protocol in self.protocols:
+            self.pool.add_protocol(protocol)
+
+    def testExhaustion(self):
+        taken = [self.pool.acquire() for _ in range(512)]
+        self.assertEqual(len(set(taken)), 512)
+        self.assertEqual(sorted(id for (protocol, id) in taken
+                                if protocol is self.protocols[1]),
+                         list(range(256)))
+        self.assertRaises(Exception, self.pool.acquire)
+
+    def testRelease(self):
+        taken = [self.pool.acquire() for _ in range(512)]
+        self.pool.release(*taken[10])
+        self.assertEqual(self.pool.acquire(), taken[10])
+        self.assertRaises(Exception, self.pool.acquire)
+
+    def testReleaseRemovedProtocol(self):
+        (protocol, id) = self.pool.acquire()
+        self.pool.clear()
+        self.pool.release(protocol, id)
+        self.assertRaises(Exception, self.pool.acquire)
+
+
+class SocketsPerPortTests(AsyncClientTestCase):
+    def setUp(self):
+        AsyncClientTestCase.setUp(self)
+        self.client = ClientAsync('127.0.0.1', secret=b'secret',
+                                  dict=self.dict, loop=self.loop,
+                                  sockets_per_port=2)
+        for _ in range(2):
+            protocol = DatagramProtocolClient('127.0.0.1', 1812,
+                                              self.client.logger, self.client,
+                                              retries=0, timeout=10)
+            protocol.transport = FakeTransport()
+            self.client.auth_pool.add_protocol(protocol)
+        self.protocols = self.client.auth_pool.protocols
+        self.client.protocol_auth = self.protocols[0]
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.client.deinitialize_transports())
+        AsyncClientTestCase.tearDown(self)
+
+    def testRouting(self):
+        futures = [self.client.SendPacket(
+                       self.client.CreateAuthPacket(User_Name='user'))
+                   for _ in range(300)]
+        pending = [protocol.pending_requests for protocol in self.protocols]
+        self.assertEqual([len(requests) for requests in pending], [256, 44])
+        self.assertEqual(sorted(pending[1]), list(range(44)))
+        futures.extend(self.client.SendPacket(
+                           self.client.CreateAuthPacket(User_Name='user'))
+                       for _ in range(212))
+        self.assertRaises(Exception, self.client.SendPacket,
+                          self.client.CreateAuthPacket(User_Name='user'))
+        for protocol in self.protocols:
+            for raw in protocol.transport.output:
+                self.assertEqual(raw[1], Packet(packet=raw,
+                                                dict=self.dict).id)
+        self.assertTrue(all(not future.done() for future in futures))
+
+    def testReplyReleasesIdentifier(self):
+        futures = [self.client.SendPacket(
+                       self.client.CreateAuthPacket(User_Name='user'))
+                   for _ in range(257)]
+        protocol = self.protocols[1]
+        self.Reply(protocol, protocol.transport.output[0])
+        reply = self.Wait(futures[256])
+        self.assertEqual(reply.code, AccessAccept)
+        self.assertNotIn(0, protocol.pending_requests)
+        # The identifier is free again once the reply arrived
+        free = list(self.client.auth_pool.free)
+        self.assertEqual(free[-1], (protocol, 0))
@@ -1,12 +1,16 @@
 import unittest
 import operator
 import os
+import pickle
+import shutil
+import tempfile
 from io import StringIO
 
 from . import home
 from pyrad.dictionary import Attribute
 from pyrad.dictionary import Dictionary
 from pyrad.dictionary import ParseError
+from pyrad import tools
 from pyrad.tools import DecodeAttr
 from pyrad.dictfile import DictFile
 
@@ -34,6 +38,11 @@ class AttributeTests(unittest.TestCase):
         self.assertEqual(attr.vendor, 'vendor')
         self.assertEqual(len(attr.values), 0)
 
+    def testCompiledCodec(self):
+        attr = Attribute('name', 'code', 'short')
+        self.assertEqual(attr.encoder(5), b'\x00\x05')
+        self.assertEqual(attr.decoder(b'\x00\x05'), 5)
+
     def testValues(self):
         attr = Attribute('name', 'code', 'integer', False, 'vendor',
                 dict(pie='custard', shake='vanilla'))
@@ -348,6 +357,31 @@ class DictionaryParsingTests(unittest.TestCase):
         self.assertEqual(f.File(), '')
         self.assertEqual(f.Line(), -1)
 
+    def testDictFileTokens(self):
+        f = DictFile(StringIO(
+                '# comment\n'
+                '\n'
+                'VENDOR Simplon 42 # trailing comment\n'
+                '  ATTRIBUTE\tTest-Type 1\tinteger\n'))
+        self.assertEqual(list(f.Tokens()),
+                [('', 3, ['VENDOR', 'Simplon', '42']),
+                 ('', 4, ['ATTRIBUTE', 'Test-Type', '1', 'integer'])])
+
+    def testFixedLengthDataType(self):
+        self.dict.ReadDictionary(StringIO(
+                'ATTRIBUTE Test-Octets 1 octets[16]\n'))
+        self.assertEqual(self.dict['Test-Octets'].type, 'octets')
+
+    def testFixedLengthDataTypeError(self):
+        for datatype in ('octets[abc]', 'octets[]'):
+            try:
+                self.dict.ReadDictionary(StringIO(
+                        'ATTRIBUTE Test-Octets 1 %s\n' % datatype))
+            except ParseError as e:
+                self.assertEqual(datatype in str(e), True)
+            else:
+                self.fail()
+
     def testDictFileParseError(self):
         tmpdict = Dictionary()
         try:
@@ -356,3 +390,165 @@ class DictionaryParsingTests(unittest.TestCase):
             self.assertEqual('dictfiletest' in str(e), True)
         else:
             self.fail()
+
+
+class KeyResolverTests(unittest.TestCase):
+    def setUp(self):
+        self.dict = Dictionary(StringIO(
+            'ATTRIBUTE Test-String 1 string\n'
+            'VENDOR Simplon 16\n'
+            'BEGIN-VENDOR Simplon\n'
+            'ATTRIBUTE Simplon-Number 1 integer\n'
+            'ATTRIBUTE Simplon-Wide 300 integer\n'
+            'END-VENDOR Simplon\n'))
+        self.resolver = self.dict.resolver
+
+    def testResolve(self):
+        resolved = self.resolver['Test-String']
+        self.assertEqual(resolved.key, 1)
+        self.assertEqual(resolved.packed, 1)
+        self.assertTrue(resolved.attribute is self.dict['Test-String'])
+        self.assertTrue(self.resolver['Test-String'] is resolved)
+
+    def testResolveVendor(self):
+        resolved = self.resolver['Simplon-Number']
+        self.assertEqual(resolved.key, (16, 1))
+        self.assertEqual(tools.UnpackKey(resolved.packed), (16, 1))
+
+    def testResolveUnpackable(self):
+        resolved = self.resolver['Simplon-Wide']
+        self.assertEqual(resolved.key, (16, 300))
+        self.assertIsNone(resolved.packed)
+
+    def testResolveUnknown(self):
+        self.assertRaises(KeyError, self.resolver.__getitem__, 'Unknown')
+
+    def testName(self):
+        self.assertEqual(self.resolver.Name((16, 1)), 'Simplon-Number')
+        self.assertEqual(self.resolver.Name(1), 'Test-String')
+        self.assertEqual(self.resolver.Name(2), 2)
+
+    def testReadDictionaryClears(self):
+        self.resolver['Test-String']
+        self.dict.ReadDictionary(StringIO('ATTRIBUTE Test-String 2 string'))
+        self.assertEqual(self.resolver['Test-String'].key, 2)
+
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'dictionary')
+        self.include = os.path.join(self.tmpdir, 'dictionary.simplon')
+        self.cache = os.path.join(self.tmpdir, 'dictionary.cache')
+        with open(self.path, 'w') as fd:
+            fd.write('ATTRIBUTE Test-Integer 1 integer\n'
+                     'VALUE Test-Integer One 1\n'
+                     '$INCLUDE dictionary.simplon\n')
+        self.WriteInclude('ATTRIBUTE Simplon-Ip 1 ipaddr\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def WriteInclude(self, content):
+        with open(self.include, 'w') as fd:
+            fd.write('VENDOR Simplon 16\n'
+                     'BEGIN-VENDOR Simplon\n' + content +
+                     'END-VENDOR Simplon\n')
+
+    def Load(self):
+        parsed = []
+        read = Dictionary.ReadDictionary
+
+        def ReadDictionary(dictionary, file):
+            parsed.append(file)
+            read(dictionary, file)
+
+        Dictionary.ReadDictionary = ReadDictionary
+        try:
+            return (Dictionary(self.path, cache=self.cache), parsed)
+        finally:
+            Dictionary.ReadDictionary = read
+
+    def testFilesRecordsIncludes(self):
+        dictionary = Dictionary(self.path)
+        self.assertEqual(dictionary.files,
+                         [os.path.realpath(self.path),
+                          os.path.realpath(self.include)])
+
+    def testCacheHit(self):
+        (first, parsed) = self.Load()
+        self.assertEqual(len(parsed), 1)
+        self.assertTrue(os.path.exists(self.cache))
+
+        (second, parsed) = self.Load()
+        self.assertEqual(parsed, [])
+        self.assertEqual(second.files, first.files)
+        self.assertEqual(second.vendors.forward, first.vendors.forward)
+        self.assertEqual(second.attrindex.forward, first.attrindex.forward)
+        attr = second['Test-Integer']
+        self.assertEqual(attr.values.forward, {'One': b'\x00\x00\x00\x01'})
+        self.assertEqual(attr.encoder(5), b'\x00\x00\x00\x05')
+        self.assertEqual(second['Simplon-Ip'].decoder(b'\x01\x02\x03\x04'),
+                         '1.2.3.4')
+
+    def testChangedIncludeInvalidates(self):
+        self.Load()
+        self.WriteInclude('ATTRIBUTE Simplon-Ip 1 ipaddr\n'
+                          'ATTRIBUTE Simplon-Number 2 integer\n')
+        (dictionary, parsed) = self.Load()
+        self.assertEqual(len(parsed), 1)
+        self.assertIn('Simplon-Number', dictionary)
+
+        (dictionary, parsed) = self.Load()
+        self.assertEqual(parsed, [])
+        self.assertIn('Simplon-Number', dictionary)
+
+    def testChangedWhileParsingInvalidates(self):
+        read = Dictionary.ReadDictionary
+
+        def ReadDictionary(dictionary, file):
+            read(dictionary, file)
+            # Edited after parsing, before the cache is written
+            self.WriteInclude('ATTRIBUTE Simplon-Ip 1 ipaddr\n'
+                              'ATTRIBUTE Simplon-Number 2 integer\n')
+
+        Dictionary.ReadDictionary = ReadDictionary
+        try:
+            dictionary = Dictionary(self.path, cache=self.cache)
+        finally:
+            Dictionary.ReadDictionary = read
+        self.assertNotIn('Simplon-Number', dictionary)
+
+        (dictionary, parsed) = self.Load()
+        self.assertEqual(len(parsed), 1)
+        self.assertIn('Simplon-Number', dictionary)
+
+    def testTouchedFileKeepsCache(self):
+        self.Load()
+        st = os.stat(self.include)
+        os.utime(self.include, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        (dictionary, parsed) = self.Load()
+        self.assertEqual(parsed, [])
+        # The cache is rewritten with the new state of the touched file
+        with open(self.cache, 'rb') as fd:
+            states = pickle.load(fd)['files']
+        self.assertIn((os.path.realpath(self.include),
+                       st.st_mtime_ns + 10**9, st.st_size),
+                      [state[:3] for state in states])
+
+    def testCorruptCacheIgnored(self):
+        with open(self.cache, 'wb') as fd:
+            fd.write(b'garbage')
+        (dictionary, parsed) = self.Load()
+        self.assertEqual(len(parsed), 1)
+        self.assertIn('Simplon-Ip', dictionary)
+
+    def testFileObjectNotCached(self):
+        Dictionary(StringIO('ATTRIBUTE Test-Integer 1 integer\n'),
+                   cache=self.cache)
+        self.assertFalse(os.path.exists(self.cache))
+
+    def testPickleAttribute(self):
+        attr = pickle.loads(pickle.dumps(Attribute('name', 1, 'short')))
+        self.assertEqual(attr.encoder(5), b'\x00\x05')
+        self.assertEqual(attr.decoder(b'\x00\x05'), 5)
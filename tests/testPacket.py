@@ -25,6 +25,25 @@ class UtilityTests(unittest.TestCase):
         newid = packet.CreateID()
         self.assertNotEqual(id, newid)
 
+    def testSecretHmac(self):
+        first = packet._SecretHmac(b'secret')
+        first.update(b'data')
+        second = packet._SecretHmac(b'secret')
+        self.assertIsNot(first, second)
+        self.assertEqual(first.digest(),
+                hmac.new(b'secret', b'data', digestmod='MD5').digest())
+        second.update(b'other')
+        self.assertEqual(second.digest(),
+                hmac.new(b'secret', b'other', digestmod='MD5').digest())
+
+    def testSecretMd5(self):
+        hash = packet._SecretMd5(b'secret')
+        hash.update(b'data')
+        self.assertEqual(hash.digest(),
+                md5_constructor(b'secretdata').digest())
+        self.assertEqual(packet._SecretMd5(b'secret').digest(),
+                md5_constructor(b'secret').digest())
+
 
 class PacketConstructionTests(unittest.TestCase):
     klass = packet.Packet
@@ -341,6 +360,41 @@ class PacketTests(unittest.TestCase):
                 self.packet._PktEncodeAttributes(),
                 b'\x01\x07value\x1a\x0d\x00\x00\x00\x10\x02\x07value')
 
+    def testSaltCrypt(self):
+        encrypted = self.packet.SaltCrypt('secret')
+        self.assertEqual(len(encrypted), 18)
+        self.assertTrue(encrypted[0] & 0x80)
+        self.assertEqual(self.packet.SaltDecrypt(encrypted), b'secret')
+
+    def testSaltCryptMultipleBlocks(self):
+        value = b'a tunnel password longer than one block'
+        encrypted = self.packet.SaltCrypt(value)
+        self.assertEqual(len(encrypted), 50)
+        self.assertEqual(self.packet.SaltDecrypt(encrypted), value)
+
+    def testPktEncodeAttributeBuffer(self):
+        self.packet[1] = [b'value']
+        self.packet[80] = [16 * b'\x00']
+        (buf, offset) = self.packet._PktEncodeAttributeBuffer()
+        self.assertIsInstance(buf, bytearray)
+        self.assertEqual(buf, b'\x01\x07value\x50\x12' + 16 * b'\x00')
+        self.assertEqual(offset, 9)
+
+        self.packet.clear()
+        self.packet[1] = [b'value']
+        self.assertEqual(self.packet._PktEncodeAttributeBuffer(),
+                (bytearray(b'\x01\x07value'), None))
+
+    def testRefreshMessageAuthenticatorReturnsAttributes(self):
+        self.packet.code = packet.AccessRequest
+        self.packet.authenticator = 16 * b'\x00'
+        self.packet['Test-String'] = 'test'
+        self.packet.add_message_authenticator()
+        attr = self.packet._refresh_message_authenticator()
+        self.assertEqual(attr, self.packet._PktEncodeAttributes())
+        self.assertNotEqual(self.packet['Message-Authenticator'][0],
+                16 * b'\x00')
+
     def testPktDecodeVendorAttribute(self):
         decode = self.packet._PktDecodeVendorAttribute
 
@@ -358,6 +412,13 @@ class PacketTests(unittest.TestCase):
                 decode(b'\x00\x00\x00\x10\x02\x07value'),
                 [((16, 2), b'value')])
 
+    def testPktDecodeVendorAttributeZeroLength(self):
+        decode = self.packet._PktDecodeVendorAttribute
+
+        # A zero length sub-attribute must not stall the decoder
+        data = b'\x00\x00\x00\x10\x02\x07value\x01\x00'
+        self.assertEqual(decode(data), [(26, data)])
+
     def testPktDecodeTlvAttribute(self):
         decode = self.packet._PktDecodeTlvAttribute
 
@@ -464,11 +525,95 @@ class PacketTests(unittest.TestCase):
             b'\x01\x02\x00\x1e1234567890123456\x01\x05one\x01\x05two')
         self.assertEqual(self.packet[1], [b'one', b'two'])
 
+    def testDecodePacketFromBytearray(self):
+        self.packet.DecodePacket(bytearray(
+            b'\x01\x02\x00\x211234567890123456\x01\x07value\x03\x06\x00\x00\x00\x01'))
+        self.assertEqual(self.packet[1], [b'value'])
+        self.assertEqual(self.packet['Test-Integer'], ['One'])
+        self.assertTrue(isinstance(self.packet[1][0], bytes))
+
+    def testDecodePacketWithManyAttributes(self):
+        attrs = b''.join(struct.pack('!BBL', 3, 6, i) for i in range(100))
+        self.packet.DecodePacket(
+            struct.pack('!BBH', 1, 2, 20 + len(attrs)) + 16 * b'\x00' + attrs)
+        self.assertEqual(len(self.packet[3]), 100)
+        self.assertEqual(self.packet[3][-1], b'\x00\x00\x00\x63')
+
     def testDecodePacketWithVendorAttribute(self):
         self.packet.DecodePacket(
                 b'\x01\x02\x00\x1b1234567890123456\x1a\x07value')
         self.assertEqual(self.packet[26], [b'value'])
 
+    def testLazyDecodePacket(self):
+        raw = (b'\x01\x02\x00\x321234567890123456\x01\x07value'
+               b'\x03\x06\x00\x00\x00\x01\x1a\x0c\x00\x00\x00\x10\x01\x06'
+               b'\x00\x00\x00\x02\x01\x05two')
+        pkt = packet.Packet(packet=raw, dict=self.dict, lazy=True)
+        self.assertEqual(pkt.code, 1)
+        self.assertEqual(pkt.id, 2)
+        self.assertEqual(pkt['Simplon-Number'], ['Two'])
+        self.assertEqual(pkt['Test-String'], ['value', 'two'])
+        self.assertEqual(pkt.get('Test-Octets'), None)
+        self.assertTrue('Test-Integer' in pkt)
+        self.assertFalse('Test-Octets' in pkt)
+        self.assertEqual(pkt.keys(),
+                         ['Test-String', 'Test-Integer', 'Simplon-Number'])
+        self.assertEqual(pkt._PktEncodeAttributes(), raw[20:27] + raw[45:] +
+                         raw[27:45])
+
+    def testLazyDecodePacketSetItem(self):
+        raw = b'\x01\x02\x00\x1b1234567890123456\x01\x07value'
+        pkt = packet.Packet(packet=raw, dict=self.dict, lazy=True)
+        pkt['Test-Integer'] = 10
+        self.assertEqual(pkt.keys(), ['Test-String', 'Test-Integer'])
+        self.assertEqual(len(pkt), 2)
+
+    def testLazyDecodePacketMappingMethods(self):
+        raw = (b'\x01\x02\x00\x321234567890123456\x01\x07value'
+               b'\x03\x06\x00\x00\x00\x01\x1a\x0c\x00\x00\x00\x10\x01\x06'
+               b'\x00\x00\x00\x02\x01\x05two')
+
+        def Packets():
+            return (packet.Packet(packet=raw, dict=self.dict),
+                    packet.Packet(packet=raw, dict=self.dict, lazy=True))
+
+        (eager, lazy) = Packets()
+        self.assertEqual(lazy, eager)
+        self.assertEqual(eager, lazy)
+        self.assertFalse(lazy != eager)
+        (eager, lazy) = Packets()
+        self.assertEqual(repr(lazy), repr(eager))
+        (eager, lazy) = Packets()
+        self.assertEqual(list(reversed(lazy)), list(reversed(eager)))
+        (eager, lazy) = Packets()
+        self.assertEqual(lazy.copy(), eager.copy())
+        (eager, lazy) = Packets()
+        self.assertEqual(lazy.popitem(), eager.popitem())
+        self.assertEqual(lazy.items(), eager.items())
+        (eager, lazy) = Packets()
+        lazy.move_to_end('Test-String')
+        eager.move_to_end('Test-String')
+        self.assertEqual(lazy.keys(), eager.keys())
+        (eager, lazy) = Packets()
+        lazy.update({4: [b'\x00\x00\x00\x01']})
+        eager.update({4: [b'\x00\x00\x00\x01']})
+        self.assertEqual(lazy.items(), eager.items())
+        (eager, lazy) = Packets()
+        target = packet.Packet(dict=self.dict)
+        target.update(lazy)
+        self.assertEqual(target, eager)
+
+    def testLazyDecodePacketValidatesFraming(self):
+        self.assertRaises(
+            packet.PacketError, packet.Packet,
+            packet=b'\x01\x02\x00\x161234567890123456\x00\x01',
+            dict=self.dict, lazy=True)
+
+    def testLazyDecodePacketMessageAuthenticator(self):
+        raw = b'\x01\x02\x00\x261234567890123456\x50\x12' + 16 * b'\x00'
+        pkt = packet.Packet(packet=raw, dict=self.dict, lazy=True)
+        self.assertTrue(pkt.message_authenticator)
+
     def testEncodeKeyValues(self):
         self.assertEqual(self.packet._EncodeKeyValues(1, '1234'), (1, '1234'))
 
@@ -483,6 +628,142 @@ class PacketTests(unittest.TestCase):
         self.packet.AddAttribute('Test-String', ['2', '3'])
         self.assertEqual(self.packet['Test-String'], ['1', '1', '2', '3'])
 
+class SlimPacketTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(home, 'data')
+        self.dict = Dictionary(os.path.join(self.path, 'full'))
+
+    def testDecodePacket(self):
+        raw = (b'\x01\x02\x00\x321234567890123456\x01\x07value'
+               b'\x03\x06\x00\x00\x00\x01\x1a\x0c\x00\x00\x00\x10\x01\x06'
+               b'\x00\x00\x00\x02\x01\x05two')
+        pkt = packet.SlimPacket(packet=raw, dict=self.dict)
+        self.assertEqual(pkt.code, 1)
+        self.assertEqual(pkt.id, 2)
+        self.assertEqual(pkt.raw_packet, raw)
+        self.assertEqual(pkt['Simplon-Number'], ['Two'])
+        self.assertEqual(pkt['Test-String'], ['value', 'two'])
+        self.assertEqual(pkt[(16, 1)], [b'\x00\x00\x00\x02'])
+        self.assertEqual(pkt.get('Test-Octets'), None)
+        self.assertTrue('Test-Integer' in pkt)
+        self.assertFalse('Test-Octets' in pkt)
+        self.assertEqual(pkt.keys(),
+                         ['Test-String', 'Test-Integer', 'Simplon-Number'])
+        self.assertEqual(pkt.items(), list(
+            packet.Packet(packet=raw, dict=self.dict).items()))
+        self.assertEqual(pkt._PktEncodeAttributes(), raw[20:])
+
+    def testDecodePacketWithTlvAttribute(self):
+        pkt = packet.SlimPacket(dict=self.dict, packet=(
+            b'\x01\x02\x00\x251234567890123456\x04\x09\x01\x07value'
+            b'\x04\x09\x02\x06\x00\x00\x00\x09'))
+        self.assertEqual(pkt[4], {1: [b'value'], 2: [b'\x00\x00\x00\x09']})
+
+    def testDecodePacketWithVendorTlvAttribute(self):
+        pkt = packet.SlimPacket(dict=self.dict, packet=(
+            b'\x01\x02\x00\x231234567890123456\x1a\x0f\x00\x00\x00\x10'
+            b'\x03\x09\x01\x07value'))
+        self.assertEqual(pkt[(16, 3)], {1: [b'value']})
+
+    def testDecodePacketWithVendorAttribute(self):
+        pkt = packet.SlimPacket(dict=self.dict, packet=(
+            b'\x01\x02\x00\x1b1234567890123456\x1a\x07value'))
+        self.assertEqual(pkt[26], [b'value'])
+
+    def testDecodePacketWithBadAttribute(self):
+        self.assertRaises(
+            packet.PacketError, packet.SlimPacket, dict=self.dict,
+            packet=b'\x01\x02\x00\x161234567890123456\x00\x01')
+
+    def testDecodePacketMessageAuthenticator(self):
+        raw = b'\x01\x02\x00\x261234567890123456\x50\x12' + 16 * b'\x00'
+        pkt = packet.SlimPacket(packet=raw, dict=self.dict)
+        self.assertTrue(pkt.message_authenticator)
+
+    def testSetItem(self):
+        raw = (b'\x01\x02\x00\x211234567890123456\x01\x07value'
+               b'\x03\x06\x00\x00\x00\x01')
+        pkt = packet.SlimPacket(packet=raw, dict=self.dict)
+        pkt['Test-String'] = 'other'
+        pkt.AddAttribute('Test-String', 'more')
+        self.assertEqual(pkt.keys(), ['Test-Integer', 'Test-String'])
+        self.assertEqual(pkt['Test-String'], ['other', 'more'])
+        self.assertEqual(pkt.raw_packet, raw)
+        del pkt['Test-Integer']
+        self.assertEqual(len(pkt), 1)
+        self.assertRaises(KeyError, pkt.__delitem__, 'Test-Integer')
+        self.assertEqual(pkt.pop(1), [b'other', b'more'])
+        self.assertEqual(pkt.pop(1, None), None)
+        self.assertEqual(pkt.keys(), [])
+
+    def testEncryptedAttribute(self):
+        pkt = packet.SlimPacket(secret=b'secret', dict=self.dict,
+                                authenticator=b'0123456789ABCDEF')
+        pkt['Test-Encrypted-String'] = 'hidden'
+        self.assertEqual(pkt.raw_packet, None)
+        self.assertEqual(pkt['Test-Encrypted-String'], ['hidden'])
+
+    def testCreateReply(self):
+        raw = b'\x01\x02\x00\x1b1234567890123456\x01\x07value'
+        pkt = packet.SlimPacket(packet=raw, secret=b'secret', dict=self.dict)
+        reply = pkt.CreateReply(Test_Integer=10)
+        self.assertEqual(reply.id, 2)
+        self.assertEqual(reply.authenticator, b'1234567890123456')
+        self.assertEqual(reply['Test-Integer'], [10])
+
+
+class PacketTemplateTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(home, 'data')
+        self.dict = Dictionary(os.path.join(self.path, 'full'))
+        self.template = packet.PacketTemplate(
+            packet.AccessAccept, self.dict, Test_String='static',
+            Test_Integer=10)
+
+    def testPacketClass(self):
+        self.assertTrue(isinstance(self.template.CreatePacket(),
+                                   packet.AuthPacket))
+        template = packet.PacketTemplate(packet.AccountingResponse,
+                                         self.dict)
+        self.assertTrue(isinstance(template.CreatePacket(),
+                                   packet.AcctPacket))
+        template = packet.PacketTemplate(250, self.dict)
+        self.assertEqual(type(template.CreatePacket()), packet.Packet)
+
+    def testCreatePacket(self):
+        pkt = self.template.CreatePacket(id=5, secret=b'secret',
+                                         Test_String='variable',
+                                         Simplon_Number='Two')
+        self.assertEqual(pkt.code, packet.AccessAccept)
+        self.assertEqual(pkt.id, 5)
+        self.assertEqual(pkt.keys(),
+                         ['Test-String', 'Test-Integer', 'Simplon-Number'])
+        self.assertEqual(pkt['Test-String'], ['static', 'variable'])
+        self.assertEqual(pkt['Simplon-Number'], ['Two'])
+
+    def testPacketsAreIndependent(self):
+        one = self.template.CreatePacket(Test_String='one')
+        two = self.template.CreatePacket()
+        self.assertEqual(one['Test-String'], ['static', 'one'])
+        self.assertEqual(two['Test-String'], ['static'])
+
+    def testCreateReply(self):
+        request = packet.AuthPacket(id=7, secret=b'secret', dict=self.dict,
+                                    authenticator=b'0123456789ABCDEF',
+                                    auth_type='chap')
+        reply = self.template.CreateReply(request, Test_Octets=b'x')
+        expected = request.CreateReply(Test_String='static', Test_Integer=10,
+                                       Test_Octets=b'x')
+        self.assertEqual(reply.id, 7)
+        self.assertEqual(reply.auth_type, 'chap')
+        self.assertEqual(reply.ReplyPacket(), expected.ReplyPacket())
+
+    def testEncryptedAttribute(self):
+        self.assertRaises(ValueError, packet.PacketTemplate,
+                          packet.AccessAccept, self.dict,
+                          Test_Encrypted_String='secret')
+
+
 class AuthPacketConstructionTests(PacketConstructionTests):
     klass = packet.AuthPacket
 
@@ -515,6 +796,25 @@ class AuthPacketTests(unittest.TestCase):
         self.packet.RequestPacket()
         self.assertTrue(self.packet.authenticator is not None)
 
+    def testRequestPacketMessageAuthenticator(self):
+        self.packet.authenticator = b'0123456789ABCDEF'
+        self.packet['Test-String'] = 'test'
+        self.packet.add_message_authenticator()
+        rawpacket = self.packet.RequestPacket()
+        pkt = packet.AuthPacket(secret=b'secret', dict=self.dict,
+                packet=rawpacket)
+        self.assertTrue(pkt.verify_message_authenticator())
+
+    def testRequestPacketEapMd5(self):
+        self.packet.auth_type = 'eap-md5'
+        self.packet['Test-String'] = 'test'
+        rawpacket = self.packet.RequestPacket()
+        attr = b'\x01\x06test\x50\x12'
+        header = b'\x01\x00\x00\x2c01234567890ABCDE'
+        digest = hmac.new(b'secret', header + attr + 16 * b'\x00',
+                digestmod='MD5').digest()
+        self.assertEqual(rawpacket, header + attr + digest)
+
     def testRequestPacketCreatesID(self):
         self.packet.id = None
         self.packet.RequestPacket()
@@ -540,6 +840,13 @@ class AuthPacketTests(unittest.TestCase):
                 b'\xd3U;\xb23\r\x11\xba\x07\xe3\xa8*\xa8x\x14\x01'),
                 'Simplon')
 
+    def testPwCryptLongPassword(self):
+        password = 'Simplon' * 10
+        encrypted = self.packet.PwCrypt(password)
+        self.assertEqual(len(encrypted), 80)
+        self.assertEqual(encrypted[:7], b'\xd3U;\xb23\r\x11')
+        self.assertEqual(self.packet.PwDecrypt(encrypted), password)
+
 
 class AuthPacketChapTests(unittest.TestCase):
     def setUp(self):
@@ -616,3 +923,36 @@ class AcctPacketTests(unittest.TestCase):
         self.packet.id = None
         self.packet.RequestPacket()
         self.assertTrue(self.packet.id is not None)
+
+    def testRequestPacketMessageAuthenticator(self):
+        self.packet['Test-String'] = 'test'
+        self.packet.add_message_authenticator()
+        rawpacket = self.packet.RequestPacket()
+        pkt = packet.AcctPacket(secret=b'secret', dict=self.dict,
+                packet=rawpacket)
+        self.assertTrue(pkt.VerifyAcctRequest())
+        self.assertTrue(pkt.verify_message_authenticator())
+
+    def testRetransmitPacketAppendsDelay(self):
+        self.packet['Test-String'] = 'test'
+        rawpacket = self.packet.RetransmitPacket(
+            self.packet.RequestPacket(), 5)
+        pkt = packet.AcctPacket(secret=b'secret', dict=self.dict,
+                packet=rawpacket)
+        self.assertTrue(pkt.VerifyAcctRequest())
+        self.assertEqual(pkt.authenticator, self.packet.authenticator)
+        self.assertEqual(pkt['Test-String'], ['test'])
+        self.assertEqual(pkt[41], [b'\x00\x00\x00\x05'])
+
+    def testRetransmitPacketPatchesDelay(self):
+        self.packet[41] = [b'\x00\x00\x00\x05']
+        self.packet['Test-String'] = 'test'
+        self.packet.add_message_authenticator()
+        rawpacket = self.packet.RetransmitPacket(
+            self.packet.RequestPacket(), 10)
+        self.packet[41] = [b'\x00\x00\x00\x0a']
+        self.assertEqual(rawpacket, self.packet.RequestPacket())
+        pkt = packet.AcctPacket(secret=b'secret', dict=self.dict,
+                packet=rawpacket)
+        self.assertTrue(pkt.VerifyAcctRequest())
+        self.assertTrue(pkt.verify_message_authenticator())
@@ -1,3 +1,7 @@
+import asyncio
+from io import StringIO
+import itertools
+import logging
 import select
 import socket
 import unittest
@@ -6,9 +10,17 @@ from .mock import MockPoll
 from .mock import MockSocket
 from .mock import MockClassMethod
 from .mock import UnmockClassMethods
+from pyrad.dictionary import Dictionary
 from pyrad.proxy import Proxy
+from pyrad.proxy_async import HomeServer
+from pyrad.proxy_async import HomeServerPool
+from pyrad.proxy_async import POLICY_LOAD_BALANCE
+from pyrad.proxy_async import ProxyAsync
 from pyrad.packet import AccessAccept
 from pyrad.packet import AccessRequest
+from pyrad.packet import AuthPacket
+from pyrad.packet import Packet
+from pyrad.packet import _CryptBlocks
 from pyrad.server import ServerPacketError
 from pyrad.server import Server
 
@@ -92,5 +104,280 @@ class OtherTests(unittest.TestCase):
                 ['_GrabPacket', '_HandleProxyPacket'])
 
 
+ASYNC_DICTIONARY = """
+ATTRIBUTE  User-Name              1   string
+ATTRIBUTE  User-Password          2   octets  encrypt=1
+ATTRIBUTE  Reply-Message          18  string
+ATTRIBUTE  Proxy-State            33  octets
+ATTRIBUTE  Tunnel-Password        69  string  encrypt=2
+ATTRIBUTE  Message-Authenticator  80  octets
+ATTRIBUTE  Ascend-Send-Secret     214 string  encrypt=3
+"""
+
+
+class FakeTransport:
+    def __init__(self):
+        self.output = []
+
+    def sendto(self, data, addr):
+        self.output.append((data, addr))
+
+
+class FakeProtocol:
+    ip = '127.0.0.1'
+    port = 1812
+
+    def __init__(self):
+        self.transport = FakeTransport()
+
+
+class FakeClient:
+    """Stands in for the ClientAsync of a home server. Requests are
+    encoded and decoded as on the wire and answered by respond, which
+    returns a reply or raises."""
+
+    def __init__(self, loop, dictionary, secret, respond):
+        self.loop = loop
+        self.dict = dictionary
+        self.secret = secret
+        self.respond = respond
+        self.protocol_auth = True
+        self.ids = itertools.count(1)
+        self.received = []
+
+    def CreateAuthPacket(self, **args):
+        return AuthPacket(dict=self.dict, id=next(self.ids),
+                          secret=self.secret, **args)
+
+    async def SendPacket(self, pkt):
+        request = AuthPacket(packet=pkt.RequestPacket(), dict=self.dict,
+                             secret=self.secret)
+        self.received.append(request)
+        reply = self.respond(request)
+        # Replies are decoded as plain packets, as by ClientAsync
+        return Packet(packet=reply.ReplyPacket(), dict=self.dict,
+                      secret=self.secret)
+
+    async def deinitialize_transports(self):
+        pass
+
+
+def Answer(request, **attributes):
+    reply = request.CreateReply(**attributes)
+    for state in request.get('Proxy-State', []):
+        reply.AddAttribute('Proxy-State', state)
+    return reply
+
+
+def TimeOut(request):
+    raise TimeoutError('Timeout on Reply')
+
+
+def Fail(request):
+    raise OSError('Network is unreachable')
+
+
+class HomeServerPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.servers = [HomeServer('server%d' % i, b'secret')
+                        for i in range(3)]
+
+    def testUnknownPolicy(self):
+        self.assertRaises(ValueError, HomeServerPool, self.servers,
+                          policy='random')
+
+    def testFailOver(self):
+        pool = HomeServerPool(self.servers)
+        self.assertIs(pool.select(), self.servers[0])
+        self.assertIs(pool.select(), self.servers[0])
+        self.assertIs(pool.select(exclude=self.servers[:1]),
+                      self.servers[1])
+        self.servers[0].alive = False
+        self.assertIs(pool.select(), self.servers[1])
+        self.assertIsNone(pool.select(exclude=self.servers))
+
+    def testLoadBalance(self):
+        pool = HomeServerPool(self.servers, policy=POLICY_LOAD_BALANCE)
+        self.servers[0].outstanding = 2
+        self.servers[1].outstanding = 1
+        self.servers[2].outstanding = 3
+        self.assertIs(pool.select(), self.servers[1])
+        self.servers[1].alive = False
+        self.assertIs(pool.select(), self.servers[0])
+        self.servers[0].outstanding = 3
+        picked = set(pool.select() for _ in range(4))
+        self.assertEqual(picked, {self.servers[0], self.servers[2]})
+
+
+class AsyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.dict = Dictionary(StringIO(ASYNC_DICTIONARY))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def CreateHomeServer(self, respond, secret=b'home', **kwargs):
+        server = HomeServer('home', secret, **kwargs)
+        server.client = FakeClient(self.loop, self.dict, secret, respond)
+        server.logger = logging.getLogger('pyrad')
+        return server
+
+
+class ProxyAsyncTests(AsyncTestCase):
+    def setUp(self):
+        AsyncTestCase.setUp(self)
+        self.home = self.CreateHomeServer(
+            lambda request: Answer(request, Reply_Message='hello',
+                                   Tunnel_Password='tunnel'))
+        self.proxy = ProxyAsync(auth_pool=HomeServerPool([self.home]),
+                                dictionary=self.dict, loop=self.loop)
+        self.protocol = FakeProtocol()
+        self.addr = ('192.0.2.1', 1645)
+
+    def Request(self, password=None, **attributes):
+        request = AuthPacket(id=7, secret=b'client', dict=self.dict,
+                             User_Name='user', **attributes)
+        if password is not None:
+            request['User-Password'] = request.PwCrypt(password)
+        raw = request.RequestPacket()
+        return (request, AuthPacket(packet=raw, secret=b'client',
+                                    dict=self.dict))
+
+    def Proxy(self, pkt, pool=None):
+        self.run_async(self.proxy.proxy_packet(
+            self.protocol, pkt, self.addr, pool or self.proxy.auth_pool))
+
+    def ClientReply(self, request, index=-1):
+        (raw, addr) = self.protocol.transport.output[index]
+        self.assertEqual(addr, self.addr)
+        reply = Packet(packet=raw, secret=b'client', dict=self.dict)
+        self.assertTrue(request.VerifyReply(reply, raw))
+        reply.authenticator = request.authenticator
+        return reply
+
+    def testForward(self):
+        (request, pkt) = self.Request(Proxy_State=b'client-state')
+        self.Proxy(pkt)
+        (forwarded,) = self.home.client.received
+        self.assertEqual(forwarded['User-Name'], ['user'])
+        states = forwarded['Proxy-State']
+        self.assertEqual(len(states), 2)
+        self.assertEqual(states[0], b'client-state')
+
+        reply = self.ClientReply(request)
+        self.assertEqual(reply.code, AccessAccept)
+        self.assertEqual(reply['Reply-Message'], ['hello'])
+        self.assertEqual(reply['Proxy-State'], [b'client-state'])
+        self.assertEqual(self.home.outstanding, 0)
+
+    def testProxyStateRemoved(self):
+        (request, pkt) = self.Request()
+        self.Proxy(pkt)
+        self.assertIn('Proxy-State', self.home.client.received[0])
+        self.assertNotIn('Proxy-State', self.ClientReply(request))
+
+    def testPasswordEncryptedForHomeServer(self):
+        password = b'caf\xe9\x00pw'
+        (request, pkt) = self.Request(password=password)
+        self.Proxy(pkt)
+        (forwarded,) = self.home.client.received
+        decrypted = _CryptBlocks(b'home', forwarded.authenticator,
+                                 forwarded[2][0], True)
+        self.assertEqual(decrypted.rstrip(b'\x00'), password)
+
+    def testPasswordInReply(self):
+        # Replies from home servers are plain packets without PwDecrypt
+        self.home.client.respond = lambda request: Answer(
+            request, User_Password=16 * b'\x01')
+        (request, pkt) = self.Request()
+        self.Proxy(pkt)
+        self.assertIn('User-Password', self.ClientReply(request))
+
+    def testSaltEncryptedReply(self):
+        (request, pkt) = self.Request()
+        self.Proxy(pkt)
+        reply = self.ClientReply(request)
+        self.assertEqual(reply['Tunnel-Password'], ['tunnel'])
+
+    def testAscendEncryptedDropped(self):
+        (request, pkt) = self.Request(Ascend_Send_Secret='secret')
+        with self.assertLogs('pyrad', 'WARNING'):
+            self.Proxy(pkt)
+        self.assertNotIn('Ascend-Send-Secret', self.home.client.received[0])
+
+    def testDuplicateInFlight(self):
+        (request, pkt) = self.Request()
+        self.proxy.proxy_states[(self.addr, pkt.id, pkt.authenticator)] = None
+        self.Proxy(pkt)
+        self.assertEqual(self.home.client.received, [])
+        self.assertEqual(self.protocol.transport.output, [])
+
+    def testDuplicateAnswered(self):
+        (request, pkt) = self.Request()
+        self.Proxy(pkt)
+        key = (self.addr, pkt.id, pkt.authenticator)
+        self.assertEqual(self.proxy.proxy_states[key],
+                         self.protocol.transport.output[0][0])
+        self.Proxy(pkt)
+        self.assertEqual(len(self.home.client.received), 1)
+        output = self.protocol.transport.output
+        self.assertEqual(len(output), 2)
+        self.assertEqual(output[0], output[1])
+
+    def testFailOver(self):
+        for respond in (TimeOut, Fail):
+            first = self.CreateHomeServer(respond)
+            pool = HomeServerPool([first, self.home])
+            (request, pkt) = self.Request()
+            self.Proxy(pkt, pool)
+            self.assertEqual(len(first.client.received), 1)
+            self.assertEqual(self.ClientReply(request)['Reply-Message'],
+                             ['hello'])
+        self.assertEqual(len(self.home.client.received), 2)
+
+    def testNoReply(self):
+        pool = HomeServerPool([self.CreateHomeServer(TimeOut)])
+        (request, pkt) = self.Request()
+        self.Proxy(pkt, pool)
+        self.assertEqual(self.protocol.transport.output, [])
+        self.assertEqual(self.proxy.proxy_states, {})
+
+
+class HomeServerTests(AsyncTestCase):
+    def testDeadAfterFailures(self):
+        server = self.CreateHomeServer(TimeOut, max_failures=2,
+                                       status_interval=3600)
+        for _ in range(2):
+            self.assertRaises(TimeoutError, self.run_async,
+                              server.send(server.client.CreateAuthPacket()))
+        self.assertFalse(server.alive)
+        self.assertIsNotNone(server.probe_task)
+        self.run_async(server.deinitialize())
+        self.assertIsNone(server.probe_task)
+
+    def testProbe(self):
+        responses = [Fail, TimeOut, Answer]
+        server = self.CreateHomeServer(
+            lambda request: responses.pop(0)(request),
+            max_failures=1, status_interval=0)
+        server.failed()
+        self.assertFalse(server.alive)
+
+        async def Recovered():
+            while not server.alive:
+                await asyncio.sleep(0)
+        self.run_async(asyncio.wait_for(Recovered(), 5))
+        self.assertEqual(responses, [])
+        self.assertEqual(server.failures, 0)
+        statuses = [pkt.code for pkt in server.client.received]
+        self.assertEqual(statuses, [12, 12, 12])
+        self.run_async(asyncio.sleep(0))
+        self.assertIsNone(server.probe_task)
+
+
 if not hasattr(select, 'poll'):
     del SocketTests
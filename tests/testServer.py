@@ -1,5 +1,11 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
 import select
+import signal
 import socket
+import threading
+import time
 import unittest
 from .mock import MockFinished
 from .mock import MockFd
@@ -7,10 +13,19 @@ from .mock import MockPoll
 from .mock import MockSocket
 from .mock import MockClassMethod
 from .mock import UnmockClassMethods
+from . import home
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AccessAccept
+from pyrad.packet import AuthPacket
+from pyrad.packet import Packet
 from pyrad.packet import PacketError
+from pyrad.packet import PacketTemplate
 from pyrad.server import RemoteHost
 from pyrad.server import Server
 from pyrad.server import ServerPacketError
+from pyrad.server_async import DatagramProtocolServer
+from pyrad.server_async import ServerAsync
+from pyrad.server_async import ServerType
 from pyrad.packet import AccessRequest
 from pyrad.packet import AccountingRequest
 
@@ -101,6 +116,23 @@ class SocketTests(unittest.TestCase):
         self.assertEqual(self.server.acctfds[0].address,
                 ('2001:db8:123::1', 1813))
 
+    def testBindRecordsAddress(self):
+        self.server.BindToAddress('192.168.13.13')
+        self.assertEqual(self.server.addresses, ['192.168.13.13'])
+
+    def testBindReusePort(self):
+        self.server.reuse_port = True
+        self.server.BindToAddress('192.168.13.13')
+        for fd in self.server.authfds + self.server.acctfds:
+            self.assertTrue((socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                    in fd.options)
+
+    def testBindNoReusePort(self):
+        self.server.BindToAddress('192.168.13.13')
+        for fd in self.server.authfds + self.server.acctfds:
+            self.assertEqual(fd.options,
+                    [(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)])
+
     def testGrabPacket(self):
         def gen(data):
             res = TrivialObject()
@@ -246,6 +278,22 @@ class OtherTests(unittest.TestCase):
         self.assertTrue(reply.source is TrivialPacket.source)
         self.assertEqual(reply.kw, dict(one='one', two='two'))
 
+    def testCreateReplyPacketFromTemplate(self):
+        class TrivialTemplate:
+            def CreateReply(self, pkt, **kw):
+                reply = TrivialObject()
+                reply.request = pkt
+                reply.kw = kw
+                return reply
+
+        request = TrivialObject()
+        request.source = object()
+        reply = self.server.CreateReplyPacket(request, TrivialTemplate(),
+                one='one')
+        self.assertTrue(reply.request is request)
+        self.assertTrue(reply.source is request.source)
+        self.assertEqual(reply.kw, dict(one='one'))
+
     def testAuthProcessInput(self):
         fd = MockFd(1)
         self.server._realauthfds = [1]
@@ -316,6 +364,481 @@ class ServerRunTests(unittest.TestCase):
         self.assertRaises(MockFinished, self.server.Run)
         self.assertEqual(self.server.called, [('_ProcessInput', (fd[0],), {})])
 
+
+class ServerStopTests(unittest.TestCase):
+    def testStopEndsRun(self):
+        server = Server()
+        thread = threading.Thread(target=server.Run)
+        thread.start()
+        while server._wakeup is None:
+            time.sleep(0.01)
+        server.Stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(server._running)
+        self.assertIsNone(server._wakeup)
+
+    def testRunManagesHandlerThreads(self):
+        server = Server(threads=2)
+        thread = threading.Thread(target=server.Run)
+        thread.start()
+        while server._wakeup is None:
+            time.sleep(0.01)
+        self.assertIsNotNone(server._executor)
+        server.Stop()
+        thread.join(5)
+        self.assertIsNone(server._executor)
+
+    def testStopBeforeRun(self):
+        server = Server()
+        server.Stop()
+        self.assertFalse(server._running)
+
+
+class ThreadedDispatchTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(threads=1, max_queue=1)
+        self.server._executor = ThreadPoolExecutor(1)
+        self.server._pending = threading.BoundedSemaphore(1)
+        self.release = threading.Event()
+        self.handled = []
+
+    def tearDown(self):
+        self.release.set()
+        self.server._executor.shutdown(wait=True)
+
+    def Handler(self, pkt):
+        self.release.wait(5)
+        self.handled.append((pkt, threading.get_ident()))
+
+    def testInvalidShedPolicy(self):
+        self.assertRaises(ValueError, Server, shed_policy='unknown')
+
+    def testHandlerRunsInThread(self):
+        self.release.set()
+        self.server._DispatchPacket(self.Handler, 'packet')
+        self.server._executor.shutdown(wait=True)
+        self.assertEqual(len(self.handled), 1)
+        self.assertEqual(self.handled[0][0], 'packet')
+        self.assertNotEqual(self.handled[0][1], threading.get_ident())
+
+    def testDropWhenQueueFull(self):
+        self.server._DispatchPacket(self.Handler, 'first')
+        self.assertRaises(ServerPacketError,
+                self.server._DispatchPacket, self.Handler, 'second')
+        self.assertEqual(self.server.shed, 1)
+        self.release.set()
+        self.server._executor.shutdown(wait=True)
+        self.assertEqual([pkt for (pkt, _) in self.handled], ['first'])
+
+    def testBlockWhenQueueFull(self):
+        self.server.shed_policy = 'block'
+        self.server._DispatchPacket(self.Handler, 'first')
+        threading.Timer(0.1, self.release.set).start()
+        self.server._DispatchPacket(self.Handler, 'second')
+        self.server._executor.shutdown(wait=True)
+        self.assertEqual([pkt for (pkt, _) in self.handled],
+                ['first', 'second'])
+        self.assertEqual(self.server.shed, 0)
+
+    def testHandlerErrorReleasesQueue(self):
+        def Failing(pkt):
+            raise ServerPacketError('failed')
+        self.server._DispatchPacket(Failing, 'first')
+        self.server._executor.shutdown(wait=True)
+        self.server._executor = ThreadPoolExecutor(1)
+        self.release.set()
+        self.server._DispatchPacket(self.Handler, 'second')
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(authport=0, batch_size=4, acct_enabled=False)
+        self.server.BindToAddress('127.0.0.1')
+        self.fd = self.server.authfds[0]
+        self.address = self.fd.getsockname()
+        self.server._poll = MockPoll()
+        self.server._fdmap = {}
+        self.server._PrepareSockets()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(5)
+
+        self.handled = []
+        self.flushed = []
+
+        def ProcessInput(fd):
+            data = fd.recvfrom_into(self.server._buffer)
+            self.handled.append(data)
+            reply = TrivialObject()
+            reply.source = data[1]
+            reply.ReplyPacket = lambda: b'reply'
+            self.server.SendReplyPacket(fd, reply)
+            self.flushed.append(self.server._replies is None)
+        self.server._ProcessInput = ProcessInput
+
+    def tearDown(self):
+        self.server._CloseSockets()
+        self.client.close()
+
+    def testBatchDrainsSocket(self):
+        for i in range(3):
+            self.client.sendto(b'request', self.address)
+        time.sleep(0.1)
+        self.assertEqual(self.server._ProcessBatch(self.fd), 3)
+        self.assertEqual(len(self.handled), 3)
+        # Replies are only sent once the batch is complete
+        self.assertEqual(self.flushed, [False, False, False])
+        for i in range(3):
+            self.assertEqual(self.client.recv(100), b'reply')
+        self.assertEqual(self.server.wakeups, 1)
+        self.assertEqual(self.server.packets, 3)
+
+    def testBatchSizeLimit(self):
+        for i in range(6):
+            self.client.sendto(b'request', self.address)
+        time.sleep(0.1)
+        self.assertEqual(self.server._ProcessBatch(self.fd), 4)
+        self.assertEqual(self.server._ProcessBatch(self.fd), 2)
+        self.assertEqual(self.server.PacketsPerWakeup(), 3.0)
+
+    def testEmptySocket(self):
+        self.assertEqual(self.server._ProcessBatch(self.fd), 0)
+        self.assertEqual(self.server.wakeups, 1)
+        self.assertEqual(self.server._replies, None)
+
+
+class FakeTransport:
+    def __init__(self):
+        self.output = []
+        self.closed = False
+
+    def sendto(self, data, addr):
+        self.output.append((data, addr))
+
+    def close(self):
+        self.closed = True
+
+
+class HandlerServer(ServerAsync):
+    """ServerAsync passing every request to one handler."""
+
+    def __init__(self, handler, **kwargs):
+        ServerAsync.__init__(self, **kwargs)
+        self.handler = handler
+
+    def handle_auth_packet(self, protocol, pkt, addr):
+        return self.handler(protocol, pkt, addr)
+
+    handle_acct_packet = handle_auth_packet
+    handle_coa_packet = handle_auth_packet
+    handle_disconnect_packet = handle_auth_packet
+
+
+class ServerAsyncTestCase(unittest.TestCase):
+    addr = ('127.0.0.1', 5000)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.dict = Dictionary(os.path.join(home, 'data', 'simple'))
+        self.requests = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def CreateProtocol(self, handler, server_type=ServerType.Auth,
+                       **kwargs):
+        self.server = HandlerServer(handler, dictionary=self.dict,
+                                    loop=self.loop, **kwargs)
+        hosts = {'127.0.0.1': RemoteHost('127.0.0.1', b'secret', 'client')}
+        protocol = DatagramProtocolServer('127.0.0.1', 1812,
+                                          self.server.logger, self.server,
+                                          server_type, hosts,
+                                          self.server.__request_handler__)
+        protocol.connection_made(FakeTransport())
+        return protocol
+
+    def Request(self, id=1):
+        return AuthPacket(id=id, secret=b'secret', dict=self.dict,
+                          Test_String='user').RequestPacket()
+
+    def RunHandlers(self, protocol):
+        self.loop.run_until_complete(asyncio.gather(
+            *protocol.handler_tasks, return_exceptions=True))
+        # Let the done callbacks run
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def RunOnce(self, steps=3):
+        for _ in range(steps):
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+
+class ServerAsyncHandlerTests(ServerAsyncTestCase):
+    def testSynchronousHandler(self):
+        def Handler(protocol, pkt, addr):
+            self.requests.append(pkt)
+        protocol = self.CreateProtocol(Handler)
+        protocol.datagram_received(self.Request(), self.addr)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(protocol.handler_tasks, set())
+
+    def testCoroutineHandler(self):
+        async def Handler(protocol, pkt, addr):
+            await asyncio.sleep(0)
+            protocol.send_response(self.server.CreateReplyPacket(pkt), addr)
+        protocol = self.CreateProtocol(Handler)
+        protocol.datagram_received(self.Request(), self.addr)
+        self.assertEqual(len(protocol.handler_tasks), 1)
+        self.RunHandlers(protocol)
+        self.assertEqual(protocol.handler_tasks, set())
+        self.assertEqual(len(protocol.transport.output), 1)
+        self.assertEqual(protocol.transport.output[0][1], self.addr)
+
+    def testHandlerError(self):
+        async def Handler(protocol, pkt, addr):
+            raise ValueError('broken handler')
+        protocol = self.CreateProtocol(Handler)
+        protocol.datagram_received(self.Request(), self.addr)
+        with self.assertLogs('pyrad', 'ERROR'):
+            self.RunHandlers(protocol)
+        self.assertEqual(protocol.handler_tasks, set())
+
+    def testMaxConcurrent(self):
+        release = asyncio.Event()
+        state = {'running': 0, 'peak': 0, 'done': 0}
+
+        async def Handler(protocol, pkt, addr):
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+            await release.wait()
+            state['running'] -= 1
+            state['done'] += 1
+        protocol = self.CreateProtocol(Handler, max_concurrent=2)
+        for id in range(5):
+            protocol.datagram_received(self.Request(id), self.addr)
+        self.RunOnce()
+        self.assertEqual(state['running'], 2)
+        self.assertEqual(len(protocol.handler_tasks), 5)
+        release.set()
+        self.RunHandlers(protocol)
+        self.assertEqual(state['peak'], 2)
+        self.assertEqual(state['done'], 5)
+
+    def testRequestTimeout(self):
+        state = {'cancelled': False}
+
+        async def Handler(protocol, pkt, addr):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state['cancelled'] = True
+                raise
+            protocol.send_response(self.server.CreateReplyPacket(pkt), addr)
+        protocol = self.CreateProtocol(Handler, request_timeout=0.01)
+        protocol.datagram_received(self.Request(), self.addr)
+        with self.assertLogs('pyrad', 'WARNING') as logs:
+            self.RunHandlers(protocol)
+        self.assertIn('timed out', logs.output[0])
+        self.assertTrue(state['cancelled'])
+        self.assertEqual(protocol.transport.output, [])
+        self.assertEqual(protocol.handler_tasks, set())
+
+    def testRequestTimeoutWaitingForSlot(self):
+        started = []
+
+        async def Handler(protocol, pkt, addr):
+            started.append(pkt.id)
+            await asyncio.sleep(10)
+        protocol = self.CreateProtocol(Handler, max_concurrent=1,
+                                       request_timeout=0.01)
+        protocol.datagram_received(self.Request(1), self.addr)
+        protocol.datagram_received(self.Request(2), self.addr)
+        with self.assertLogs('pyrad', 'WARNING') as logs:
+            self.RunHandlers(protocol)
+        self.assertEqual(len(logs.output), 2)
+        # The second handler timed out before it got a slot
+        self.assertEqual(started, [1])
+
+    def testCloseTransportCancelsHandlers(self):
+        state = {'cancelled': 0}
+
+        async def Handler(protocol, pkt, addr):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state['cancelled'] += 1
+                raise
+        protocol = self.CreateProtocol(Handler)
+        transport = protocol.transport
+        protocol.datagram_received(self.Request(1), self.addr)
+        protocol.datagram_received(self.Request(2), self.addr)
+        self.RunOnce()
+        tasks = list(protocol.handler_tasks)
+        self.loop.run_until_complete(protocol.close_transport())
+        self.RunOnce()
+        self.assertTrue(transport.closed)
+        self.assertIsNone(protocol.transport)
+        self.assertTrue(all(task.cancelled() for task in tasks))
+        self.assertEqual(state['cancelled'], 2)
+        self.assertEqual(protocol.handler_tasks, set())
+
+
+class ServerAsyncDecodeTests(ServerAsyncTestCase):
+    def setUp(self):
+        ServerAsyncTestCase.setUp(self)
+        self.protocol = self.CreateProtocol(
+            lambda protocol, pkt, addr: self.requests.append(pkt))
+
+    def testDecode(self):
+        decoded = []
+        original = Packet.DecodePacket
+
+        def CountingDecode(pkt, *args, **kwargs):
+            decoded.append(pkt)
+            return original(pkt, *args, **kwargs)
+        Packet.DecodePacket = CountingDecode
+        try:
+            self.protocol.datagram_received(self.Request(7), self.addr)
+        finally:
+            Packet.DecodePacket = original
+        (pkt,) = self.requests
+        self.assertIs(type(pkt), AuthPacket)
+        self.assertEqual(decoded, [pkt])
+        self.assertEqual(pkt.id, 7)
+        self.assertEqual(pkt['Test-String'], ['user'])
+
+    def testShortPacket(self):
+        with self.assertLogs('pyrad', 'ERROR') as logs:
+            self.protocol.datagram_received(self.Request()[:19], self.addr)
+        self.assertIn('Packet header is corrupt', logs.output[0])
+        self.assertEqual(self.requests, [])
+
+    def testUnknownCode(self):
+        raw = bytes([99]) + self.Request()[1:]
+        with self.assertLogs('pyrad', 'ERROR') as logs:
+            self.protocol.datagram_received(raw, self.addr)
+        self.assertIn('non-auth packet', logs.output[0])
+        self.assertEqual(self.requests, [])
+
+    def testResponseCode(self):
+        raw = bytes([AccessAccept]) + self.Request()[1:]
+        with self.assertLogs('pyrad', 'ERROR') as logs:
+            self.protocol.datagram_received(raw, self.addr)
+        self.assertIn('Invalid response packet', logs.output[0])
+        self.assertEqual(self.requests, [])
+
+    def testCreateReplyPacketFromTemplate(self):
+        self.protocol.datagram_received(self.Request(7), self.addr)
+        template = PacketTemplate(AccessAccept, self.dict, Test_Integer=10)
+        reply = ServerAsync.CreateReplyPacket(self.requests[0],
+                                              template=template,
+                                              Test_String='reply')
+        self.assertEqual(reply.code, AccessAccept)
+        self.assertEqual(reply.id, 7)
+        self.assertEqual(reply.authenticator, self.requests[0].authenticator)
+        self.assertEqual(reply['Test-Integer'], [10])
+        self.assertEqual(reply['Test-String'], ['reply'])
+
+
+class RunWorkersTests(unittest.TestCase):
+    def setUp(self):
+        (self.read_end, self.write_end) = os.pipe()
+        self.pids = b''
+        self.supervisor = None
+
+    def tearDown(self):
+        if self.supervisor:
+            try:
+                os.kill(self.supervisor, signal.SIGKILL)
+                os.waitpid(self.supervisor, 0)
+            except (OSError, ChildProcessError):
+                pass
+        os.close(self.read_end)
+
+    def StartSupervisor(self, address, **kwargs):
+        server = Server(authport=0, acct_enabled=False)
+        server.addresses = [address]
+        pid = os.fork()
+        if pid:
+            os.close(self.write_end)
+            self.supervisor = pid
+            return
+        status = 1
+        try:
+            spawn = server._SpawnWorker
+
+            def ReportingSpawn(sigmask):
+                worker = spawn(sigmask)
+                os.write(self.write_end, b'%d\n' % worker)
+                return worker
+            server._SpawnWorker = ReportingSpawn
+            server.RunWorkers(2, **kwargs)
+            status = 0
+        finally:
+            os._exit(status)
+
+    def Workers(self, count, timeout=5):
+        """Return the process ids of the next count started workers."""
+        deadline = time.time() + timeout
+        while self.pids.count(b'\n') < count:
+            (ready, _, _) = select.select([self.read_end], [], [],
+                                          deadline - time.time())
+            if not ready:
+                self.fail('Workers were not started')
+            self.pids += os.read(self.read_end, 1024)
+        lines = self.pids.split(b'\n')
+        self.pids = b'\n'.join(lines[count:])
+        return [int(pid) for pid in lines[:count]]
+
+    def AssertReaped(self, pids, timeout=5):
+        deadline = time.time() + timeout
+        for pid in pids:
+            # Zombie processes still exist until they are reaped
+            while True:
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    break
+                if time.time() > deadline:
+                    self.fail('Worker %d was not reaped' % pid)
+                time.sleep(0.01)
+
+    def testRestartAndStop(self):
+        self.StartSupervisor('127.0.0.1')
+        first = self.Workers(2)
+        os.kill(self.supervisor, signal.SIGHUP)
+        second = self.Workers(2)
+        self.assertEqual(set(first) & set(second), set())
+        self.AssertReaped(first)
+        os.kill(self.supervisor, signal.SIGTERM)
+        (_, status) = os.waitpid(self.supervisor, 0)
+        self.supervisor = None
+        self.assertEqual(status, 0)
+        self.AssertReaped(second)
+
+    def testFailingWorkersRestartedWithDelay(self):
+        # Workers fail to bind to an address that is not local
+        self.StartSupervisor('192.0.2.1', restart_delay=0.5)
+        self.Workers(2)
+        time.sleep(1.2)
+        os.kill(self.supervisor, signal.SIGTERM)
+        os.waitpid(self.supervisor, 0)
+        self.supervisor = None
+        os.set_blocking(self.read_end, False)
+        try:
+            self.pids += os.read(self.read_end, 65536)
+        except BlockingIOError:
+            pass
+        restarts = self.pids.count(b'\n')
+        self.assertGreaterEqual(restarts, 2)
+        self.assertLessEqual(restarts, 8)
+
+
 if not hasattr(select, 'poll'):
     del SocketTests
     del ServerRunTests
+    del ServerStopTests
+    del BatchTests
+if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'):
+    del RunWorkersTests
+elif not hasattr(socket, 'SO_REUSEPORT'):
+    del SocketTests.testBindReusePort
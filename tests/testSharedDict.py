@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import home
+from pyrad.dictionary import Dictionary
+from pyrad.packet import AuthPacket
+from pyrad.packet import Packet
+from pyrad.shareddict import BuildSharedDictionary
+from pyrad.shareddict import SharedDictionary
+from pyrad.shareddict import WriteSharedDictionary
+
+
+class SharedDictionaryTests(unittest.TestCase):
+    def setUp(self):
+        self.dict = Dictionary(os.path.join(home, 'data', 'full'))
+        self.shared = SharedDictionary.FromDictionary(self.dict)
+
+    def testInvalidBuffer(self):
+        self.assertRaises(ValueError, SharedDictionary, b'\x00' * 64)
+
+    def testAttributes(self):
+        self.assertEqual(len(self.shared), len(self.dict))
+        self.assertEqual(sorted(self.shared.attributes),
+                         sorted(self.dict.attributes.keys()))
+        for (name, attr) in self.dict.attributes.items():
+            shared = self.shared[name]
+            self.assertEqual(shared.code, attr.code)
+            self.assertEqual(shared.type, attr.type)
+            self.assertEqual(shared.vendor, attr.vendor)
+            self.assertEqual(shared.encrypt, attr.encrypt)
+            self.assertEqual(shared.values.forward, attr.values.forward)
+
+    def testMissingAttribute(self):
+        self.assertFalse('Missing-Attribute' in self.shared)
+        self.assertRaises(KeyError, self.shared.__getitem__,
+                          'Missing-Attribute')
+        self.assertEqual(self.shared.attributes.get(1), None)
+
+    def testAttributeIsCached(self):
+        self.assertTrue(self.shared['Test-String'] is
+                        self.shared['Test-String'])
+
+    def testTlv(self):
+        tlv = self.shared['Simplon-Tlv']
+        self.assertEqual(self.shared['Simplon-Tlv-Str'].parent, tlv)
+        self.assertEqual(self.shared['Simplon-Tlv-Int'].parent, tlv)
+        self.assertEqual(tlv.sub_attributes,
+                         self.dict['Simplon-Tlv'].sub_attributes)
+
+    def testAttrIndex(self):
+        for (name, key) in self.dict.attrindex.forward.items():
+            self.assertEqual(self.shared.attrindex.GetForward(name), key)
+            self.assertEqual(self.shared.attrindex.GetBackward(key), name)
+        self.assertFalse(self.shared.attrindex.HasBackward(250))
+        self.assertFalse(self.shared.attrindex.HasBackward([1]))
+
+    def testPacket(self):
+        packets = []
+        for dictionary in (self.dict, self.shared):
+            pkt = AuthPacket(id=1, secret=b'secret', dict=dictionary,
+                             authenticator=b'0123456789ABCDEF')
+            pkt['Test-String'] = 'value'
+            pkt['Test-Integer'] = 10
+            pkt['Simplon-Number'] = 'Three'
+            pkt['Test-Encrypted-String'] = 'hidden'
+            raw = pkt.RequestPacket()
+            reply = Packet(packet=raw, secret=b'secret', dict=dictionary)
+            packets.append((sorted(reply.keys()),
+                            reply['Simplon-Number'],
+                            reply['Test-Encrypted-String']))
+        self.assertEqual(packets[0], packets[1])
+
+    def testFile(self):
+        path = tempfile.mkdtemp()
+        try:
+            name = os.path.join(path, 'dictionary.shared')
+            WriteSharedDictionary(self.dict, name)
+            shared = SharedDictionary.Open(name)
+            self.assertEqual(shared['Test-Integer'].code, 3)
+            with open(name, 'rb') as fd:
+                self.assertEqual(fd.read(), BuildSharedDictionary(self.dict))
+            shared.buffer.close()
+        finally:
+            shutil.rmtree(path)
@@ -1,5 +1,10 @@
 from ipaddress import AddressValueError
 from pyrad import tools
+from pyrad.bidict import BiDict
+from pyrad.datatypes import Evs, Extended, Tlv, Vsa
+from pyrad.dictionary import Attribute
+from pyrad.packet import Packet
+import struct
 import unittest
 
 
@@ -86,6 +91,30 @@ class EncodingTests(unittest.TestCase):
     def testUnknownTypeDecoding(self):
         self.assertRaises(ValueError, tools.DecodeAttr, 'unknown', None)
 
+    def testCompileCodec(self):
+        (encoder, decoder) = tools.CompileCodec('integer')
+        self.assertEqual(encoder(0x01020304), b'\x01\x02\x03\x04')
+        self.assertEqual(decoder(b'\x01\x02\x03\x04'), 0x01020304)
+
+    def testPackKey(self):
+        for key in (1, (16, 3), (4294967295, 255), '241.1'):
+            self.assertEqual(tools.UnpackKey(tools.PackKey(key)), key)
+        self.assertNotEqual(tools.PackKey((1, 1)), tools.PackKey('1.1'))
+        for key in ((429, 300), (1 << 32, 1), (16, -1), '241.256',
+                    '256.1'):
+            self.assertRaises(ValueError, tools.PackKey, key)
+
+    def testCompileCodecUnknownType(self):
+        self.assertRaises(ValueError, tools.CompileCodec, 'unknown')
+
+    def testComboIpEncoding(self):
+        self.assertEqual(
+                tools.EncodeAttr('combo-ip', '192.168.0.255'),
+                b'\xc0\xa8\x00\xff')
+        self.assertEqual(
+                tools.EncodeAttr('combo-ip', '2001:db8::1'),
+                b'\x20\x01\x0d\xb8' + 11 * b'\x00' + b'\x01')
+
     def testEncodeFunction(self):
         self.assertEqual(
                 tools.EncodeAttr('string', 'string'),
@@ -125,3 +154,71 @@ class EncodingTests(unittest.TestCase):
         self.assertEqual(
                 tools.DecodeAttr('date', b'\x01\x02\x03\x04'),
                 0x01020304)
+
+
+class StructuredTests(unittest.TestCase):
+    def setUp(self):
+        self.attrcodes = BiDict()
+        self.attrcodes.Add(1, 'integer')
+        self.attrcodes.Add(2, 'string')
+        self.attrcodes.Add(3, 'tlv')
+        self.attrcodes.Add('241.1', 'tlv')
+
+    def testSlots(self):
+        self.assertRaises(AttributeError, setattr, Tlv(1, 6, 5), 'other', 1)
+        self.assertEqual(Tlv(1, 6, 5), Tlv(1, 6, 5))
+        self.assertNotEqual(Tlv(1, 6, 5), Tlv(1, 6, 4))
+
+    def testHashable(self):
+        vsa = Vsa(26, 12, 16, [Tlv(1, 6, 5)])
+        self.assertEqual(hash(vsa), hash(Vsa(26, 12, 16, [Tlv(1, 6, 5)])))
+        self.assertEqual({vsa: 'value'}.get(Vsa(26, 12, 16, [Tlv(1, 6, 5)])),
+                         'value')
+        self.assertNotIn(Evs(16, 1, 5), {Evs(16, 1, 4): 'value'})
+
+    def testPacketEncode(self):
+        attr = Attribute('Test-Vsa', 26, 'vsa', attrcodes=self.attrcodes)
+        pkt = Packet(dict=None)
+        self.assertEqual(pkt._EncodeValue(attr, Vsa(26, 12, 16,
+                                                    [Tlv(1, 6, 5)])),
+                         b'\x1a\x0c' + struct.pack('I', 16) +
+                         b'\x01\x06\x00\x00\x00\x05')
+
+    def testTlvRoundTrip(self):
+        value = Tlv(3, 10, Tlv(3, 8, Tlv(1, 6, 5)))
+        encoded = tools.EncodeAttr('tlv', value, self.attrcodes)
+        self.assertEqual(encoded, b'\x03\x0a\x03\x08\x01\x06\x00\x00\x00\x05')
+        self.assertEqual(tools.DecodeAttr('tlv', encoded, self.attrcodes),
+                         value)
+
+    def testVsaSeveralAttributes(self):
+        encoded = (b'\x1a\x13' + struct.pack('I', 10415) +
+                   b'\x01\x06\x00\x00\x00\x05' + b'\x02\x07value')
+        self.assertEqual(tools.DecodeAttr('vsa', encoded, self.attrcodes),
+                         Vsa(26, 19, 10415, [Tlv(1, 6, 5),
+                                             Tlv(2, 7, 'value')]))
+
+    def testVsaInvalidLength(self):
+        encoded = b'\x1a\x0a' + struct.pack('I', 10415) + b'\x01\x00\x00\x00'
+        self.assertRaises(ValueError, tools.DecodeAttr, 'vsa', encoded,
+                          self.attrcodes)
+
+    def testExtended(self):
+        encoded = b'\xf1\x09\x01\x01\x06\x00\x00\x00\x05'
+        self.assertEqual(tools.DecodeAttr('extended', encoded, self.attrcodes),
+                         Extended(241, 9, 1, Tlv(1, 6, 5)))
+
+    def testEvs(self):
+        encoded = b'\x00\x00\x00\x10\x01\x00\x00\x00\x05'
+        self.assertEqual(tools.DecodeAttr('evs', encoded, self.attrcodes),
+                         Evs(16, 1, 5))
+
+    def testNestingLimit(self):
+        # MAX_NESTING + 1 levels of TLVs
+        encoded = b'\x01\x06\x00\x00\x00\x05'
+        for _ in range(tools.MAX_NESTING):
+            encoded = b'\x03' + bytes([len(encoded) + 2]) + encoded
+        self.assertRaises(ValueError, tools.DecodeAttr, 'tlv', encoded,
+                          self.attrcodes)
+        self.assertEqual(
+            tools.DecodeAttr('tlv', encoded[2:], self.attrcodes).datatype, 3)